@@ -95,7 +95,7 @@ DATABASES = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'main.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -111,6 +111,34 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Достижения проверяются отложенно: сигналы кладут события в AchievementEvent,
+# обработчик запускается командой `python manage.py process_achievement_events --loop`
+ACHIEVEMENT_QUEUE_ENABLED = True
+# Как часто (в секундах) перечитывать индекс правил достижений
+ACHIEVEMENT_RULES_TTL = 300
+# Как часто (в секундах) перечитывать настройки уровней (LevelConfiguration)
+LEVEL_CONFIGURATION_TTL = 300
+# Сколько секунд хранить сотрудника в кеше токенов авторизации (main/authentication.py)
+AUTH_TOKEN_CACHE_TTL = 60
+# Как часто (в секундах) записывать в базу накопленные last_login / last_activity (main/activity.py)
+ACTIVITY_FLUSH_INTERVAL = 30
+# Сколько секунд хранить группы и права сотрудника в кеше ролей (main/roles.py)
+ROLE_CACHE_TTL = 300
+# Как часто (в секундах) перечитывать конфигурацию (SystemSetting, KarmaSettings, множители, пороги сложности)
+CONFIG_CACHE_TTL = 300
+# Как часто (в секундах) перестраивать рейтинги сотрудников целиком (main/leaderboard.py)
+LEADERBOARD_TTL = 300
+# Сколько секунд хранить скомпилированный ключ ответов теста (main/answer_keys.py)
+ANSWER_KEY_TTL = 300
+# Сколько секунд хранить собранное содержимое теста - вопросы и теорию (main/test_content.py)
+TEST_CONTENT_TTL = 300
+# Как часто (в секундах) перечитывать каталог тем и тестов (main/test_catalog.py)
+TEST_CATALOG_TTL = 300
+# Как часто (в секундах) перечитывать снимок дерева классификаций (main/classification_tree.py)
+CLASSIFICATION_TREE_TTL = 300
+# Сколько секунд хранить сводную статистику (main/statistics.py); 0 - считать на каждый запрос
+STATISTICS_TTL = 60
+
 
 
 # Password validation
@@ -0,0 +1,420 @@
+"""
+Проверка достижений сотрудников.
+
+Сигналы из signals.py не проверяют достижения сами, а ставят событие в очередь
+AchievementEvent (см. enqueue_event). Команда process_achievement_events забирает
+события пачками, объединяет их по сотруднику и типу и вызывает функции evaluate_*.
+Если ACHIEVEMENT_QUEUE_ENABLED = False, события обрабатываются сразу, как раньше.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .achievement_rules import get_rule_index
+from .models import AchievementEvent, ComplexityThresholds, Employee, EmployeeAchievement, EmployeeStats, Feedback, \
+    Request, TestAttempt
+
+# Сколько раз повторять обработку события, завершившегося ошибкой
+MAX_EVENT_ATTEMPTS = 5
+
+
+def queue_enabled():
+    return getattr(settings, 'ACHIEVEMENT_QUEUE_ENABLED', True)
+
+
+def evaluate_shift_achievements(employee):
+    stats = EmployeeStats.for_employee(employee)
+
+    # Ключ условия -> значение счётчика
+    counters = {
+        'streak_days_required': stats.max_streak,  # Стрик дней без опозданий
+        'total_days_required': stats.days_without_late,  # Общее количество дней без опозданий
+        'total_worked_days_required': stats.worked_days,  # Общее количество отработанных дней
+    }
+
+    for achievement, conditions in get_rule_index().shift_rules:
+        for key, required in conditions:
+            value = counters[key]
+            employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+                employee=employee,
+                achievement=achievement
+            )
+            # Обновляем прогресс по условию
+            if value > employee_achievement.progress:
+                employee_achievement.progress = min(value, required)
+                if employee_achievement.progress >= required and not employee_achievement.date_awarded:
+                    employee_achievement.date_awarded = timezone.now()
+                employee_achievement.save()
+
+
+def evaluate_indicator_achievements(employee, change_type):
+    stats = None
+
+    # Из индекса берём только достижения типа "Indicators" с условиями на данный тип изменения
+    for achievement, required in get_rule_index().for_indicator(change_type):
+        # Значения берём из накопительных счётчиков, а не агрегируем логи заново
+        if stats is None:
+            stats = EmployeeStats.for_employee(employee)
+
+        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+            employee=employee,
+            achievement=achievement
+        )
+
+        for key, required_value in required:
+            if stats.counter(key) >= required_value and not employee_achievement.date_awarded:
+                employee_achievement.progress = required_value
+                employee_achievement.reward_employee()
+                employee_achievement.date_awarded = timezone.now()
+
+        employee_achievement.save()
+
+
+def evaluate_request_achievements(employee, request_numbers):
+    rule_index = get_rule_index()
+    if not rule_index.request_rules:
+        return
+
+    # Сколько новых обращений подходит под каждое достижение
+    thresholds = ComplexityThresholds.get_cached()
+    matched = Counter()
+    achievements = {}
+    requests = Request.objects.filter(number__in=request_numbers).select_related('classification')
+    for request in requests:
+        complexity = request.get_complexity(thresholds)
+        for achievement in rule_index.for_request(request.classification_id, complexity, request.is_massive):
+            matched[achievement.id] += 1
+            achievements[achievement.id] = achievement
+
+    for achievement_id, count in matched.items():
+        achievement = achievements[achievement_id]
+        required_requests_count = achievement.type_specific_data.get("required_requests_count")
+
+        employee_achievement, _ = EmployeeAchievement.objects.get_or_create(
+            employee=employee,
+            achievement=achievement
+        )
+
+        if required_requests_count:
+            current_progress = employee_achievement.progress + count
+            employee_achievement.progress = current_progress
+            employee_achievement.progress_percent = min(current_progress / required_requests_count, 1.0) * 100
+
+            # Проверяем, достигнут ли необходимый прогресс для награждения
+            if current_progress >= required_requests_count and not employee_achievement.date_awarded:
+                employee_achievement.reward_employee()
+                employee_achievement.date_awarded = timezone.now()
+
+            employee_achievement.save()
+
+
+def evaluate_test_passed_achievements(employee, attempt_ids):
+    rule_index = get_rule_index()
+    if not rule_index.test_rules:
+        return
+
+    attempts = TestAttempt.objects.filter(id__in=attempt_ids, status=TestAttempt.PASSED)
+    for attempt in attempts:
+        # Достижения, которые связаны с данным тестом
+        for achievement in rule_index.for_test(attempt.test_id):
+            required_score = achievement.type_specific_data.get("required_score", None)
+            if required_score is None or attempt.score >= required_score:
+                employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+                    employee=employee,
+                    achievement=achievement
+                )
+                # Если достижение только что создано или прогресс не завершён, обновляем прогресс
+                if created or employee_achievement.progress < 1:
+                    employee_achievement.progress = 1
+                    employee_achievement.reward_employee()
+                    employee_achievement.date_awarded = timezone.now()
+                    employee_achievement.save()
+
+
+def evaluate_test_count_achievements(employee):
+    test_achievements = get_rule_index().test_count_rules
+    if not test_achievements:
+        return
+
+    # Все счётчики попыток одним запросом
+    counts = TestAttempt.objects.filter(employee=employee).aggregate(
+        passed=Count('id', filter=Q(status=TestAttempt.PASSED)),
+        perfect=Count('id', filter=Q(score=F('test__max_score'))),
+        moderation=Count('id', filter=Q(status=TestAttempt.MODERATION)),
+    )
+    conditions = (
+        ('total_tests_required', counts['passed']),
+        ('successful_tests_required', counts['passed']),
+        ('perfect_score_tests_required', counts['perfect']),
+        ('moderation_tests_required', counts['moderation']),
+    )
+
+    for achievement in test_achievements:
+        type_data = achievement.type_specific_data
+
+        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+            employee=employee,
+            achievement=achievement
+        )
+
+        total_progress = 0
+        total_conditions = 0
+        fulfilled_conditions = 0
+        for key, completed in conditions:
+            required = type_data.get(key)
+            if required is None:
+                continue
+            total_progress += min(completed, required)
+            total_conditions += 1
+            if completed >= required:
+                fulfilled_conditions += 1
+
+        employee_achievement.progress = total_progress
+
+        # Если все указанные условия выполнены, фиксируем дату награждения и выдаем награду
+        if fulfilled_conditions == total_conditions and not employee_achievement.date_awarded:
+            employee_achievement.reward_employee()
+            employee_achievement.date_awarded = timezone.now()
+
+        employee_achievement.save()
+
+
+def evaluate_praise_achievements(employee):
+    praise_achievements = get_rule_index().praise_rules
+    if not praise_achievements:
+        return
+
+    praises = Feedback.objects.filter(target_employee=employee, type='praise', status='approved')
+    total_praises = None
+    praise_dates = None
+
+    for achievement in praise_achievements:
+        type_data = achievement.type_specific_data or {}
+        required_praises_total = type_data.get('required_praises_total', None)
+        required_days_in_a_row = type_data.get('required_days_in_a_row', None)
+
+        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+            employee=employee,
+            achievement=achievement
+        )
+
+        fulfilled_conditions = 0
+        total_conditions = 0
+
+        # 1. Проверка общего количества похвал
+        if required_praises_total is not None:
+            if total_praises is None:
+                total_praises = praises.count()
+            if total_praises >= required_praises_total:
+                fulfilled_conditions += 1
+            total_conditions += 1
+
+        # 2. Проверка на дни подряд с похвалами
+        if required_days_in_a_row is not None:
+            if praise_dates is None:
+                praise_dates = sorted(set(praises.values_list('created_at', flat=True)))
+            consecutive_days = 1
+            previous_date = None
+            for date in praise_dates:
+                if previous_date and (date - previous_date).days == 1:
+                    consecutive_days += 1
+                else:
+                    consecutive_days = 1
+                previous_date = date
+
+                if consecutive_days >= required_days_in_a_row:
+                    fulfilled_conditions += 1
+                    break
+            total_conditions += 1
+
+        if fulfilled_conditions == total_conditions and not employee_achievement.date_awarded:
+            employee_achievement.progress = 1
+            employee_achievement.reward_employee()
+            employee_achievement.date_awarded = timezone.now()
+
+        employee_achievement.save()
+
+
+def evaluate_level_achievements(employee):
+    level_achievements = get_rule_index().level_rules
+    if not level_achievements:
+        return
+
+    current_level = employee.level
+    current_exp = employee.experience
+    total_experience_earned_week = None
+
+    for achievement in level_achievements:
+        type_specific_data = achievement.type_specific_data or {}
+        required_level = type_specific_data.get("required_level")
+        exp_earned = type_specific_data.get("exp_earned")
+        exp_earned_week = type_specific_data.get("exp_earned_week")
+
+        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
+            employee=employee,
+            achievement=achievement
+        )
+
+        # Прогресс по каждому условию в процентах
+        progress_values = []
+
+        if required_level is not None:
+            progress_values.append(min(current_level / required_level, 1.0) * 100)
+            if current_level >= required_level:
+                employee_achievement.progress = required_level
+                if not employee_achievement.date_awarded:
+                    employee_achievement.reward_employee()
+                    employee_achievement.date_awarded = timezone.now()
+
+        if exp_earned is not None:
+            progress_values.append(min(current_exp / exp_earned, 1.0) * 100)
+            if current_exp >= exp_earned:
+                employee_achievement.progress = exp_earned
+                if not employee_achievement.date_awarded:
+                    employee_achievement.reward_employee()
+                    employee_achievement.date_awarded = timezone.now()
+
+        if exp_earned_week is not None:
+            if total_experience_earned_week is None:
+                total_experience_earned_week = EmployeeStats.for_employee(employee).counter('experience_earned_week')
+            progress_values.append(min(total_experience_earned_week / exp_earned_week, 1.0) * 100)
+            if total_experience_earned_week >= exp_earned_week:
+                employee_achievement.progress = exp_earned_week
+                if not employee_achievement.date_awarded:
+                    employee_achievement.reward_employee()
+                    employee_achievement.date_awarded = timezone.now()
+
+        # Общий прогресс равен минимальному из всех условий
+        if progress_values:
+            employee_achievement.progress_percent = min(progress_values)
+
+        employee_achievement.save()
+
+
+def has_rules_for(event_type):
+    """Нет смысла ставить событие в очередь, если ни одно правило на него не реагирует."""
+    rule_index = get_rule_index()
+    return bool({
+        AchievementEvent.SHIFT: rule_index.shift_rules,
+        AchievementEvent.KARMA: rule_index.for_indicator('karma'),
+        AchievementEvent.ACOINS: rule_index.for_indicator('acoins'),
+        AchievementEvent.LEVEL: rule_index.level_rules,
+        AchievementEvent.REQUEST: rule_index.request_rules,
+        AchievementEvent.TEST_PASSED: rule_index.test_rules,
+        AchievementEvent.TEST_ATTEMPT: rule_index.test_count_rules,
+        AchievementEvent.PRAISE: rule_index.praise_rules,
+    }.get(event_type))
+
+
+def run_events(employee, events, refresh=False):
+    """
+    Проверяет достижения сотрудника по списку событий [(event_type, object_id)].
+    Однотипные события объединяются: счётчики проверяются один раз,
+    а события с объектами (обращения, попытки) обрабатываются одним запросом.
+    """
+    objects_by_type = defaultdict(list)
+    for event_type, object_id in events:
+        objects_by_type[event_type].append(object_id)
+
+    if AchievementEvent.REQUEST in objects_by_type:
+        evaluate_request_achievements(employee, objects_by_type[AchievementEvent.REQUEST])
+    if AchievementEvent.TEST_PASSED in objects_by_type:
+        evaluate_test_passed_achievements(employee, objects_by_type[AchievementEvent.TEST_PASSED])
+    if AchievementEvent.TEST_ATTEMPT in objects_by_type:
+        evaluate_test_count_achievements(employee)
+    if AchievementEvent.SHIFT in objects_by_type:
+        evaluate_shift_achievements(employee)
+    if AchievementEvent.KARMA in objects_by_type:
+        evaluate_indicator_achievements(employee, 'karma')
+    if AchievementEvent.ACOINS in objects_by_type:
+        evaluate_indicator_achievements(employee, 'acoins')
+    if AchievementEvent.PRAISE in objects_by_type:
+        evaluate_praise_achievements(employee)
+    if AchievementEvent.LEVEL in objects_by_type:
+        # Уровень проверяем последним: награды за другие достижения могли его изменить
+        if refresh:
+            employee.refresh_from_db()
+        evaluate_level_achievements(employee)
+
+
+def enqueue_event(employee, event_type, object_id=None):
+    """Ставит событие в очередь или, если очередь выключена, сразу проверяет достижения."""
+    if not has_rules_for(event_type):
+        return
+    if not queue_enabled():
+        run_events(employee, [(event_type, object_id)])
+        return
+    AchievementEvent.objects.create(
+        employee=employee,
+        event_type=event_type,
+        object_id=None if object_id is None else str(object_id),
+    )
+
+
+def enqueue_events(events):
+    """Пакетная постановка в очередь для массового импорта: events = [(employee, event_type, object_id)]."""
+    events = [event for event in events if has_rules_for(event[1])]
+    if not events:
+        return
+    if not queue_enabled():
+        grouped = defaultdict(list)
+        employees = {}
+        for employee, event_type, object_id in events:
+            grouped[employee.pk].append((event_type, object_id))
+            employees[employee.pk] = employee
+        for employee_id, employee_events in grouped.items():
+            run_events(employees[employee_id], employee_events)
+        return
+    AchievementEvent.objects.bulk_create([
+        AchievementEvent(
+            employee=employee,
+            event_type=event_type,
+            object_id=None if object_id is None else str(object_id),
+        )
+        for employee, event_type, object_id in events
+    ], batch_size=1000)
+
+
+def process_pending_events(batch_size=500):
+    """
+    Обрабатывает одну пачку событий из очереди. Возвращает количество взятых из очереди событий.
+    Ошибка у одного сотрудника не мешает обработке остальных: его события остаются в очереди
+    и повторяются до MAX_EVENT_ATTEMPTS раз.
+    """
+    with transaction.atomic():
+        events = list(
+            AchievementEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, attempts__lt=MAX_EVENT_ATTEMPTS)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        events_by_employee = defaultdict(list)
+        for event in events:
+            events_by_employee[event.employee_id].append(event)
+        employees = Employee.objects.in_bulk(list(events_by_employee))
+
+        processed_ids = []
+        for employee_id, employee_events in events_by_employee.items():
+            employee = employees.get(employee_id)
+            try:
+                with transaction.atomic():
+                    if employee is not None:
+                        run_events(
+                            employee,
+                            [(event.event_type, event.object_id) for event in employee_events],
+                            refresh=True,
+                        )
+                processed_ids.extend(event.id for event in employee_events)
+            except Exception as e:
+                print(f"Ошибка при проверке достижений сотрудника {employee_id}: {e}")
+                AchievementEvent.objects.filter(id__in=[event.id for event in employee_events]).update(
+                    attempts=F('attempts') + 1, last_error=str(e)
+                )
+
+        AchievementEvent.objects.filter(id__in=processed_ids).update(processed_at=timezone.now())
+    return len(events)
@@ -0,0 +1,116 @@
+"""
+Скомпилированный индекс правил достижений.
+
+Вместо того чтобы на каждое событие загружать все достижения нужного типа и
+перебирать их type_specific_data, обработчики сигналов берут из индекса только
+те правила, которые могут сработать на данное событие. Индекс перестраивается
+при изменении или удалении Achievement (см. signals.py), а также по истечении
+ACHIEVEMENT_RULES_TTL секунд на случай изменений из другого процесса.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Achievement
+
+# Ключи условий для достижений типа "Тест" (type=5), зависящих от количества попыток
+TEST_COUNT_KEYS = (
+    'total_tests_required',
+    'successful_tests_required',
+    'perfect_score_tests_required',
+    'moderation_tests_required',
+)
+
+# Ключи условий для достижений типа "Indicators" (type=6) по типу изменения в EmployeeLog
+INDICATOR_KEYS = {
+    'karma': ('karma_earned', 'karma_earned_day', 'karma_earned_week', 'karma_earned_month'),
+    'acoins': ('acoins_earned', 'acoins_earned_day', 'acoins_earned_week', 'acoins_earned_month'),
+}
+
+# Ключи условий для достижений типа "Смены" (type=4)
+SHIFT_KEYS = ('streak_days_required', 'total_days_required', 'total_worked_days_required')
+
+
+def _hashable(value):
+    # Значения из JSON могут оказаться списками, ключ словаря должен быть хешируемым
+    return tuple(value) if isinstance(value, list) else value
+
+
+class AchievementRuleIndex:
+    def __init__(self, achievements):
+        # (classification_id, required_complexity, is_massive) -> [достижения]
+        self.request_rules = defaultdict(list)
+        # test_id -> [достижения за прохождение конкретного теста]
+        self.test_rules = defaultdict(list)
+        # Достижения за количество тестов
+        self.test_count_rules = []
+        # change_type -> [(достижение, [(ключ, требуемое значение)])]
+        self.indicator_rules = defaultdict(list)
+        # [(достижение, [(ключ, требуемое значение)])]
+        self.shift_rules = []
+        self.level_rules = []
+        self.praise_rules = []
+
+        for achievement in achievements:
+            data = achievement.type_specific_data or {}
+            if not isinstance(data, dict):
+                continue
+
+            if achievement.type == 1:
+                key_tail = (_hashable(data.get('required_complexity')), _hashable(data.get('is_massive', False)))
+                for classification_id in data.get('classification_ids') or []:
+                    self.request_rules[(_hashable(classification_id),) + key_tail].append(achievement)
+            elif achievement.type == 3:
+                self.level_rules.append(achievement)
+            elif achievement.type == 4:
+                required = [(key, data[key]) for key in SHIFT_KEYS if key in data]
+                if required:
+                    self.shift_rules.append((achievement, required))
+            elif achievement.type == 5:
+                if 'test_id' in data:
+                    self.test_rules[_hashable(data['test_id'])].append(achievement)
+                if any(key in data for key in TEST_COUNT_KEYS):
+                    self.test_count_rules.append(achievement)
+            elif achievement.type == 6:
+                for change_type, keys in INDICATOR_KEYS.items():
+                    required = [(key, data[key]) for key in keys if key in data]
+                    if required:
+                        self.indicator_rules[change_type].append((achievement, required))
+            elif achievement.type == 7:
+                self.praise_rules.append(achievement)
+
+    def for_request(self, classification_id, complexity, is_massive):
+        return self.request_rules.get((classification_id, complexity, is_massive), [])
+
+    def for_test(self, test_id):
+        return self.test_rules.get(test_id, [])
+
+    def for_indicator(self, change_type):
+        return self.indicator_rules.get(change_type, [])
+
+
+_index = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_rule_index():
+    """Возвращает актуальный индекс правил, при необходимости перестраивая его одним запросом."""
+    global _index, _built_at
+    ttl = getattr(settings, 'ACHIEVEMENT_RULES_TTL', 300)
+    index = _index
+    if index is not None and time.monotonic() - _built_at < ttl:
+        return index
+    with _lock:
+        if _index is None or time.monotonic() - _built_at >= ttl:
+            _index = AchievementRuleIndex(Achievement.objects.all())
+            _built_at = time.monotonic()
+        return _index
+
+
+def invalidate_rule_index():
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,74 @@
+"""
+Отложенная запись активности сотрудников (last_login / last_activity).
+
+Вместо UPDATE строки сотрудника на каждый запрос время последнего обращения
+запоминается в памяти процесса и раз в ACTIVITY_FLUSH_INTERVAL секунд
+записывается одним UPDATE ... CASE для всех накопившихся сотрудников.
+Незаписанные значения учитываются в get_active_users (см. views.py).
+"""
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import Employee
+
+FLUSH_CHUNK_SIZE = 500
+
+# id сотрудника -> время последнего запроса, ещё не записанное в базу
+_pending = {}
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+
+
+def record_activity(employee_id, when=None):
+    """Запоминает активность сотрудника; при необходимости записывает накопленное в базу."""
+    global _last_flush
+    when = when or timezone.now()
+    with _lock:
+        previous = _pending.get(employee_id)
+        if previous is None or previous < when:
+            _pending[employee_id] = when
+        due = time.monotonic() - _last_flush >= getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 30)
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush_activity()
+
+
+def pending_activity():
+    """Незаписанные отметки активности: id сотрудника -> время."""
+    with _lock:
+        return dict(_pending)
+
+
+def flush_activity():
+    """Записывает накопленные отметки активности пачками по FLUSH_CHUNK_SIZE сотрудников."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    items = list(pending.items())
+    try:
+        for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+            chunk = items[start:start + FLUSH_CHUNK_SIZE]
+            timestamp = Case(
+                *[When(pk=employee_id, then=Value(when)) for employee_id, when in chunk],
+                output_field=DateTimeField(),
+            )
+            Employee.objects.filter(pk__in=[employee_id for employee_id, _ in chunk]).update(
+                last_login=timestamp, last_activity=timestamp
+            )
+    except Exception as e:
+        print(f"Ошибка при записи активности сотрудников: {e}")
+        # Возвращаем незаписанные отметки, не затирая более свежие
+        with _lock:
+            for employee_id, when in pending.items():
+                if employee_id not in _pending or _pending[employee_id] < when:
+                    _pending[employee_id] = when
+    return len(items)
+
+
+atexit.register(flush_activity)
@@ -17,6 +17,10 @@ admin.site.register(PasswordPolicy)
 admin.site.register(EmployeeActionLog)
 admin.site.register(Item)
 admin.site.register(ShiftHistory)
+admin.site.register(EmployeeStats)
+admin.site.register(AchievementEvent)
+admin.site.register(EarningBucket)
+admin.site.register(AttemptAnswer)
 admin.site.register(Template)
 admin.site.register(ComplexityThresholds)
 admin.site.register(Background)
@@ -0,0 +1,156 @@
+"""
+Скомпилированные ключи ответов для проверки тестов (CompleteTestView).
+
+Для каждого теста один раз загружаются вопросы и варианты ответов, а
+правильные варианты сворачиваются в битовую маску (бит i - вариант i + 1).
+Проверка попытки - один проход по ответам без запросов к базе.
+Ключ сбрасывается при изменении вопросов и вариантов ответов (см. signals.py)
+и по истечении ANSWER_KEY_TTL секунд на случай изменений из другого процесса.
+"""
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+from .models import AnswerOption, TestQuestion
+
+SCORE_PRECISION = Decimal('0.1')
+ZERO = Decimal('0.0')
+
+# options - кортеж (текст варианта, правильный ли вариант) в порядке номеров
+CompiledQuestion = namedtuple('CompiledQuestion', [
+    'id', 'text', 'type', 'points', 'explanation', 'options', 'correct_mask', 'correct_count',
+])
+
+
+class AnswerKey:
+    """Неизменяемый ключ ответов теста: вопросы в порядке их номеров в попытке."""
+
+    def __init__(self, test_id, questions):
+        self.test_id = test_id
+        self.questions = tuple(questions)
+        self.max_score = sum((question.points for question in self.questions), ZERO)
+        self.has_text_questions = any(question.type == TestQuestion.TEXT for question in self.questions)
+
+    @classmethod
+    def compile(cls, test_id):
+        # Порядок вопросов и вариантов - как у filter() и answer_options.all() без сортировки (по id)
+        options = {}
+        for question_id, option_text, is_correct in AnswerOption.objects.filter(
+                question__test_id=test_id).order_by('pk').values_list('question_id', 'option_text', 'is_correct'):
+            options.setdefault(question_id, []).append((option_text, is_correct))
+
+        questions = []
+        for question in TestQuestion.objects.filter(test_id=test_id).order_by('pk').only(
+                'id', 'question_text', 'question_type', 'points', 'explanation'):
+            question_options = tuple(options.get(question.id, ()))
+            correct_mask = 0
+            for index, (_, is_correct) in enumerate(question_options):
+                if is_correct:
+                    correct_mask |= 1 << index
+            questions.append(CompiledQuestion(
+                id=question.id,
+                text=question.question_text,
+                type=question.question_type,
+                points=Decimal(str(question.points)),
+                explanation=question.explanation,
+                options=question_options,
+                correct_mask=correct_mask,
+                correct_count=bin(correct_mask).count('1'),
+            ))
+        return cls(test_id, questions)
+
+    def grade(self, submitted):
+        """
+        Проверяет ответы попытки (номер вопроса -> ответ, ключи - строки).
+        Возвращает (набранные баллы, answers_info, id вопросов в порядке answers_info).
+        """
+        total_score = ZERO
+        answers_info = []
+        answered_question_ids = []
+
+        for question_number, question in enumerate(self.questions, start=1):
+            answer_key = str(question_number)
+            if answer_key not in submitted:
+                continue
+            submitted_answer = submitted[answer_key]
+            is_correct = False
+            selected = None
+
+            if question.type == TestQuestion.SINGLE:
+                selected_number = int(submitted_answer)
+                is_correct = question.options[selected_number - 1][1]
+                question_score = question.points if is_correct else ZERO
+                total_score += question_score
+                selected = (selected_number,)
+            elif question.type == TestQuestion.TEXT:
+                question_score = ZERO
+            elif question.type == TestQuestion.MULTIPLE:
+                if isinstance(submitted_answer, int):
+                    submitted_answer = [submitted_answer]
+                selected = tuple(int(answer) for answer in submitted_answer)
+                selected_correct = sum(
+                    1 for number in selected if number >= 1 and question.correct_mask >> (number - 1) & 1
+                )
+                selected_incorrect = len(selected) - selected_correct
+
+                weight = question.points / Decimal(question.correct_count)
+                question_score = max(selected_correct * weight - selected_incorrect * weight, ZERO)
+                is_correct = selected_correct == question.correct_count and selected_incorrect == 0
+                total_score += question_score
+
+            question_score = question_score.quantize(SCORE_PRECISION, rounding=ROUND_HALF_UP)
+
+            answer_info = {
+                "question_text": question.text,
+                "type": question.type,
+                "is_correct": is_correct,
+                "question_score": float(question_score),
+                "answer_options": [],
+                "explanation": question.explanation
+            }
+            if question.type == TestQuestion.TEXT:
+                answer_info['text_answer'] = submitted_answer
+                answer_info['max_question_score'] = float(question.points)
+            else:
+                answer_info["answer_options"] = [
+                    {
+                        "option_number": option_number,
+                        "option_text": option_text,
+                        "submitted_answer": option_number in selected,
+                        "correct_options": option_is_correct
+                    }
+                    for option_number, (option_text, option_is_correct) in enumerate(question.options, start=1)
+                ]
+            answers_info.append(answer_info)
+            answered_question_ids.append(question.id)
+
+        return total_score.quantize(SCORE_PRECISION, rounding=ROUND_HALF_UP), answers_info, answered_question_ids
+
+
+# id теста -> (ключ, время компиляции)
+_keys = {}
+_lock = threading.Lock()
+
+
+def get_answer_key(test_id):
+    ttl = getattr(settings, 'ANSWER_KEY_TTL', 300)
+    entry = _keys.get(test_id)
+    if entry is not None and time.monotonic() - entry[1] < ttl:
+        return entry[0]
+    answer_key = AnswerKey.compile(test_id)
+    with _lock:
+        _keys[test_id] = (answer_key, time.monotonic())
+    return answer_key
+
+
+def invalidate_answer_key(test_id):
+    with _lock:
+        _keys.pop(test_id, None)
+
+
+def clear_answer_keys():
+    with _lock:
+        _keys.clear()
@@ -0,0 +1,108 @@
+"""
+Запись журнала действий (EmployeeActionLog) для log_model_save / log_model_delete.
+
+Старое состояние объекта берётся из снимка, сделанного при загрузке экземпляра
+(post_init), поэтому для сравнения изменений не нужен дополнительный SELECT.
+Внутри транзакции записи журнала копятся в буфере своей точки сохранения и
+вставляются bulk_create после фиксации транзакции (transaction.on_commit).
+"""
+import copy
+
+from django.db import transaction
+
+from .models import Employee, EmployeeActionLog
+
+# От имени этого сотрудника журналируются изменения классификаций, у которых нет автора
+IMPORT_AUTHOR_USERNAME = 'oleg'
+
+# (сотрудник или None,) - кешируется и отсутствие сотрудника
+_import_author = None
+
+
+def take_snapshot(instance):
+    """Значения редактируемых полей экземпляра (как в model_to_dict, но без ManyToMany и запросов)."""
+    snapshot = {}
+    for field in instance._meta.concrete_fields:
+        if not field.editable or field.attname not in instance.__dict__:
+            continue
+        value = field.value_from_object(instance)
+        # JSON-поля могут изменяться на месте, поэтому храним копию
+        if isinstance(value, (dict, list)):
+            value = copy.deepcopy(value)
+        snapshot[field.name] = value
+    return snapshot
+
+
+def remember_snapshot(sender, instance, **kwargs):
+    instance._audit_snapshot = take_snapshot(instance)
+
+
+class AuditBuffer:
+    """
+    Записи журнала одной точки сохранения (или внешней транзакции). Обработчик
+    flush регистрируется в on_commit внутри этой точки сохранения, поэтому при её
+    откате Django убирает его вместе с записями буфера.
+    """
+
+    def __init__(self, connection, key):
+        self.connection = connection
+        self.key = key
+        self.entries = []
+        self.scheduled = True
+        # Откат транзакции или точки сохранения заменяет список run_on_commit новым
+        self.hooks = connection.run_on_commit
+
+    def is_scheduled(self):
+        return self.scheduled and self.hooks is self.connection.run_on_commit
+
+    def flush(self):
+        self.scheduled = False
+        entries, self.entries = self.entries, []
+        buffers = getattr(self.connection, 'audit_buffers', {})
+        if buffers.get(self.key) is self:
+            del buffers[self.key]
+        if entries:
+            EmployeeActionLog.objects.bulk_create(entries, batch_size=500)
+
+
+def write_action_log(**fields):
+    """
+    Добавляет запись в журнал действий. Вне транзакции запись сохраняется сразу,
+    внутри транзакции - вместе с остальными записями той же точки сохранения
+    после фиксации транзакции; при откате точки сохранения записи отбрасываются.
+    """
+    entry = EmployeeActionLog(**fields)
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        entry.save()
+        return
+
+    buffers = getattr(connection, 'audit_buffers', None)
+    if buffers is None:
+        buffers = connection.audit_buffers = {}
+    key = tuple(connection.savepoint_ids)
+    buffer = buffers.get(key)
+    if buffer is None or not buffer.is_scheduled():
+        buffer = buffers[key] = AuditBuffer(connection, key)
+        transaction.on_commit(buffer.flush)
+    buffer.entries.append(entry)
+
+
+def get_import_author():
+    """Сотрудник IMPORT_AUTHOR_USERNAME или None; ищется один раз до invalidate_import_author."""
+    global _import_author
+    cached = _import_author
+    if cached is None:
+        cached = _import_author = (Employee.objects.filter(username=IMPORT_AUTHOR_USERNAME).first(),)
+    return cached[0]
+
+
+def is_import_author(employee):
+    cached = _import_author
+    return employee.username == IMPORT_AUTHOR_USERNAME or (
+        cached is not None and cached[0] is not None and cached[0].pk == employee.pk)
+
+
+def invalidate_import_author():
+    global _import_author
+    _import_author = None
@@ -0,0 +1,99 @@
+"""
+Кеш токенов авторизации: ключ токена -> сотрудник.
+
+EmployeeMiddleware, CachedTokenAuthentication (DRF) и EmployeeAPIView берут
+сотрудника отсюда, поэтому обычный авторизованный запрос не делает запросов
+к Token и Employee. В кеше хранятся только поля, нужные для авторизации
+(CACHED_FIELDS); на каждый запрос собирается новый экземпляр, остальные поля
+которого отложены и загружаются из базы одним запросом при первом обращении
+(см. Employee.refresh_from_db). Поэтому опыт, карма, уровень и прочие данные,
+изменённые другим процессом или через .update(), не берутся из кеша и не
+затираются при сохранении сотрудника. Запись удаляется при удалении токена и при сохранении или удалении сотрудника
+(см. signals.py), а также по истечении AUTH_TOKEN_CACHE_TTL секунд на случай
+изменений из другого процесса.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import Employee
+
+# Поля сотрудника, которые хранятся в кеше
+CACHED_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+# ключ токена -> (id сотрудника, значения CACHED_FIELDS, дата создания токена, время кеширования)
+_tokens = {}
+# id сотрудника -> ключи его токенов в кеше
+_keys_by_user = {}
+_lock = threading.Lock()
+
+
+def _cached_fields():
+    # from_db ожидает значения в порядке полей модели
+    return [field.attname for field in Employee._meta.concrete_fields if field.attname in CACHED_FIELDS]
+
+
+def _load(key):
+    token = Token.objects.select_related('user').get(key=key)
+    user = token.user
+    values = tuple(getattr(user, attname) for attname in _cached_fields())
+    with _lock:
+        _tokens[key] = (user.pk, values, token.created, time.monotonic())
+        _keys_by_user.setdefault(user.pk, set()).add(key)
+    return user, token
+
+
+def get_token_user(key):
+    """
+    Возвращает (сотрудник, токен) по ключу токена.
+    Если токен не найден, выбрасывает Token.DoesNotExist.
+    """
+    ttl = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60)
+    entry = _tokens.get(key)
+    if entry is None or time.monotonic() - entry[3] >= ttl:
+        return _load(key)
+
+    user_id, values, created, _ = entry
+    user = Employee.from_db(Employee.objects.db, _cached_fields(), values)
+    token = Token.from_db(Token.objects.db, ['key', 'user_id', 'created'], [key, user_id, created])
+    token.user = user
+    return user, token
+
+
+def invalidate_token(key):
+    with _lock:
+        entry = _tokens.pop(key, None)
+        if entry is not None:
+            _keys_by_user.get(entry[0], set()).discard(key)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        for key in _keys_by_user.pop(user_id, ()):
+            _tokens.pop(key, None)
+
+
+def clear_token_cache():
+    with _lock:
+        _tokens.clear()
+        _keys_by_user.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, берущий токен и сотрудника из кеша."""
+
+    def authenticate_credentials(self, key):
+        try:
+            user, token = get_token_user(key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (user, token)
@@ -0,0 +1,302 @@
+"""
+Снимок дерева классификаций для ClassificationsViewSet и импорта обращений.
+
+Все классификации загружаются одним запросом. Поверх них строятся списки
+детей, листья и префиксное дерево по названиям уровней, поэтому поиск
+"A->B->C" при импорте обращений идёт без запросов к базе. Новые
+классификации добавляются в снимок на месте; изменение или удаление
+существующих сбрасывает снимок (см. Classifications.save и signals.py).
+Снимок также пересобирается по истечении CLASSIFICATION_TREE_TTL секунд.
+
+upsert_classification_paths создаёт недостающие узлы для набора путей пачками
+по уровням (bulk_create), минуя Classifications.save и сигналы, и пишет одну
+общую запись в журнал действий. Так как снимок может отставать от базы, найденные
+в нём узлы и недостающие узлы каждого уровня сверяются с базой.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .audit import get_import_author, write_action_log
+from .models import Classifications, ComplexityThresholds
+
+
+class TrieNode:
+    """Узел префиксного дерева: классификация и дети по названию (у корня classification = None)."""
+    __slots__ = ('classification', 'children')
+
+    def __init__(self, classification=None):
+        self.classification = classification
+        self.children = {}
+
+
+class ClassificationTree:
+    def __init__(self, classifications=None):
+        if classifications is None:
+            classifications = Classifications.objects.order_by('pk').only(
+                'id', 'name', 'parent_id', 'experience_points', 'complexity', 'path', 'depth', 'full_name',
+            )
+        self.root = TrieNode()
+        self.nodes = {}
+        for classification in classifications:
+            self.nodes[classification.pk] = TrieNode(classification)
+        for node in self.nodes.values():
+            self._parent_node(node.classification).children[node.classification.name] = node
+        # Полные имена строк, ещё не заполненных rebuild_classification_tree, восстанавливаем в памяти
+        for node in self.nodes.values():
+            self._fill_full_name(node.classification)
+
+    def _fill_full_name(self, classification):
+        if not classification.full_name:
+            parent_node = self.nodes.get(classification.parent_id)
+            if parent_node is None:
+                classification.full_name = classification.name
+            else:
+                self._fill_full_name(parent_node.classification)
+                classification.full_name = (
+                    f"{parent_node.classification.full_name}{Classifications.NAME_SEPARATOR}{classification.name}"
+                )
+
+    def _parent_node(self, classification):
+        if classification.parent_id is None:
+            return self.root
+        # Родитель, которого нет в снимке, считаем корнем, чтобы узел не потерялся
+        return self.nodes.get(classification.parent_id, self.root)
+
+    def add(self, classification):
+        """Добавляет новую классификацию; если узел с таким именем и родителем уже есть, возвращает его."""
+        parent_node = self._parent_node(classification)
+        node = parent_node.children.get(classification.name)
+        if node is None:
+            node = TrieNode(classification)
+            parent_node.children[classification.name] = node
+            self.nodes[classification.pk] = node
+        return node
+
+    def resolve(self, names):
+        """
+        Ищет путь из названий уровней. Возвращает (узел самого глубокого найденного
+        уровня, количество найденных уровней); если не найден ни один - (корень, 0).
+        """
+        node = self.root
+        for found, name in enumerate(names):
+            child = node.children.get(name)
+            if child is None:
+                return node, found
+            node = child
+        return node, len(names)
+
+    def roots(self):
+        return sorted((node.classification for node in self.root.children.values()), key=lambda c: c.pk)
+
+    def leaves(self):
+        return sorted((node.classification for node in self.nodes.values() if not node.children),
+                      key=lambda c: c.pk)
+
+    @staticmethod
+    def serialize(classification):
+        """Тот же словарь, что у ClassificationsSerializer."""
+        return {
+            'id': classification.pk,
+            'name': classification.name,
+            'experience_points': classification.experience_points,
+            'parent': classification.parent_id,
+            'parentName': classification.parent_full_name,
+        }
+
+
+_tree = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_classification_tree():
+    global _tree, _built_at
+    ttl = getattr(settings, 'CLASSIFICATION_TREE_TTL', 300)
+    tree = _tree
+    if tree is not None and time.monotonic() - _built_at < ttl:
+        return tree
+    with _lock:
+        if _tree is None or time.monotonic() - _built_at >= ttl:
+            _tree = ClassificationTree()
+            _built_at = time.monotonic()
+        return _tree
+
+
+def classification_saved(classification, created):
+    """Новую классификацию добавляет в снимок, при изменении существующей сбрасывает снимок."""
+    with _lock:
+        if _tree is None:
+            return
+        if created:
+            _tree.add(classification)
+        else:
+            _invalidate()
+
+
+def _invalidate():
+    global _tree
+    _tree = None
+
+
+def invalidate_classification_tree():
+    with _lock:
+        _invalidate()
+
+
+def split_path(path):
+    return tuple(level.strip() for level in path.split(Classifications.NAME_SEPARATOR))
+
+
+def _fetch_created(new_objects):
+    """Проставляет id созданным узлам, если база не вернула их из bulk_create (MySQL)."""
+    parent_ids = {obj.parent_id for obj in new_objects}
+    names = {obj.name for obj in new_objects}
+    condition = Q(parent_id__in=parent_ids - {None})
+    if None in parent_ids:
+        condition |= Q(parent__isnull=True)
+    pks = {
+        (parent_id, name): pk
+        for pk, parent_id, name in Classifications.objects.filter(condition, name__in=names)
+        .values_list('pk', 'parent_id', 'name')
+    }
+    for obj in new_objects:
+        obj.pk = pks[(obj.parent_id, obj.name)]
+
+
+def _existing_children(missing):
+    """
+    Узлы из missing (префикс -> несохранённая классификация), которые уже есть в базе -
+    например, созданы другим процессом после сборки снимка. Один запрос на уровень.
+    """
+    parent_ids = {obj.parent_id for obj in missing.values()}
+    condition = Q(parent_id__in=parent_ids - {None})
+    if None in parent_ids:
+        condition |= Q(parent__isnull=True)
+    existing = {
+        (obj.parent_id, obj.name): obj
+        for obj in Classifications.objects.filter(condition, name__in={obj.name for obj in missing.values()})
+    }
+    return {prefix: existing[(obj.parent_id, obj.name)] for prefix, obj in missing.items()
+            if (obj.parent_id, obj.name) in existing}
+
+
+def _resolve(tree, all_levels):
+    """
+    Ищет пути в снимке и проверяет одним запросом, что найденные узлы ещё есть в базе.
+    Если какой-то узел удалён другим процессом, снимок пересобирается.
+    """
+    resolved = {levels: tree.resolve(levels) for levels in all_levels}
+    pks = {node.classification.pk for node, found in resolved.values() if found}
+    if pks and Classifications.objects.filter(pk__in=pks).count() != len(pks):
+        invalidate_classification_tree()
+        tree = get_classification_tree()
+        resolved = {levels: tree.resolve(levels) for levels in all_levels}
+    return tree, resolved
+
+
+def upsert_classification_paths(paths, employee=None):
+    """
+    Находит или создаёт классификации для путей "A->B->C".
+    Недостающие узлы создаются одним bulk_create на уровень дерева со сложностью,
+    посчитанной в памяти; перед созданием узлы уровня сверяются с базой, так как
+    снимок мог устареть. В журнал пишется одна запись от имени employee (по
+    умолчанию - сотрудник импорта). Возвращает словарь путь -> классификация.
+    При ошибке снимок сбрасывается, чтобы повторная попытка начиналась с базы.
+    """
+    levels_by_path = {path: split_path(path) for path in paths}
+    all_levels = set(levels_by_path.values())
+    if not all_levels:
+        return {}
+
+    try:
+        tree, resolved = _resolve(get_classification_tree(), all_levels)
+        if all(found == len(levels) for levels, (_, found) in resolved.items()):
+            return {path: resolved[levels][0].classification for path, levels in levels_by_path.items()}
+        nodes, created, stale = _create_missing(tree, all_levels, employee)
+    except Exception:
+        invalidate_classification_tree()
+        raise
+
+    if created or stale:
+        def update_snapshot():
+            with _lock:
+                if _tree is not tree:
+                    return
+                if stale:
+                    # Узлы, созданные другим процессом, есть в базе, но не в снимке
+                    _invalidate()
+                    return
+                # Родители создаются раньше детей, поэтому добавляем в порядке создания
+                for obj in created:
+                    tree.add(obj)
+        # Вне внешней транзакции выполняется сразу
+        transaction.on_commit(update_snapshot)
+
+    return {path: nodes[levels].classification for path, levels in levels_by_path.items()}
+
+
+def _create_missing(tree, all_levels, employee):
+    """Создаёт недостающие узлы по уровням; возвращает (префикс -> узел, созданные, снимок устарел)."""
+    default_points = Classifications._meta.get_field('experience_points').default
+    complexity = Classifications.complexity_for(default_points, ComplexityThresholds.get_cached())
+    # Префикс пути -> узел снимка; созданные узлы живут в отдельных TrieNode до фиксации транзакции
+    nodes = {(): tree.root}
+    created = []
+    stale = False
+
+    with transaction.atomic():
+        for depth in range(1, max(len(levels) for levels in all_levels) + 1):
+            missing = {}
+            for levels in all_levels:
+                prefix = levels[:depth]
+                if len(levels) < depth or prefix in nodes or prefix in missing:
+                    continue
+                parent_node = nodes[prefix[:-1]]
+                node = parent_node.children.get(prefix[-1])
+                if node is not None:
+                    nodes[prefix] = node
+                else:
+                    missing[prefix] = Classifications(name=prefix[-1], parent=parent_node.classification,
+                                                      complexity=complexity)
+            if not missing:
+                continue
+
+            for prefix, obj in _existing_children(missing).items():
+                nodes[prefix] = TrieNode(obj)
+                del missing[prefix]
+                stale = True
+            if not missing:
+                continue
+
+            new_objects = Classifications.objects.bulk_create(list(missing.values()))
+            if any(obj.pk is None for obj in new_objects):
+                _fetch_created(new_objects)
+            for prefix, obj in zip(missing, new_objects):
+                obj.path, obj.depth, obj.full_name = Classifications.tree_fields(obj.pk, obj.name, obj.parent)
+                nodes[prefix] = TrieNode(obj)
+            created += new_objects
+
+        if created:
+            Classifications.objects.bulk_update(created, ['path', 'depth', 'full_name'], batch_size=500)
+            _log_created(created, employee)
+
+    return nodes, created, stale
+
+
+def _log_created(created, employee=None):
+    employee = employee or get_import_author()
+    if employee is None:
+        return
+    pks = [obj.pk for obj in created]
+    write_action_log(
+        employee=employee,
+        action_type='создано',
+        model_name='Classifications',
+        object_id=f"{min(pks)}-{max(pks)}" if len(pks) > 1 else str(pks[0]),
+        description=f"{employee.get_full_name()} создал классификации ({len(created)}): "
+                    + ", ".join(obj.full_name for obj in created),
+    )
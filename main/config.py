@@ -0,0 +1,90 @@
+"""
+Кеш конфигурационных таблиц: SystemSetting, KarmaSettings, ExperienceMultiplier
+и ComplexityThresholds.
+
+Все таблицы загружаются одним снимком (Configuration) и дальше читаются из
+памяти. Снимок сбрасывается после сохранения или удаления любой из этих
+моделей (см. signals.py), а также по истечении CONFIG_CACHE_TTL секунд на
+случай изменений из другого процесса. Объекты из снимка только для чтения:
+для изменения настроек их нужно получать из базы.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import ComplexityThresholds, ExperienceMultiplier, KarmaSettings, SystemSetting
+
+
+class Configuration:
+    def __init__(self):
+        # key -> строковое значение
+        self.system_settings = dict(SystemSetting.objects.values_list('key', 'value'))
+        # (operation_type, level) -> KarmaSettings; при дублях берётся первая запись, как filter().first()
+        self.karma_settings = {}
+        for karma_setting in KarmaSettings.objects.order_by('pk'):
+            self.karma_settings.setdefault((karma_setting.operation_type, karma_setting.level), karma_setting)
+        # name -> множитель
+        self.multipliers = dict(ExperienceMultiplier.objects.values_list('name', 'multiplier'))
+        self.complexity_thresholds = ComplexityThresholds.get_current_thresholds()
+
+    def system_setting(self, key, default=SystemSetting.DoesNotExist):
+        """Строковое значение настройки; без default отсутствующая настройка - SystemSetting.DoesNotExist."""
+        if key in self.system_settings:
+            return self.system_settings[key]
+        if default is SystemSetting.DoesNotExist:
+            raise SystemSetting.DoesNotExist(f"SystemSetting '{key}' не найдена")
+        return default
+
+    def int_setting(self, key, default=SystemSetting.DoesNotExist):
+        value = self.system_setting(key, default)
+        return int(value) if value is not None else None
+
+    def karma_setting(self, operation_type, level=None):
+        """Настройка кармы для типа операции и уровня (level=None - настройка без уровня) или None."""
+        return self.karma_settings.get((operation_type, level))
+
+    def first_karma_setting(self, operation_type):
+        """Первая настройка кармы для типа операции независимо от уровня или None."""
+        for (setting_type, _), karma_setting in self.karma_settings.items():
+            if setting_type == operation_type:
+                return karma_setting
+        return None
+
+    def karma_settings_by_level(self, operation_type):
+        """level -> настройка кармы для типа операции."""
+        return {
+            level: karma_setting
+            for (setting_type, level), karma_setting in self.karma_settings.items()
+            if setting_type == operation_type
+        }
+
+    def multiplier(self, name):
+        """Множитель опыта по имени или None, если он не задан."""
+        return self.multipliers.get(name)
+
+
+_config = None
+_built_at = 0.0
+# RLock: загрузка снимка может создать ComplexityThresholds, а его post_save сбрасывает кеш
+_lock = threading.RLock()
+
+
+def get_config():
+    """Возвращает актуальный снимок конфигурации, при необходимости перечитывая таблицы."""
+    global _config, _built_at
+    ttl = getattr(settings, 'CONFIG_CACHE_TTL', 300)
+    config = _config
+    if config is not None and time.monotonic() - _built_at < ttl:
+        return config
+    with _lock:
+        if _config is None or time.monotonic() - _built_at >= ttl:
+            _config = Configuration()
+            _built_at = time.monotonic()
+        return _config
+
+
+def invalidate_config():
+    global _config
+    with _lock:
+        _config = None
@@ -0,0 +1,315 @@
+"""
+Рейтинги сотрудников (get_rating).
+
+Для каждой метрики хранятся отсортированные ключи (-значение, id) только по
+активным сотрудникам (SortedKeys), поэтому место сотрудника, страница рейтинга,
+топ-N и окрестность сотрудника находятся бинарным поиском, без чтения всей
+таблицы, а изменение значения сотрудника стоит O(log n). Рейтинги строятся агрегирующими запросами и дальше обновляются
+инкрементально из сигналов Employee, Acoin и EmployeeStats (см. signals.py).
+Рейтинги начислений за неделю и месяц строятся по дневным корзинам
+(EarningBucket) и перестраиваются при смене периода, а все рейтинги -
+по истечении LEADERBOARD_TTL секунд на случай изменений из другого процесса.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+
+from django.conf import settings
+
+from .models import EarningBucket, Employee, EmployeeStats
+
+# Метрики текущих значений сотрудника
+TOTAL_METRICS = ('experience', 'karma', 'acoins')
+# Периоды EmployeeStats, за которые строятся рейтинги начислений
+WINDOW_PERIODS = ('week', 'month')
+# Метрика рейтинга -> (метрика начислений, период) или None для текущих значений
+METRICS = dict(
+    {metric: None for metric in TOTAL_METRICS},
+    **{f'{metric}_{period}': (metric, period) for period in WINDOW_PERIODS for metric in EmployeeStats.METRICS},
+)
+
+
+class SortedKeys:
+    """
+    Отсортированный список, разбитый на корзины не длиннее 2 * LOAD элементов.
+    Корзина ищется бинарным поиском по максимумам корзин, позиция элемента -
+    по дереву Фенвика из длин корзин, поэтому вставка, удаление и поиск по
+    значению или позиции стоят O(log n + LOAD). Дерево перестраивается за
+    O(n / LOAD) только при разбиении или удалении корзины.
+    """
+    LOAD = 256
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.buckets = [keys[start:start + self.LOAD] for start in range(0, len(keys), self.LOAD)]
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.length = sum(len(bucket) for bucket in self.buckets)
+        # Дерево Фенвика: tree[i] - сумма длин корзин (i - (i & -i), i]
+        self.tree = [0] + [len(bucket) for bucket in self.buckets]
+        for index in range(1, len(self.tree)):
+            parent = index + (index & -index)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[index]
+
+    def _add_length(self, bucket_index, delta):
+        self.length += delta
+        index = bucket_index + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, bucket_index):
+        """Число элементов в корзинах до bucket_index."""
+        total = 0
+        while bucket_index > 0:
+            total += self.tree[bucket_index]
+            bucket_index -= bucket_index & -bucket_index
+        return total
+
+    def _locate(self, position):
+        """(номер корзины, индекс в корзине) для позиции 0 <= position < len."""
+        bucket_index, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            candidate = bucket_index + step
+            if candidate < len(self.tree) and self.tree[candidate] <= position:
+                bucket_index = candidate
+                position -= self.tree[candidate]
+            step >>= 1
+        return bucket_index, position
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            yield from bucket
+
+    def add(self, key):
+        if not self.buckets:
+            self.buckets = [[key]]
+            self._rebuild_index()
+            return
+        bucket_index = min(bisect_left(self.maxes, key), len(self.buckets) - 1)
+        bucket = self.buckets[bucket_index]
+        insort(bucket, key)
+        self.maxes[bucket_index] = bucket[-1]
+        if len(bucket) > 2 * self.LOAD:
+            self.buckets[bucket_index:bucket_index + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._rebuild_index()
+        else:
+            self._add_length(bucket_index, 1)
+
+    def remove(self, key):
+        bucket_index = bisect_left(self.maxes, key)
+        bucket = self.buckets[bucket_index]
+        del bucket[bisect_left(bucket, key)]
+        if not bucket:
+            del self.buckets[bucket_index]
+            self._rebuild_index()
+        else:
+            self.maxes[bucket_index] = bucket[-1]
+            self._add_length(bucket_index, -1)
+
+    def bisect_left(self, key):
+        bucket_index = bisect_left(self.maxes, key)
+        if bucket_index == len(self.buckets):
+            return self.length
+        return self._prefix(bucket_index) + bisect_left(self.buckets[bucket_index], key)
+
+    def bisect_right(self, key):
+        bucket_index = bisect_right(self.maxes, key)
+        if bucket_index == len(self.buckets):
+            return self.length
+        return self._prefix(bucket_index) + bisect_right(self.buckets[bucket_index], key)
+
+    def slice(self, start, stop):
+        """Элементы с позициями [start, stop)."""
+        start, stop = max(start, 0), min(stop, self.length)
+        if start >= stop:
+            return []
+        bucket_index, offset = self._locate(start)
+        rows = []
+        for bucket in islice(self.buckets, bucket_index, None):
+            rows += bucket[offset:offset + stop - start - len(rows)]
+            offset = 0
+            if len(rows) == stop - start:
+                break
+        return rows
+
+
+class Leaderboard:
+    """Рейтинг по одной метрике: равные значения делят место, при равенстве порядок - по id."""
+
+    def __init__(self, values, period_start=None):
+        # id сотрудника -> значение
+        self.values = dict(values)
+        self.keys = SortedKeys((-value, employee_id) for employee_id, value in self.values.items())
+        self.period_start = period_start
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, employee_id):
+        return employee_id in self.values
+
+    def set(self, employee_id, value):
+        old = self.values.get(employee_id)
+        if old == value and employee_id in self.values:
+            return
+        if employee_id in self.values:
+            self.keys.remove((-old, employee_id))
+        self.values[employee_id] = value
+        self.keys.add((-value, employee_id))
+
+    def remove(self, employee_id):
+        if employee_id in self.values:
+            value = self.values.pop(employee_id)
+            self.keys.remove((-value, employee_id))
+
+    def rank_of_value(self, value):
+        # (-value,) меньше любого ключа (-value, id), поэтому это число сотрудников с большим значением
+        return self.keys.bisect_left((-value,)) + 1
+
+    def rank(self, employee_id):
+        """Место сотрудника или None, если его нет в рейтинге."""
+        if employee_id not in self.values:
+            return None
+        return self.rank_of_value(self.values[employee_id])
+
+    def position(self, employee_id):
+        """Индекс сотрудника в отсортированном рейтинге или None."""
+        if employee_id not in self.values:
+            return None
+        return self.keys.bisect_left((-self.values[employee_id], employee_id))
+
+    def slice(self, offset, limit):
+        """Строки рейтинга [offset, offset + limit): (место, id сотрудника, значение)."""
+        offset = max(offset, 0)
+        return [
+            (self.rank_of_value(-negative), employee_id, -negative)
+            for negative, employee_id in self.keys.slice(offset, offset + limit)
+        ]
+
+    def top(self, limit):
+        return self.slice(0, limit)
+
+    def page(self, page, page_size):
+        return self.slice((page - 1) * page_size, page_size)
+
+    def after(self, value, employee_id, limit):
+        """limit строк, следующих за строкой (value, employee_id) - keyset-страница."""
+        return self.slice(self.keys.bisect_right((-value, employee_id)), limit)
+
+    def around(self, employee_id, size):
+        """size строк до и после сотрудника (включая его самого)."""
+        position = self.position(employee_id)
+        if position is None:
+            return []
+        start = max(position - size, 0)
+        return self.slice(start, position - start + size + 1)
+
+
+_boards = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def _period_value(value, start, current_start):
+    # Счётчик устаревшего периода считается нулевым, как в EmployeeStats.counter
+    return value if value is not None and start == current_start else 0
+
+
+def _build():
+    starts = EmployeeStats.period_starts()
+    values = {metric: {} for metric in METRICS}
+    rows = Employee.objects.filter(is_active=True).values_list('id', 'experience', 'karma', 'acoin__amount')
+    for employee_id, experience, karma, acoins in rows:
+        values['experience'][employee_id] = experience
+        values['karma'][employee_id] = karma
+        values['acoins'][employee_id] = acoins or 0
+
+    # Начисления за период: по одной сумме корзин на сотрудника и метрику, у кого их нет - 0
+    for metric, window in METRICS.items():
+        if window:
+            totals = EarningBucket.totals(window[0], since=starts[window[1]])
+            values[metric] = {employee_id: totals.get(employee_id) or 0 for employee_id in values['experience']}
+    return {
+        metric: Leaderboard(values[metric], starts[window[1]] if window else None)
+        for metric, window in METRICS.items()
+    }
+
+
+def _is_stale(boards):
+    if boards is None or time.monotonic() - _built_at >= getattr(settings, 'LEADERBOARD_TTL', 300):
+        return True
+    starts = EmployeeStats.period_starts()
+    return any(window and boards[metric].period_start != starts[window[1]] for metric, window in METRICS.items())
+
+
+def get_leaderboard(metric):
+    """Рейтинг по метрике из METRICS; при необходимости перестраивает все рейтинги."""
+    global _boards, _built_at
+    if metric not in METRICS:
+        raise ValueError(f"Неизвестная метрика рейтинга: {metric}")
+    boards = _boards
+    if _is_stale(boards):
+        with _lock:
+            if _is_stale(_boards):
+                _boards = _build()
+                _built_at = time.monotonic()
+            boards = _boards
+    return boards[metric]
+
+
+def invalidate_leaderboards():
+    global _boards
+    with _lock:
+        _boards = None
+
+
+def update_employee(employee_id, is_active, experience, karma):
+    """Обновляет опыт и карму сотрудника; неактивные сотрудники убираются из всех рейтингов."""
+    global _boards
+    with _lock:
+        if _boards is None:
+            return
+        if not is_active:
+            for board in _boards.values():
+                board.remove(employee_id)
+        elif employee_id not in _boards['experience']:
+            # Новый или снова активный сотрудник: остальные метрики проще перечитать
+            _boards = None
+        else:
+            _boards['experience'].set(employee_id, experience)
+            _boards['karma'].set(employee_id, karma)
+
+
+def remove_employee(employee_id):
+    with _lock:
+        if _boards is not None:
+            for board in _boards.values():
+                board.remove(employee_id)
+
+
+def update_acoins(employee_id, amount):
+    with _lock:
+        if _boards is not None and employee_id in _boards['acoins']:
+            _boards['acoins'].set(employee_id, amount or 0)
+
+
+def update_stats(employee_id, counters, starts):
+    """
+    Обновляет рейтинги начислений за период по сохранённой записи EmployeeStats.
+    counters - {'karma_week': значение, ...}, starts - {'week': начало периода, ...}.
+    """
+    with _lock:
+        if _boards is None or employee_id not in _boards['experience']:
+            return
+        for metric, window in METRICS.items():
+            if window:
+                board = _boards[metric]
+                board.set(employee_id, _period_value(counters[metric], starts[window[1]], board.period_start))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.retention import DEFAULT_CHUNK_SIZE, apply_retention
+
+
+class Command(BaseCommand):
+    help = ("Удаляет устаревшие строки журналов и обработанные события достижений по срокам хранения из "
+            "SystemSetting, предварительно выгружая журналы в архив")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Ширина диапазона id, удаляемого одним запросом")
+        parser.add_argument('--no-archive', action='store_true', help="Удалять журналы без выгрузки в архив")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать устаревшие строки")
+
+    def handle(self, *args, **options):
+        results = apply_retention(chunk_size=options['chunk_size'], archive=not options['no_archive'],
+                                  dry_run=options['dry_run'])
+        verb = "Устарело" if options['dry_run'] else "Удалено"
+        for name, count in results.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"{verb} строк: {sum(results.values())}"))
@@ -0,0 +1,42 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from main.models import AttemptAnswer, Employee, TestAttempt, TestQuestion
+
+
+class Command(BaseCommand):
+    help = "Переносит ответы из TestAttempt.test_results в таблицу AttemptAnswer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Перезаписать ответы и у попыток, для которых они уже перенесены")
+        parser.add_argument('--batch-size', type=int, default=500, help="Количество попыток в одной пачке")
+
+    def handle(self, *args, **options):
+        # Модератор в test_results хранится как "Имя Фамилия"; однофамильцев не сопоставляем
+        names = Counter()
+        moderators_by_name = {}
+        for employee_id, first_name, last_name in Employee.objects.values_list('id', 'first_name', 'last_name'):
+            name = f"{first_name} {last_name}"
+            names[name] += 1
+            moderators_by_name[name] = employee_id
+        moderators_by_name = {name: employee_id for name, employee_id in moderators_by_name.items() if names[name] == 1}
+
+        attempts = TestAttempt.objects.exclude(test_results__isnull=True).order_by('pk')
+        if not options['force']:
+            attempts = attempts.filter(answers__isnull=True)
+
+        question_ids_by_test = {}
+        total = 0
+        for attempt in attempts.iterator(chunk_size=options['batch_size']):
+            if attempt.test_id not in question_ids_by_test:
+                question_ids_by_test[attempt.test_id] = dict(
+                    TestQuestion.objects.filter(test_id=attempt.test_id).values_list('question_text', 'id')
+                )
+            try:
+                AttemptAnswer.sync_attempt(attempt, question_ids_by_test[attempt.test_id], moderators_by_name)
+                total += 1
+            except Exception as e:
+                self.stderr.write(f"Ошибка при переносе ответов попытки {attempt.pk}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Ответы перенесены для попыток: {total}"))
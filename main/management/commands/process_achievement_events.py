@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.achievement_engine import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает очередь событий достижений (AchievementEvent) пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Количество событий в одной пачке")
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, ожидая новые события")
+        parser.add_argument('--sleep', type=float, default=5.0, help="Пауза между проверками очереди в режиме --loop")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            processed = process_pending_events(batch_size=batch_size)
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Обработано событий: {total}"))
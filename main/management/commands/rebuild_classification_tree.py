@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.classification_tree import invalidate_classification_tree
+from main.models import Classifications
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает материализованные пути, глубину и полные имена классификаций"
+
+    def handle(self, *args, **options):
+        changed = Classifications.rebuild_tree_fields()
+        invalidate_classification_tree()
+        self.stdout.write(self.style.SUCCESS(f"Обновлено классификаций: {changed}"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.models import EarningBucket, Employee, EmployeeStats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневные корзины начислений (EarningBucket) и статистику сотрудников (EmployeeStats) по полной истории"
+
+    def add_arguments(self, parser):
+        parser.add_argument('employee_ids', nargs='*', type=int, help="id сотрудников (по умолчанию - все)")
+
+    def handle(self, *args, **options):
+        employee_ids = options['employee_ids'] or Employee.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        for employee_id in employee_ids:
+            try:
+                EarningBucket.rebuild(employee_id)
+                EmployeeStats.rebuild(employee_id)
+                total += 1
+            except Exception as e:
+                self.stderr.write(f"Ошибка при пересчёте статистики сотрудника {employee_id}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Статистика пересчитана для сотрудников: {total}"))
@@ -6,7 +6,10 @@ from rest_framework.authtoken.models import Token
 from django.http import JsonResponse, HttpResponse
 from django.utils.deprecation import MiddlewareMixin
 from django.utils import timezone
-from main.models import Employee, UserSession, SystemSetting
+from main.activity import record_activity
+from main.authentication import get_token_user
+from main.config import get_config
+from main.models import UserSession
 
 
 class CheckActiveUserMiddleware:
@@ -30,8 +33,8 @@ class CheckActiveUserMiddleware:
 class UpdateLastLoginMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.user.is_authenticated:
-            # Обновляем поле last_login для пользователя
-            Employee.objects.filter(id=request.user.id).update(last_login=timezone.now())
+            # Время последнего входа записывается в базу пачкой (main/activity.py)
+            record_activity(request.user.id)
 
 class EmployeeMiddleware(MiddlewareMixin):
     def process_request(self, request):
@@ -39,10 +42,11 @@ class EmployeeMiddleware(MiddlewareMixin):
         if token_key and token_key.startswith('Token '):
             try:
                 token_key = token_key.split(' ')[1]
-                token = Token.objects.get(key=token_key)
-                request.employee = token.user
-                # Обновляем поле last_login при использовании токена
-                Employee.objects.filter(id=token.user.id).update(last_login=timezone.now())
+                # Сотрудник берётся из кеша токенов, без запросов к Token и Employee
+                employee, token = get_token_user(token_key)
+                request.employee = employee
+                # Обновляем поле last_login при использовании токена (отложенно, пачкой)
+                record_activity(employee.id)
             except Token.DoesNotExist:
                 return JsonResponse({"message": "Invalid token"}, status=403)
         else:
@@ -51,19 +55,20 @@ class UpdateLastActivityMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.user.is_authenticated:
             request.user.last_activity = timezone.now()
-            request.user.save()
+            record_activity(request.user.id, request.user.last_activity)
 class ActiveSessionMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.user.is_authenticated:
             session_key = request.session.session_key
             user_sessions = UserSession.objects.filter(user=request.user)
 
-            # Получение системных настроек
-            max_active_sessions = SystemSetting.objects.get(key='max_active_sessions')
-            max_session_duration = SystemSetting.objects.get(key='max_session_duration')  # Максимальная продолжительность сессии в секундах
+            # Получение системных настроек из кеша конфигурации
+            config = get_config()
+            max_active_sessions = config.int_setting('max_active_sessions')
+            max_session_duration = config.int_setting('max_session_duration')  # Максимальная продолжительность сессии в секундах
 
             # Проверка максимального количества активных сессий
-            if user_sessions.count() >= int(max_active_sessions.value):
+            if user_sessions.count() >= max_active_sessions:
                 # Завершаем самую старую сессию
                 oldest_session = user_sessions.order_by('created_at').first()
                 oldest_session.session.delete()
@@ -73,7 +78,7 @@ class ActiveSessionMiddleware(MiddlewareMixin):
             user_session, created = UserSession.objects.get_or_create(user=request.user, session_id=session_key)
             if not created:
                 session_age = timezone.now() - user_session.last_activity
-                if session_age.total_seconds() > int(max_session_duration.value):
+                if session_age.total_seconds() > max_session_duration:
                     # Завершаем сессию, если она длится дольше, чем разрешено
                     user_session.session.delete()
                     user_session.delete()
@@ -94,12 +99,9 @@ class FileSizeLimitMiddleware:
     def __call__(self, request):
         # Если запрос содержит файлы, проверяем их размер
         if request.method == 'POST' and request.FILES:
-            # Получаем значение max_upload_size из базы данных
-            try:
-                max_upload_size_setting = SystemSetting.objects.get(key='max_upload_size')
-                max_upload_size = int(max_upload_size_setting.value)  # Преобразуем в число
-            except SystemSetting.DoesNotExist:
-                max_upload_size = 5 * 1024 * 1024  # Если не найдено, используем значение по умолчанию (5 MB)
+            # Получаем значение max_upload_size из кеша конфигурации
+            # Если не найдено, используем значение по умолчанию (5 MB)
+            max_upload_size = get_config().int_setting('max_upload_size', 5 * 1024 * 1024)
 
             for file in request.FILES.values():
                 if file.size > max_upload_size:
@@ -1,12 +1,18 @@
+import bisect
+import datetime
+import functools
+import json
 import os
+import threading
+import time
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser, Group, Permission, User
 from django.contrib.sessions.models import Session
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.core.validators import EmailValidator, MinValueValidator
 from django.core.exceptions import ValidationError
 import re
-from django.db.models import JSONField
+from django.db.models import JSONField, F, Q, Sum, Count, Min
 from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
@@ -61,16 +67,90 @@ class PreloadedAvatar(models.Model):
 
     def __str__(self):
         return self.name
+MAX_LEVEL = 50
+BASE_LEVEL_EXPERIENCE = 100  # базовый опыт для первого уровня
+
+
+@functools.lru_cache(maxsize=32)
+def experience_curve(multiplier, max_level=MAX_LEVEL):
+    """
+    Кривая опыта: curve[level] - опыт, необходимый для перехода с уровня level на следующий
+    (то же, что Employee.calculate_experience_for_level, для всех уровней сразу).
+    """
+    curve = [BASE_LEVEL_EXPERIENCE, BASE_LEVEL_EXPERIENCE]  # уровни 0 и 1
+    for level in range(2, max_level + 1):
+        curve.append(curve[-1] + int(BASE_LEVEL_EXPERIENCE * (level - 1) * multiplier))
+    return tuple(curve)
+
+
+class LevelSettings:
+    """Настройки уровней с предрассчитанной кривой опыта."""
+
+    def __init__(self, base_acoin_amount=50, acoin_multiplier=0.2, experience_multiplier=1.2):
+        self.base_acoin_amount = base_acoin_amount
+        self.acoin_multiplier = acoin_multiplier
+        self.experience_multiplier = experience_multiplier
+        self.curve = experience_curve(experience_multiplier)
+
+    def experience_for_level(self, level):
+        return self.curve[max(level, 0)]
+
+    def level_for_experience(self, experience):
+        """
+        Уровень для данного количества опыта: бинарный поиск по кривой.
+        Уровень равен 1 + количество порогов curve[1..MAX_LEVEL-1], которые уже достигнуты.
+        """
+        return bisect.bisect_right(self.curve, experience, 1, MAX_LEVEL)
+
+    def acoins_for_level(self, level):
+        """Награда в акоинах за получение уровня level + 1."""
+        return int(self.base_acoin_amount * (level * self.acoin_multiplier))
+
+
 class LevelConfiguration(models.Model):
     base_acoin_amount = models.IntegerField(default=50, help_text="Базовое количество акоинов за повышение уровня")
     acoin_multiplier = models.FloatField(default=0.2, help_text="Множитель для выдачи акоинов при повышении уровня")
     experience_multiplier = models.FloatField(default=1.2, help_text="Множитель для расчета требуемого опыта для следующего уровня")
 
+    # Кеш настроек уровней в процессе; сбрасывается при сохранении конфигурации
+    # и по истечении LEVEL_CONFIGURATION_TTL секунд (изменения из другого процесса)
+    _settings_cache = None
+    _settings_cached_at = 0.0
+    _settings_lock = threading.Lock()
+
     def save(self, *args, **kwargs):
         # Проверка, что существует только одна запись
         if not self.pk and LevelConfiguration.objects.exists():
             raise ValidationError("Допускается только одна запись в LevelConfiguration.")
         super(LevelConfiguration, self).save(*args, **kwargs)
+        transaction.on_commit(LevelConfiguration.invalidate_settings)
+
+    def delete(self, *args, **kwargs):
+        result = super(LevelConfiguration, self).delete(*args, **kwargs)
+        transaction.on_commit(LevelConfiguration.invalidate_settings)
+        return result
+
+    @classmethod
+    def get_settings(cls):
+        """Текущие настройки уровней (LevelSettings); без конфигурации - значения по умолчанию."""
+        ttl = getattr(settings, 'LEVEL_CONFIGURATION_TTL', 300)
+        cached = cls._settings_cache
+        if cached is not None and time.monotonic() - cls._settings_cached_at < ttl:
+            return cached
+        with cls._settings_lock:
+            config = cls.objects.first()
+            if config is None:
+                cached = LevelSettings()
+            else:
+                cached = LevelSettings(config.base_acoin_amount, config.acoin_multiplier, config.experience_multiplier)
+            cls._settings_cache = cached
+            cls._settings_cached_at = time.monotonic()
+        return cached
+
+    @classmethod
+    def invalidate_settings(cls):
+        with cls._settings_lock:
+            cls._settings_cache = None
 
     @classmethod
     def get_solo_instance(cls):
@@ -148,6 +228,16 @@ class Employee(AbstractUser):
     def get_survey_answers(self):
         return self.survey_answers.select_related('question').all()
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # При обращении к отложенному полю загружаем сразу все отложенные поля одним запросом
+        # (сотрудник из кеша токенов содержит только поля авторизации, см. main/authentication.py)
+        if fields is not None:
+            fields = set(fields)
+            deferred_fields = self.get_deferred_fields()
+            if fields & deferred_fields:
+                fields |= deferred_fields
+        super().refresh_from_db(using, fields, **kwargs)
+
     def save(self, *args, **kwargs):
         # Разрешаем изменения только поля is_active для деактивированных аккаунтов
         if not self.is_active and not getattr(self, 'force_save', False):
@@ -171,6 +261,14 @@ class Employee(AbstractUser):
         if old_value == new_value:
             return
 
+        # Создаём запись лога с изменениями
+        log = self._build_log(change_type, old_value, new_value, source=source, description=description)
+        log.save()
+        print(
+            f"Logging change: {change_type}, {old_value} -> {new_value}, source: {source}, description: {log.description}")
+
+    def _build_log(self, change_type, old_value, new_value, source=None, description=None):
+        """Несохранённая запись EmployeeLog (для log_change и пакетной записи через bulk_create)."""
         # Если описание не передано, создаём его на основе типа изменения
         if description is None:
             if change_type == 'experience':
@@ -191,8 +289,7 @@ class Employee(AbstractUser):
             else:
                 description = f"Сотрудник {self.get_full_name()} изменил {change_type}: {old_value} -> {new_value}."
 
-        # Создаём запись лога с изменениями
-        EmployeeLog.objects.create(
+        return EmployeeLog(
             employee=self,
             change_type=change_type,
             old_value=old_value,
@@ -200,8 +297,6 @@ class Employee(AbstractUser):
             source=source,
             description=description  # Описание всегда заполняется
         )
-        print(
-            f"Logging change: {change_type}, {old_value} -> {new_value}, source: {source}, description: {description}")
 
     def add_karma(self, amount, source="Изменили вручную"):
         """ Увеличивает карму на указанное количество и логирует изменение """
@@ -252,42 +347,21 @@ class Employee(AbstractUser):
         if getattr(self, '_checking_level', False):
             return
         self._checking_level = True  # Устанавливаем флаг начала проверки уровня
-        leveled_up_or_down = False  # Флаг для отслеживания, был ли уровень изменен
-        max_level = 50
-        min_level = 1
-
-        # Получаем конфигурацию уровней или используем значения по умолчанию
         try:
-            config = LevelConfiguration.objects.get()
-            acoins_for_level = config.base_acoin_amount
-            acoin_multiplier = config.acoin_multiplier
-            experience_multiplier = config.experience_multiplier
-        except ObjectDoesNotExist:
-            acoins_for_level = 50
-            acoin_multiplier = 0.2
-            experience_multiplier = 1.2
-
-        # Проверка на повышение уровня
-        while self.experience >= self.next_level_experience and self.level < max_level:
-            self.add_acoins(acoins_for_level * (self.level * acoin_multiplier),
-                            source=f"За получение {self.level}-го уровня")
-            old_level = self.level
-            self.level += 1
-            leveled_up_or_down = True
-            self.next_level_experience = self.calculate_experience_for_level(self.level, experience_multiplier)
-            self.log_change('level', old_level, self.level)
-
-        # Проверка на понижение уровня
-        while self.level > min_level and self.experience < self.calculate_experience_for_level(self.level - 1,
-                                                                                               experience_multiplier):
-            old_level = self.level
-            self.level -= 1
-            leveled_up_or_down = True
-            self.next_level_experience = self.calculate_experience_for_level(self.level, experience_multiplier)
-            self.log_change('level', old_level, self.level)
+            self._update_level()
+        finally:
+            self._checking_level = False
+
+    def _update_level(self):
+        # Настройки уровней и кривая опыта берутся из кеша, уровень ищется бинарным поиском
+        levels = LevelConfiguration.get_settings()
+        old_level = self.level
+        self.level = levels.level_for_experience(self.experience)
+        leveled_up_or_down = self.level != old_level  # Флаг для отслеживания, был ли уровень изменен
+        self.next_level_experience = levels.experience_for_level(self.level)
 
         # Обновление оставшегося опыта
-        previous_level_experience = self.calculate_experience_for_level(self.level - 1, experience_multiplier)
+        previous_level_experience = levels.experience_for_level(self.level - 1)
         self.remaining_experience = self.next_level_experience - self.experience
 
         # Корректный расчет прогресса опыта (в процентах)
@@ -301,6 +375,7 @@ class Employee(AbstractUser):
 
         # Сохранение изменений только если уровень был изменен
         if leveled_up_or_down:
+            self._write_level_change(old_level, levels)
             super(Employee, self).save(
                 update_fields=['level', 'experience', 'next_level_experience', 'remaining_experience',
                                'experience_progress'])
@@ -308,8 +383,45 @@ class Employee(AbstractUser):
             super(Employee, self).save(
                 update_fields=['experience', 'next_level_experience', 'remaining_experience', 'experience_progress'])
 
+    def _write_level_change(self, old_level, levels):
+        """
+        Записывает изменение уровня одним пакетом: журнал по каждому пройденному уровню
+        и награды в акоинах за каждый полученный уровень.
+        """
+        step = 1 if self.level > old_level else -1
+        logs = [self._build_log('level', level, level + step) for level in range(old_level, self.level, step)]
+        acoin_transactions = []
+        if step > 0:
+            acoin, _ = Acoin.objects.get_or_create(employee=self)
+            balance = acoin.amount
+            for level in range(old_level, self.level):
+                amount = levels.acoins_for_level(level)
+                acoin_transactions.append(AcoinTransaction(employee=self, amount=amount))
+                logs.append(self._build_log('acoins', balance, balance + amount,
+                                            source=f"За получение {level}-го уровня"))
+                balance += amount
+
+        with transaction.atomic():
+            EmployeeLog.objects.bulk_create(logs)
+            if acoin_transactions:
+                AcoinTransaction.objects.bulk_create(acoin_transactions)
+                total = sum(acoin_transaction.amount for acoin_transaction in acoin_transactions)
+                Acoin.objects.filter(pk=acoin.pk).update(amount=F('amount') + total)
+                acoin.amount += total
+                self.acoin = acoin
+                EmployeeStats.register_acoin_transactions(self, acoin_transactions)
+                # bulk_create и update() не отправляют post_save, поэтому событие достижений
+                # и рейтинг по акоинам обновляем сами
+                from .achievement_engine import enqueue_event
+                from .leaderboard import update_acoins
+                enqueue_event(self, AchievementEvent.ACOINS)
+                employee_id, amount = self.pk, acoin.amount
+                transaction.on_commit(lambda: update_acoins(employee_id, amount))
+
     def calculate_experience_for_level(self, level, multiplier=1.2):
-        base_experience = 100  # базовый опыт для первого уровня
+        if level <= MAX_LEVEL:
+            return experience_curve(multiplier)[max(level, 0)]
+        base_experience = BASE_LEVEL_EXPERIENCE  # базовый опыт для первого уровня
         experience_required = base_experience
 
         for i in range(2, level + 1):
@@ -357,6 +469,14 @@ class EmployeeActionLog(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Журнал читается от новых записей к старым (keyset по created_at, id), чаще всего по сотруднику
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['employee', 'created_at']),
+            models.Index(fields=['employee', 'model_name', 'created_at']),
+        ]
+
     def __str__(self):
         return f"{self.employee.username} - {self.action_type} {self.model_name} at {self.created_at}"
 
@@ -399,6 +519,551 @@ class ShiftHistory(models.Model):
     def __str__(self):
         return f"{self.employee} - {self.date} - {self.scheduled_start}-{self.scheduled_end}"
 
+
+class EarningBucket(models.Model):
+    """
+    Начисления сотрудника (карма, опыт, акоины) за один день.
+    Пополняется вместе с EmployeeStats на каждую запись EmployeeLog и AcoinTransaction,
+    поэтому сумма за неделю или месяц - это сумма нескольких корзин, а не всей истории.
+    """
+    METRIC_CHOICES = [
+        ('karma', 'Карма'),
+        ('experience', 'Опыт'),
+        ('acoins', 'Акоины'),
+    ]
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='earning_buckets')
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    day = models.DateField()
+    amount = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('employee', 'metric', 'day')
+        indexes = [models.Index(fields=['metric', 'day'])]
+        verbose_name = "Начисления за день"
+        verbose_name_plural = "Начисления по дням"
+
+    def __str__(self):
+        return f"{self.employee} - {self.metric} за {self.day}: {self.amount}"
+
+    @classmethod
+    def add(cls, employee_id, metric, amount, when=None):
+        """Прибавляет начисление к корзине дня (по умолчанию - сегодняшнего)."""
+        if not amount:
+            return
+        day = timezone.localdate(when) if when else timezone.localdate()
+        bucket = cls.objects.filter(employee_id=employee_id, metric=metric, day=day)
+        if bucket.update(amount=F('amount') + amount):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(employee_id=employee_id, metric=metric, day=day, amount=amount)
+        except IntegrityError:
+            # Корзину успели создать параллельно
+            bucket.update(amount=F('amount') + amount)
+
+    @classmethod
+    def totals(cls, metric, since=None, employee_id=None):
+        """id сотрудника -> сумма начислений по метрике начиная с даты since (включительно)."""
+        buckets = cls.objects.filter(metric=metric)
+        if since:
+            buckets = buckets.filter(day__gte=since)
+        if employee_id is not None:
+            buckets = buckets.filter(employee_id=employee_id)
+        return dict(buckets.values('employee_id').annotate(total=Sum('amount')).values_list('employee_id', 'total'))
+
+    @classmethod
+    def covers_history(cls, employee_id):
+        """
+        Есть ли корзины за всю историю начислений сотрудника: история, начавшаяся
+        раньше первой корзины, значит, что корзины ещё не заполнялись по старым записям.
+        """
+        first_bucket = cls.objects.filter(employee_id=employee_id).aggregate(first=Min('day'))['first']
+        first_entries = [
+            EmployeeLog.objects.filter(
+                employee_id=employee_id, change_type__in=('karma', 'experience'), new_value__gt=F('old_value')
+            ).aggregate(first=Min('timestamp'))['first'],
+            AcoinTransaction.objects.filter(employee_id=employee_id).aggregate(first=Min('timestamp'))['first'],
+        ]
+        first_entries = [timezone.localdate(first) for first in first_entries if first is not None]
+        if not first_entries:
+            return True
+        return first_bucket is not None and min(first_entries) >= first_bucket
+
+    @classmethod
+    def rebuild(cls, employee_id):
+        """Пересобирает корзины сотрудника по EmployeeLog и AcoinTransaction."""
+        from django.db.models.functions import TruncDate
+
+        rows = []
+        for metric in ('karma', 'experience'):
+            rows += [
+                (metric, row['day'], row['total'])
+                for row in EmployeeLog.objects.filter(
+                    employee_id=employee_id, change_type=metric, new_value__gt=F('old_value')
+                ).annotate(day=TruncDate('timestamp')).values('day').annotate(
+                    total=Sum(F('new_value') - F('old_value'))
+                )
+            ]
+        rows += [
+            ('acoins', row['day'], row['total'])
+            for row in AcoinTransaction.objects.filter(employee_id=employee_id).annotate(
+                day=TruncDate('timestamp')
+            ).values('day').annotate(total=Sum('amount'))
+        ]
+        with transaction.atomic():
+            cls.objects.filter(employee_id=employee_id).delete()
+            cls.objects.bulk_create([
+                cls(employee_id=employee_id, metric=metric, day=day, amount=total)
+                for metric, day, total in rows if total
+            ])
+
+
+class EmployeeStats(models.Model):
+    """
+    Накопительные счётчики сотрудника для проверки достижений.
+    Обновляются инкрементально на каждое событие (смена, лог, транзакция акоинов),
+    поэтому проверка достижений не перечитывает всю историю сотрудника.
+    """
+    METRICS = ('karma', 'experience', 'acoins')
+    PERIODS = ('day', 'week', 'month')
+    # Период -> позиция в списках requests_by_classification
+    REQUEST_PERIODS = {'month': 1, 'week': 2}
+
+    employee = models.OneToOneField(Employee, on_delete=models.CASCADE, related_name='stats')
+
+    # Смены
+    last_shift_date = models.DateField(null=True, blank=True)
+    current_streak = models.IntegerField(default=0)  # Текущий стрик смен без опозданий
+    max_streak = models.IntegerField(default=0)  # Максимальный стрик смен без опозданий
+    days_without_late = models.IntegerField(default=0)
+    late_count = models.IntegerField(default=0)
+    worked_days = models.IntegerField(default=0)  # Количество уникальных дат смен
+
+    # Начисления: всего и за текущие день/неделю/месяц
+    karma_earned = models.IntegerField(default=0)
+    karma_earned_day = models.IntegerField(default=0)
+    karma_earned_week = models.IntegerField(default=0)
+    karma_earned_month = models.IntegerField(default=0)
+    experience_earned = models.IntegerField(default=0)
+    experience_earned_day = models.IntegerField(default=0)
+    experience_earned_week = models.IntegerField(default=0)
+    experience_earned_month = models.IntegerField(default=0)
+    acoins_earned = models.IntegerField(default=0)
+    acoins_earned_day = models.IntegerField(default=0)
+    acoins_earned_week = models.IntegerField(default=0)
+    acoins_earned_month = models.IntegerField(default=0)
+
+    # Обращения, где сотрудник - оператор поддержки (периоды - по дате обращения)
+    requests_total = models.IntegerField(default=0)
+    requests_month = models.IntegerField(default=0)
+    requests_week = models.IntegerField(default=0)
+    massive_requests_total = models.IntegerField(default=0)
+    massive_requests_month = models.IntegerField(default=0)
+    massive_requests_week = models.IntegerField(default=0)
+    simple_requests = models.IntegerField(default=0)
+    medium_requests = models.IntegerField(default=0)
+    hard_requests = models.IntegerField(default=0)
+    # id классификации -> [всего, за месяц, за неделю]
+    requests_by_classification = JSONField(default=dict, blank=True)
+
+    # Профиль
+    completed_tests = models.IntegerField(default=0)
+    complaints_count = models.IntegerField(default=0)
+    praises_count = models.IntegerField(default=0)
+    achievements_count = models.IntegerField(default=0)
+
+    # Начало периодов, к которым относятся счётчики *_day, *_week, *_month
+    day_start = models.DateField(null=True, blank=True)
+    week_start = models.DateField(null=True, blank=True)
+    month_start = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Статистика сотрудника"
+        verbose_name_plural = "Статистика сотрудников"
+
+    def __str__(self):
+        return f"Статистика {self.employee}"
+
+    @staticmethod
+    def period_starts(today=None):
+        today = today or timezone.localdate()
+        return {
+            'day': today,
+            'week': today - datetime.timedelta(days=today.weekday()),
+            'month': today.replace(day=1),
+        }
+
+    def counter(self, key):
+        """
+        Возвращает значение счётчика по ключу type_specific_data (например, 'karma_earned_week').
+        Счётчик устаревшего периода считается нулевым.
+        """
+        for period, start in self.period_starts().items():
+            if key.endswith(f'_{period}') and getattr(self, f'{period}_start') != start:
+                return 0
+        return getattr(self, key)
+
+    def _roll_periods(self):
+        for period, start in self.period_starts().items():
+            if getattr(self, f'{period}_start') != start:
+                setattr(self, f'{period}_start', start)
+                for metric in self.METRICS:
+                    setattr(self, f'{metric}_earned_{period}', 0)
+                if period in self.REQUEST_PERIODS:
+                    setattr(self, f'requests_{period}', 0)
+                    setattr(self, f'massive_requests_{period}', 0)
+                    position = self.REQUEST_PERIODS[period]
+                    for counts in self.requests_by_classification.values():
+                        counts[position] = 0
+
+    def _add_earned(self, metric, amount):
+        self._roll_periods()
+        for field in [f'{metric}_earned'] + [f'{metric}_earned_{period}' for period in self.PERIODS]:
+            setattr(self, field, getattr(self, field) + amount)
+
+    @classmethod
+    def _locked_for(cls, employee):
+        """
+        Возвращает заблокированную запись счётчиков и признак того, что она была
+        только что пересчитана из истории (тогда текущее событие уже учтено).
+        Вызывается внутри transaction.atomic().
+        """
+        stats = cls.objects.select_for_update().filter(employee=employee).first()
+        if stats is None:
+            return cls.rebuild(employee), True
+        return stats, False
+
+    @classmethod
+    def for_employee(cls, employee):
+        """
+        Счётчики сотрудника для чтения (используется select_related('stats'), если он был).
+        Счётчики прошедших периодов обнуляются в памяти, без сохранения.
+        """
+        try:
+            stats = employee.stats
+        except cls.DoesNotExist:
+            stats = cls.rebuild(employee)
+        stats._roll_periods()
+        return stats
+
+    def _apply_shift(self, shift):
+        if shift.late:
+            self.current_streak = 0
+            self.late_count += 1
+        else:
+            self.current_streak += 1
+            self.days_without_late += 1
+            self.max_streak = max(self.max_streak, self.current_streak)
+        if shift.date != self.last_shift_date:
+            self.worked_days += 1
+        self.last_shift_date = shift.date
+
+    @classmethod
+    def register_shift(cls, shift):
+        return cls.register_shifts(shift.employee, [shift])
+
+    @classmethod
+    def register_shifts(cls, employee, shifts):
+        """Учитывает новые смены сотрудника (например, после bulk_create при импорте графика)."""
+        shifts = sorted(shifts, key=lambda shift: shift.date)
+        if not shifts:
+            return None
+        with transaction.atomic():
+            stats, rebuilt = cls._locked_for(employee)
+            if rebuilt:
+                return stats
+            if stats.last_shift_date and shifts[0].date < stats.last_shift_date:
+                # Смена загружена задним числом - стрик нужно пересчитать по истории
+                return cls.rebuild(employee)
+
+            for shift in shifts:
+                stats._apply_shift(shift)
+            stats.save()
+        return stats
+
+    @classmethod
+    def register_log(cls, log):
+        """Учитывает прирост кармы или опыта из EmployeeLog."""
+        if log.change_type not in ('karma', 'experience') or log.new_value <= log.old_value:
+            return None
+        with transaction.atomic():
+            # Корзина - раньше счётчиков: пересчёт счётчиков читает корзины
+            EarningBucket.add(log.employee_id, log.change_type, log.new_value - log.old_value, log.timestamp)
+            stats, rebuilt = cls._locked_for(log.employee)
+            if not rebuilt:
+                stats._add_earned(log.change_type, log.new_value - log.old_value)
+                stats.save()
+        return stats
+
+    @classmethod
+    def register_acoin_transaction(cls, acoin_transaction):
+        return cls.register_acoin_transactions(acoin_transaction.employee, [acoin_transaction])
+
+    @classmethod
+    def register_acoin_transactions(cls, employee, acoin_transactions):
+        amount = sum(acoin_transaction.amount for acoin_transaction in acoin_transactions)
+        with transaction.atomic():
+            EarningBucket.add(getattr(employee, 'pk', employee), 'acoins', amount)
+            stats, rebuilt = cls._locked_for(employee)
+            if not rebuilt:
+                stats._add_earned('acoins', amount)
+                stats.save()
+        return stats
+
+    @staticmethod
+    def request_key(request):
+        """Вклад обращения в статистику: (id оператора, дата, массовое, сложность, id классификации)."""
+        return (request.support_operator_id, request.date, request.is_massive,
+                request.computed_complexity, request.classification_id)
+
+    @staticmethod
+    def feedback_key(feedback):
+        # В статистику попадают только одобренные отзывы
+        if feedback.status != 'approved':
+            return None
+        return (feedback.target_employee_id, feedback.type)
+
+    @staticmethod
+    def test_attempt_key(attempt):
+        return (attempt.employee_id,) if attempt.status == TestAttempt.PASSED else None
+
+    @staticmethod
+    def achievement_key(employee_achievement):
+        return (employee_achievement.employee_id,)
+
+    def _request_periods(self, date):
+        """Периоды (month/week), к которым относится дата обращения."""
+        if isinstance(date, datetime.datetime):
+            date = timezone.localdate(date) if timezone.is_aware(date) else date.date()
+        if not isinstance(date, datetime.date):
+            return []
+        periods = []
+        if (date.year, date.month) == (self.month_start.year, self.month_start.month):
+            periods.append('month')
+        if date >= self.week_start:
+            periods.append('week')
+        return periods
+
+    def _apply_request(self, key, sign):
+        _, date, is_massive, complexity, classification_id = key
+        periods = self._request_periods(date)
+        counts = self.requests_by_classification.setdefault(str(classification_id), [0, 0, 0])
+        self.requests_total += sign
+        counts[0] += sign
+        if is_massive:
+            self.massive_requests_total += sign
+        for period in periods:
+            setattr(self, f'requests_{period}', getattr(self, f'requests_{period}') + sign)
+            counts[self.REQUEST_PERIODS[period]] += sign
+            if is_massive:
+                setattr(self, f'massive_requests_{period}', getattr(self, f'massive_requests_{period}') + sign)
+        if complexity in ('simple', 'medium', 'hard'):
+            field = f'{complexity}_requests'
+            setattr(self, field, getattr(self, field) + sign)
+
+    def _apply_feedback(self, key, sign):
+        if key[1] == 'complaint':
+            self.complaints_count += sign
+        elif key[1] == 'praise':
+            self.praises_count += sign
+
+    def _apply_test_attempt(self, key, sign):
+        self.completed_tests += sign
+
+    def _apply_achievement(self, key, sign):
+        self.achievements_count += sign
+
+    @classmethod
+    def _tracking(cls, model):
+        """(функция ключа, метод применения) для моделей, влияющих на статистику профиля."""
+        return {
+            Request: (cls.request_key, cls._apply_request),
+            Feedback: (cls.feedback_key, cls._apply_feedback),
+            TestAttempt: (cls.test_attempt_key, cls._apply_test_attempt),
+            EmployeeAchievement: (cls.achievement_key, cls._apply_achievement),
+        }.get(model)
+
+    @classmethod
+    def tracked_key(cls, instance):
+        """Вклад объекта в статистику сотрудника или None, если объект не учитывается."""
+        tracking = cls._tracking(type(instance))
+        return tracking[0](instance) if tracking else None
+
+    @classmethod
+    def register_change(cls, model, old_key, new_key, create_missing=True):
+        """
+        Переносит вклад объекта (обращения, отзыва, попытки теста, достижения) из старого
+        состояния в новое. Ключ - кортеж, первым элементом которого идёт id сотрудника,
+        или None, если объект не учитывается. При удалении (create_missing=False)
+        отсутствующая статистика не создаётся: сотрудник может удаляться каскадно.
+        """
+        if old_key == new_key:
+            return
+        apply = cls._tracking(model)[1]
+        employee_ids = {key[0] for key in (old_key, new_key) if key and key[0]}
+        for employee_id in employee_ids:
+            with transaction.atomic():
+                if create_missing:
+                    stats, rebuilt = cls._locked_for(employee_id)
+                else:
+                    stats = cls.objects.select_for_update().filter(employee_id=employee_id).first()
+                    rebuilt = stats is None
+                if rebuilt:
+                    continue
+                stats._roll_periods()
+                for key, sign in ((old_key, -1), (new_key, 1)):
+                    if key and key[0] == employee_id:
+                        apply(stats, key, sign)
+                stats.save()
+
+    @classmethod
+    def register_requests(cls, employee, requests):
+        """Учитывает пачку новых обращений оператора (например, после bulk_create при загрузке выгрузки)."""
+        if not requests:
+            return None
+        with transaction.atomic():
+            stats, rebuilt = cls._locked_for(employee)
+            if not rebuilt:
+                stats._roll_periods()
+                for request in requests:
+                    stats._apply_request(cls.request_key(request), 1)
+                stats.save()
+        return stats
+
+    @classmethod
+    def rebuild(cls, employee):
+        """Полный пересчёт счётчиков по истории сотрудника."""
+        employee_id = getattr(employee, 'pk', employee)
+        starts = cls.period_starts()
+        values = {f'{period}_start': start for period, start in starts.items()}
+
+        # Стрик считается по сменам в порядке дат, опоздание обнуляет его
+        current_streak = max_streak = days_without_late = late_count = worked_days = 0
+        last_date = None
+        shifts = ShiftHistory.objects.filter(employee_id=employee_id).order_by('date', 'id').values_list('date', 'late')
+        for date, late in shifts:
+            if late:
+                current_streak = 0
+                late_count += 1
+            else:
+                current_streak += 1
+                days_without_late += 1
+                max_streak = max(max_streak, current_streak)
+            if date != last_date:
+                worked_days += 1
+            last_date = date
+        values.update(
+            last_shift_date=last_date,
+            current_streak=current_streak,
+            max_streak=max_streak,
+            days_without_late=days_without_late,
+            late_count=late_count,
+            worked_days=worked_days,
+        )
+
+        # Начисления - по дневным корзинам (EarningBucket); если корзины не заполнены
+        # по старой истории (сотрудник был до их появления), сначала пересобираем их
+        if not EarningBucket.covers_history(employee_id):
+            EarningBucket.rebuild(employee_id)
+        for metric in cls.METRICS:
+            totals = EarningBucket.objects.filter(employee_id=employee_id, metric=metric).aggregate(
+                total=Sum('amount'),
+                **{f'total_{period}': Sum('amount', filter=Q(day__gte=start)) for period, start in starts.items()}
+            )
+            values[f'{metric}_earned'] = totals['total'] or 0
+            for period in cls.PERIODS:
+                values[f'{metric}_earned_{period}'] = totals[f'total_{period}'] or 0
+
+        period_filters = {
+            period: timezone.make_aware(datetime.datetime.combine(start, datetime.time.min))
+            for period, start in starts.items()
+        }
+
+        # Обращения: месяц - по календарному месяцу даты обращения, неделя - с понедельника
+        month_start = period_filters['month']
+        next_month_start = timezone.make_aware(datetime.datetime.combine(
+            (starts['month'] + datetime.timedelta(days=32)).replace(day=1), datetime.time.min))
+        request_periods = {
+            'month': Q(date__gte=month_start, date__lt=next_month_start),
+            'week': Q(date__gte=period_filters['week']),
+        }
+        requests = Request.objects.filter(support_operator_id=employee_id)
+        values.update(requests.aggregate(
+            requests_total=Count('number'),
+            requests_month=Count('number', filter=request_periods['month']),
+            requests_week=Count('number', filter=request_periods['week']),
+            massive_requests_total=Count('number', filter=Q(is_massive=True)),
+            massive_requests_month=Count('number', filter=Q(is_massive=True) & request_periods['month']),
+            massive_requests_week=Count('number', filter=Q(is_massive=True) & request_periods['week']),
+            simple_requests=Count('number', filter=Q(computed_complexity='simple')),
+            medium_requests=Count('number', filter=Q(computed_complexity='medium')),
+            hard_requests=Count('number', filter=Q(computed_complexity='hard')),
+        ))
+        values['requests_by_classification'] = {
+            str(row['classification_id']): [row['total'], row['month'], row['week']]
+            for row in requests.values('classification_id').annotate(
+                total=Count('number'),
+                month=Count('number', filter=request_periods['month']),
+                week=Count('number', filter=request_periods['week']),
+            ).order_by()
+        }
+
+        values['completed_tests'] = TestAttempt.objects.filter(
+            employee_id=employee_id, status=TestAttempt.PASSED).count()
+        values.update(Feedback.objects.filter(target_employee_id=employee_id, status='approved').aggregate(
+            complaints_count=Count('id', filter=Q(type='complaint')),
+            praises_count=Count('id', filter=Q(type='praise')),
+        ))
+        values['achievements_count'] = EmployeeAchievement.objects.filter(employee_id=employee_id).count()
+
+        stats, _ = cls.objects.update_or_create(employee_id=employee_id, defaults=values)
+        return stats
+
+
+class AchievementEvent(models.Model):
+    """
+    Очередь событий для отложенной проверки достижений (outbox).
+    Сигналы только добавляют сюда запись в рамках той же транзакции,
+    а команда process_achievement_events обрабатывает события пачками.
+    """
+    SHIFT = 'shift'
+    KARMA = 'karma'
+    ACOINS = 'acoins'
+    LEVEL = 'level'
+    REQUEST = 'request'
+    TEST_PASSED = 'test_passed'
+    TEST_ATTEMPT = 'test_attempt'
+    PRAISE = 'praise'
+
+    EVENT_TYPE_CHOICES = [
+        (SHIFT, 'Смена'),
+        (KARMA, 'Изменение кармы'),
+        (ACOINS, 'Изменение акоинов'),
+        (LEVEL, 'Уровень и опыт'),
+        (REQUEST, 'Обращение'),
+        (TEST_PASSED, 'Тест пройден'),
+        (TEST_ATTEMPT, 'Попытка теста'),
+        (PRAISE, 'Похвала'),
+    ]
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='achievement_events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    object_id = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['processed_at', 'id'])]
+        verbose_name = "Событие достижений"
+        verbose_name_plural = "События достижений"
+
+    def __str__(self):
+        return f"{self.employee} - {self.event_type} ({self.object_id})"
+
 class SystemSetting(models.Model):
     key = models.CharField(max_length=100, unique=True)
     value = models.CharField(max_length=255)
@@ -452,6 +1117,12 @@ class ComplexityThresholds(models.Model):
             thresholds = cls.objects.create()
         return thresholds
 
+    @classmethod
+    def get_cached(cls):
+        """Текущие пороги из кеша конфигурации (только для чтения)."""
+        from .config import get_config  # config импортирует models
+        return get_config().complexity_thresholds
+
     def __str__(self):
         return f"Simple: {self.simple}, Medium: {self.medium}, Hard: {self.hard}"
 
@@ -467,10 +1138,17 @@ class Classifications(models.Model):
         (HARD, 'Сложное'),
     ]
 
+    PATH_SEPARATOR = '/'
+    NAME_SEPARATOR = '->'
+
     name = models.CharField(max_length=100)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subclassifications')
     experience_points = models.IntegerField(default=10, verbose_name="Очки опыта")
     complexity = models.CharField(max_length=10, choices=COMPLEXITY_CHOICES, default=SIMPLE, editable=False)
+    # Материализованный путь "/id корня/.../id/", глубина (у корня 0) и полное имя "A->B->C"
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    full_name = models.TextField(blank=True, default='', editable=False)
 
     class Meta:
         unique_together = ('name', 'parent')
@@ -478,23 +1156,93 @@ class Classifications(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def parent_full_name(self):
+        """Полное имя родителя ("A->B") или None для корня."""
+        if not self.parent_id:
+            return None
+        return self.full_name[:-len(self.NAME_SEPARATOR + self.name)]
+
+    @classmethod
+    def complexity_for(cls, experience_points, thresholds=None):
+        thresholds = thresholds or ComplexityThresholds.get_cached()
+        if experience_points < thresholds.simple:
+            return cls.SIMPLE
+        elif experience_points < thresholds.medium:
+            return cls.MEDIUM
+        return cls.HARD
+
+    @classmethod
+    def tree_fields(cls, pk, name, parent=None):
+        """(path, depth, full_name) узла по уже посчитанным полям родителя."""
+        if parent is None:
+            return f"{cls.PATH_SEPARATOR}{pk}{cls.PATH_SEPARATOR}", 0, name
+        return (f"{parent.path}{pk}{cls.PATH_SEPARATOR}", parent.depth + 1,
+                f"{parent.full_name}{cls.NAME_SEPARATOR}{name}")
+
+    def _update_tree_fields(self):
+        """Пересчитывает путь, глубину и полное имя узла и, если они изменились, всех его потомков."""
+        old_path = self.path
+        path, depth, full_name = self.tree_fields(self.pk, self.name, self.parent)
+        if (path, depth, full_name) == (self.path, self.depth, self.full_name):
+            return
+        Classifications.objects.filter(pk=self.pk).update(path=path, depth=depth, full_name=full_name)
+        self.path, self.depth, self.full_name = path, depth, full_name
+
+        if old_path:
+            # Потомки сортируются по глубине, чтобы родитель каждого был пересчитан раньше него
+            nodes = {self.pk: self}
+            descendants = list(Classifications.objects.filter(path__startswith=old_path).exclude(pk=self.pk)
+                               .order_by('depth').only('id', 'name', 'parent_id', 'path', 'depth', 'full_name'))
+            for descendant in descendants:
+                descendant.path, descendant.depth, descendant.full_name = self.tree_fields(
+                    descendant.pk, descendant.name, nodes[descendant.parent_id])
+                nodes[descendant.pk] = descendant
+            Classifications.objects.bulk_update(descendants, ['path', 'depth', 'full_name'], batch_size=500)
+
+    @classmethod
+    def rebuild_tree_fields(cls):
+        """Пересчитывает path, depth и full_name у всех классификаций; возвращает число изменённых."""
+        rows = list(cls.objects.only('id', 'name', 'parent_id', 'path', 'depth', 'full_name'))
+        by_id = {row.pk: row for row in rows}
+        stored = {row.pk: (row.path, row.depth, row.full_name) for row in rows}
+        done = set()
+
+        def compute(row):
+            # Поля родителя пересчитываются раньше, чем поля узла
+            if row.pk in done:
+                return
+            done.add(row.pk)
+            parent = by_id.get(row.parent_id)
+            if parent is not None:
+                compute(parent)
+            row.path, row.depth, row.full_name = cls.tree_fields(row.pk, row.name, parent)
+
+        for row in rows:
+            compute(row)
+        changed = [row for row in rows if (row.path, row.depth, row.full_name) != stored[row.pk]]
+        cls.objects.bulk_update(changed, ['path', 'depth', 'full_name'], batch_size=500)
+        return len(changed)
+
     def save(self, *args, **kwargs):
         # Устанавливаем сложность в зависимости от очков опыта и текущих порогов
-        thresholds = ComplexityThresholds.get_current_thresholds()
-        if self.experience_points < thresholds.simple:
-            self.complexity = self.SIMPLE
-        elif self.experience_points < thresholds.medium:
-            self.complexity = self.MEDIUM
-        else:
-            self.complexity = self.HARD
+        self.complexity = self.complexity_for(self.experience_points)
 
         # Проверка на наличие существующей классификации с таким же именем и родителем
         existing_classification = Classifications.objects.filter(name=self.name, parent=self.parent).first()
         if existing_classification and existing_classification.id != self.id:
             existing_classification.experience_points = self.experience_points
             super(Classifications, existing_classification).save(*args, **kwargs)  # сохраняем изменения
+            saved, created = existing_classification, False
         else:
+            created = self.pk is None
             super(Classifications, self).save(*args, **kwargs)
+            self._update_tree_fields()
+            saved = self
+
+        # Снимок дерева (main/classification_tree.py) обновляется после фиксации транзакции
+        from .classification_tree import classification_saved
+        transaction.on_commit(lambda: classification_saved(saved, created))
 
 class Template(models.Model):
     name = models.CharField(max_length=255)
@@ -632,11 +1380,33 @@ class Request(models.Model):
     computed_complexity = models.CharField(max_length=10, choices=Classifications.COMPLEXITY_CHOICES, null=True,
                                            blank=True)
 
-    def compute_complexity(self, experience_points):
+    def calculate_experience(self, responsible_multiplier=None, massive_multiplier=None):
+        """
+        Опыт оператору за обращение: база из классификации с учётом множителей
+        за ответственность и массовость. None, если у классификации не задан опыт.
+        """
+        experience_points = getattr(self.classification, 'experience_points', None)
+        if not experience_points:
+            return None
+
+        # Множитель за ответственность, если оператор сам завершил обращение
+        responsible_full_name = self.responsible.split()
+        if len(responsible_full_name) >= 2 and responsible_multiplier:
+            responsible_name = f"{responsible_full_name[1]} {responsible_full_name[0]}"  # Имя + Фамилия
+            operator_full_name = f"{self.support_operator.first_name} {self.support_operator.last_name}"
+            if responsible_name == operator_full_name:
+                experience_points *= responsible_multiplier
+
+        # Множитель за массовое обращение
+        if self.is_massive and massive_multiplier:
+            experience_points *= massive_multiplier
+        return experience_points
+
+    def compute_complexity(self, experience_points, thresholds=None):
         """
         Определяет сложность на основе переданного значения опыта.
         """
-        thresholds = ComplexityThresholds.get_current_thresholds()
+        thresholds = thresholds or ComplexityThresholds.get_cached()
         if experience_points < thresholds.simple:
             return Classifications.SIMPLE
         elif thresholds.simple <= experience_points < thresholds.medium:
@@ -646,8 +1416,8 @@ class Request(models.Model):
     def __str__(self):
         return f'{self.number} - {self.get_status_display()}'
 
-    def get_complexity(self):
-        thresholds = ComplexityThresholds.get_current_thresholds()
+    def get_complexity(self, thresholds=None):
+        thresholds = thresholds or ComplexityThresholds.get_cached()
         experience_points = self.classification.experience_points
 
         if experience_points < thresholds.simple:
@@ -676,6 +1446,14 @@ class EmployeeLog(models.Model):
     # Новое поле для хранения источника изменения
     source = models.CharField(max_length=100, null=True, blank=True)
 
+    class Meta:
+        # Логи читаются от новых записей к старым (keyset по timestamp, id), чаще всего по сотруднику
+        indexes = [
+            models.Index(fields=['timestamp', 'id']),
+            models.Index(fields=['employee', 'timestamp']),
+            models.Index(fields=['employee', 'change_type', 'timestamp']),
+        ]
+
     def __str__(self):
         source_info = f" - {self.source}" if self.source else ""
         return f"{self.employee} - {self.change_type} at {self.timestamp}{source_info}"
@@ -958,6 +1736,124 @@ class TestAttempt(models.Model):
                         EmployeeAchievement.objects.create(employee=self.employee, achievement=achievement)
                         self.employee.save()
 
+    def results(self):
+        """test_results в виде словаря (исторически хранится строкой json.dumps)."""
+        test_results = self.test_results
+        if isinstance(test_results, str):
+            try:
+                test_results = json.loads(test_results)
+            except ValueError:
+                return {}
+        return test_results if isinstance(test_results, dict) else {}
+
+
+class AttemptAnswer(models.Model):
+    """
+    Ответ на вопрос в попытке прохождения теста - нормализованная копия
+    answers_info из TestAttempt.test_results. Пишется в CompleteTestView и
+    moderate_test_attempt, старые попытки переносятся командой backfill_attempt_answers.
+    Статистика по вопросам считается по этой таблице через GROUP BY.
+    """
+    attempt = models.ForeignKey(TestAttempt, on_delete=models.CASCADE, related_name='answers')
+    question = models.ForeignKey(TestQuestion, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='attempt_answers')
+    position = models.PositiveIntegerField()  # Номер ответа в answers_info, начиная с 1
+    question_text = models.TextField()
+    question_type = models.CharField(max_length=10, choices=TestQuestion.QUESTION_TYPE_CHOICES)
+    selected_options = JSONField(default=list, blank=True)  # Номера выбранных вариантов ответа
+    text_answer = models.TextField(blank=True, default='')
+    score = models.FloatField(default=0)
+    max_score = models.FloatField(null=True, blank=True)
+    is_correct = models.BooleanField(default=False)
+    is_partially_true = models.BooleanField(null=True, blank=True)
+    moderator = models.ForeignKey(Employee, on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='moderated_answers')
+    moderator_name = models.CharField(max_length=255, blank=True, default='')
+    moderation_comment = models.TextField(blank=True, default='')
+
+    class Meta:
+        unique_together = ('attempt', 'position')
+        ordering = ['attempt', 'position']
+        indexes = [
+            models.Index(fields=['question', 'is_correct']),
+            models.Index(fields=['moderator_name']),
+        ]
+        verbose_name = "Ответ в попытке теста"
+        verbose_name_plural = "Ответы в попытках тестов"
+
+    def __str__(self):
+        return f"{self.attempt} - вопрос {self.position}"
+
+    @classmethod
+    def from_answer_info(cls, attempt, position, answer_info, question_id=None, moderator_name=''):
+        """Строит (не сохраняя) ответ по элементу answers_info."""
+        selected_options = [
+            option['option_number'] for option in answer_info.get('answer_options', [])
+            if option.get('submitted_answer')
+        ]
+        return cls(
+            attempt=attempt,
+            question_id=question_id,
+            position=position,
+            question_text=answer_info.get('question_text') or '',
+            question_type=answer_info.get('type') or '',
+            selected_options=selected_options,
+            text_answer=answer_info.get('text_answer') or '',
+            score=answer_info.get('question_score') or 0,
+            max_score=answer_info.get('max_question_score'),
+            is_correct=bool(answer_info.get('is_correct')),
+            is_partially_true=answer_info.get('is_partially_true'),
+            moderator_name=moderator_name,
+            moderation_comment=answer_info.get('moderation_comment') or '',
+        )
+
+    @classmethod
+    def sync_attempt(cls, attempt, question_ids_by_text=None, moderators_by_name=None):
+        """
+        Перезаписывает ответы попытки по её test_results.
+        Вопрос ищется по тексту среди вопросов теста, модератор - по имени и фамилии.
+        """
+        test_results = attempt.results()
+        if question_ids_by_text is None:
+            question_ids_by_text = dict(
+                TestQuestion.objects.filter(test_id=attempt.test_id).values_list('question_text', 'id')
+            )
+        moderator_name = test_results.get('moderator') or ''
+        moderator_id = (moderators_by_name or {}).get(moderator_name)
+        answers = [
+            cls.from_answer_info(attempt, position, answer_info,
+                                 question_id=question_ids_by_text.get(answer_info.get('question_text')),
+                                 moderator_name=moderator_name)
+            for position, answer_info in enumerate(test_results.get('answers_info', []), start=1)
+        ]
+        for answer in answers:
+            answer.moderator_id = moderator_id
+        with transaction.atomic():
+            cls.objects.filter(attempt=attempt).delete()
+            cls.objects.bulk_create(answers)
+        return answers
+
+    @classmethod
+    def apply_moderation(cls, attempt, answers_info, moderator):
+        """Переносит результаты модерации из answers_info в ответы попытки."""
+        answers = {answer.position: answer for answer in cls.objects.filter(attempt=attempt)}
+        if len(answers) != len(answers_info):
+            # Ответы попытки ещё не перенесены из test_results
+            answers = {answer.position: answer for answer in cls.sync_attempt(attempt)}
+        moderator_name = f"{moderator.first_name} {moderator.last_name}"
+        for position, answer_info in enumerate(answers_info, start=1):
+            answer = answers[position]
+            answer.score = answer_info.get('question_score') or 0
+            answer.is_correct = bool(answer_info.get('is_correct'))
+            answer.is_partially_true = answer_info.get('is_partially_true')
+            answer.moderation_comment = answer_info.get('moderation_comment') or ''
+            answer.moderator = moderator
+            answer.moderator_name = moderator_name
+        cls.objects.bulk_update(answers.values(), [
+            'score', 'is_correct', 'is_partially_true', 'moderation_comment', 'moderator', 'moderator_name',
+        ])
+
+
 def create_acoin_transaction(test_attempt):
     if test_attempt.status == TestAttempt.PASSED:
         # Получаем количество акоинов за прохождение теста
@@ -1,6 +1,8 @@
 from functools import partial
 from rest_framework.permissions import BasePermission
 
+from .roles import get_user_roles, user_has_perm, user_in_group
+
 class HasPermission(BasePermission):
     def __init__(self, perm=None):
         """
@@ -13,7 +15,7 @@ class HasPermission(BasePermission):
         if self.perm:
             perm = self.perm
             print(f"Проверка конкретного разрешения для пользователя: {request.user.username}, Требуемое разрешение: {perm}")
-            return request.user.has_perm(perm)
+            return user_has_perm(request.user, perm)
 
         # Если разрешение не указано, определяем действие исходя из метода запроса
         if hasattr(view, 'queryset'):
@@ -27,7 +29,7 @@ class HasPermission(BasePermission):
             perm = f"{model._meta.app_label}.{action}_{model._meta.model_name}"
 
             print(f"Проверка базового разрешения для пользователя: {request.user.username}, Требуемое разрешение: {perm}")
-            return request.user.has_perm(perm)
+            return user_has_perm(request.user, perm)
 
         # Если не смогли определить модель или действие, отказываем в доступе
         return False
@@ -52,7 +54,9 @@ class IsAdmin(BasePermission):
     def has_permission(self, request, view):
         print("Используется IsAdmin")
         is_authenticated = request.user.is_authenticated
-        is_admin = request.user.groups.filter(name='Администраторы').exists()
+        # Группы берутся из кеша ролей (main/roles.py), без запросов к базе
+        groups, _ = get_user_roles(request.user)
+        is_admin = 'Администраторы' in groups
         has_permission = is_authenticated and is_admin
 
         # Логируем информацию о пользователе и его роли
@@ -60,7 +64,7 @@ class IsAdmin(BasePermission):
             "username": request.user.username,
             "is_authenticated": is_authenticated,
             "is_admin": is_admin,
-            "groups": list(request.user.groups.values_list('name', flat=True))
+            "groups": sorted(groups)
         }
         # print(f"User info: {user_info}")
 
@@ -68,17 +72,18 @@ class IsAdmin(BasePermission):
 
 class IsModerator(BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Модераторы').exists()
+        return user_in_group(request.user, 'Модераторы')
 
 class IsUser(BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Пользователи').exists()
+        return user_in_group(request.user, 'Пользователи')
 
 class IsModeratorOrAdmin(BasePermission):
     def has_permission(self, request, view):
         is_authenticated = request.user.is_authenticated
-        is_moderator = request.user.groups.filter(name='Модераторы').exists()
-        is_admin = request.user.groups.filter(name='Администраторы').exists()
+        groups, _ = get_user_roles(request.user)
+        is_moderator = 'Модераторы' in groups
+        is_admin = 'Администраторы' in groups
         has_permission = is_authenticated and (is_moderator or is_admin)
 
         # Логируем информацию о пользователе и его роли
@@ -87,7 +92,7 @@ class IsModeratorOrAdmin(BasePermission):
             "is_authenticated": is_authenticated,
             "is_moderator": is_moderator,
             "is_admin": is_admin,
-            "groups": list(request.user.groups.values_list('name', flat=True))
+            "groups": sorted(groups)
         }
         # print(f"User info: {user_info}")
 
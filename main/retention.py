@@ -0,0 +1,134 @@
+"""
+Хранение и архивирование журналов (команда apply_log_retention).
+
+Срок хранения каждой таблицы задаётся в SystemSetting (ключ RetentionPolicy.setting_key,
+значение - число дней; пусто или 0 - хранить всё). Устаревшие строки удаляются
+пачками по диапазонам id: каждая пачка - один DELETE по первичному ключу в своей
+транзакции. Перед удалением строки журналов выгружаются в gzip-файлы JSONL в
+каталог FilePath с именем ARCHIVE_FILE_PATH_NAME; без настроенного каталога такие
+таблицы не очищаются. Обработанные события достижений не архивируются.
+"""
+import datetime
+import gzip
+import json
+import os
+from collections import namedtuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .config import get_config
+from .models import AchievementEvent, EmployeeActionLog, EmployeeLog, FilePath
+
+ARCHIVE_FILE_PATH_NAME = 'log_archive'
+DEFAULT_CHUNK_SIZE = 5000
+
+RetentionPolicy = namedtuple('RetentionPolicy', ['name', 'model', 'time_field', 'setting_key', 'archive', 'filters'])
+
+POLICIES = (
+    RetentionPolicy('employee_log', EmployeeLog, 'timestamp', 'employee_log_retention_days', True, {}),
+    RetentionPolicy('employee_action_log', EmployeeActionLog, 'created_at', 'employee_action_log_retention_days',
+                    True, {}),
+    # Необработанные события не трогаем: их ещё должен разобрать process_achievement_events
+    RetentionPolicy('achievement_event', AchievementEvent, 'processed_at', 'achievement_event_retention_days',
+                    False, {'processed_at__isnull': False}),
+)
+
+
+def retention_days(policy):
+    """Срок хранения в днях или None, если таблица хранится полностью."""
+    try:
+        days = get_config().int_setting(policy.setting_key, None)
+    except ValueError:
+        print(f"Ошибка в настройке {policy.setting_key}: ожидается число дней")
+        return None
+    return days if days and days > 0 else None
+
+
+def archive_directory():
+    file_path = FilePath.objects.filter(name=ARCHIVE_FILE_PATH_NAME).first()
+    return file_path.path if file_path and file_path.path else None
+
+
+def expired(policy, cutoff):
+    return policy.model.objects.filter(**{f'{policy.time_field}__lt': cutoff}, **policy.filters)
+
+
+class ArchiveWriter:
+    """gzip-файл JSONL для одной таблицы; создаётся при первой записи."""
+
+    def __init__(self, directory, name):
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+        self.path = os.path.join(directory, f"{name}-{stamp}.jsonl.gz")
+        self.file = None
+
+    def write(self, rows):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = gzip.open(self.path, 'at', encoding='utf-8')
+        for row in rows:
+            self.file.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+            self.file.write('\n')
+        # Перед удалением пачки её строки должны быть на диске
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def purge(policy, cutoff, chunk_size=DEFAULT_CHUNK_SIZE, archive_dir=None, dry_run=False):
+    """
+    Удаляет строки таблицы старше cutoff пачками по chunk_size id, предварительно
+    выгружая их в archive_dir (если передан). Возвращает (число строк, путь к архиву или None).
+    """
+    queryset = expired(policy, cutoff)
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0, None
+    if dry_run:
+        return queryset.count(), None
+
+    writer = ArchiveWriter(archive_dir, policy.name) if archive_dir else None
+    total = 0
+    try:
+        for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            chunk = queryset.filter(pk__gte=low, pk__lt=low + chunk_size)
+            with transaction.atomic():
+                if writer is not None:
+                    rows = list(chunk.order_by('pk').values())
+                    if not rows:
+                        continue
+                    writer.write(rows)
+                # У журналов нет обработчиков удаления, поэтому это один DELETE по диапазону id
+                deleted, _ = chunk.delete()
+            total += deleted
+    finally:
+        if writer is not None:
+            writer.close()
+    return total, writer.path if writer is not None and writer.file is not None else None
+
+
+def apply_retention(now=None, chunk_size=DEFAULT_CHUNK_SIZE, archive=True, dry_run=False):
+    """Применяет сроки хранения ко всем таблицам из POLICIES; возвращает {таблица: число удалённых строк}."""
+    now = now or timezone.now()
+    archive_dir = archive_directory() if archive else None
+    results = {}
+    for policy in POLICIES:
+        days = retention_days(policy)
+        if days is None:
+            continue
+        if policy.archive and archive and archive_dir is None:
+            print(f"Каталог архива (FilePath '{ARCHIVE_FILE_PATH_NAME}') не настроен, {policy.name} не очищается")
+            continue
+        try:
+            deleted, path = purge(policy, now - datetime.timedelta(days=days), chunk_size,
+                                  archive_dir if policy.archive else None, dry_run)
+            results[policy.name] = deleted
+            if path:
+                print(f"{policy.name}: {deleted} строк выгружено в {path}")
+        except Exception as e:
+            print(f"Ошибка при очистке {policy.name}: {e}")
+    return results
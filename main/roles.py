@@ -0,0 +1,70 @@
+"""
+Кеш ролей (групп) и прав сотрудников для классов разрешений (permissions.py).
+
+Для каждого сотрудника один раз загружаются названия его групп и все права
+(свои и групповые, в формате "app_label.codename", как в ModelBackend),
+после чего проверки IsAdmin/IsModerator/HasPermission - поиск во множестве.
+Кеш сбрасывается через m2m_changed на groups/user_permissions/Group.permissions,
+при изменении групп и прав и в PermissionManagementViewSet (см. signals.py и
+views.py), а также по истечении ROLE_CACHE_TTL секунд.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+
+# id сотрудника -> (названия групп, права, время кеширования)
+_roles = {}
+_lock = threading.Lock()
+
+EMPTY_ROLES = (frozenset(), frozenset())
+
+
+def get_user_roles(user):
+    """Возвращает (названия групп, права) сотрудника."""
+    if not getattr(user, 'is_authenticated', False):
+        return EMPTY_ROLES
+
+    ttl = getattr(settings, 'ROLE_CACHE_TTL', 300)
+    entry = _roles.get(user.pk)
+    if entry is not None and time.monotonic() - entry[2] < ttl:
+        return entry[0], entry[1]
+
+    groups = frozenset(user.groups.values_list('name', flat=True))
+    permissions = frozenset(
+        f"{app_label}.{codename}"
+        for app_label, codename in Permission.objects.filter(
+            Q(user=user) | Q(group__user=user)
+        ).values_list('content_type__app_label', 'codename').distinct()
+    )
+    with _lock:
+        _roles[user.pk] = (groups, permissions, time.monotonic())
+    return groups, permissions
+
+
+def user_in_group(user, *group_names):
+    groups, _ = get_user_roles(user)
+    return any(name in groups for name in group_names)
+
+
+def user_has_perm(user, perm):
+    """Аналог user.has_perm(perm) для ModelBackend без запросов к базе."""
+    if not getattr(user, 'is_active', False):
+        return False
+    if getattr(user, 'is_superuser', False):
+        return True
+    _, permissions = get_user_roles(user)
+    return perm in permissions
+
+
+def invalidate_user_roles(*user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _roles.pop(user_id, None)
+
+
+def clear_role_cache():
+    with _lock:
+        _roles.clear()
@@ -81,41 +81,26 @@ class PlayersSerializer(serializers.ModelSerializer):
             return f"http://shaman.pythonanywhere.com/media/{obj.avatar.image}"
         return "http://shaman.pythonanywhere.com/media/avatars/default.jpg"
 
+    # Настройка профиля -> (ключ в statistics, поле EmployeeStats)
+    STATS_SETTINGS = (
+        ("show_total_requests", 'total_requests', 'requests_total'),
+        ("show_achievements_count", 'achievements_count', 'achievements_count'),
+        ("show_total_experience_earned", 'total_experience_earned', 'experience_earned'),
+        ("show_completed_tests_count", 'completed_tests_count', 'completed_tests'),
+        ("show_worked_days", 'worked_days', 'worked_days'),
+        ("show_praises_count", 'praises_count', 'praises_count'),
+    )
+
     def get_statistics(self, obj):
         settings = obj.profile_settings or {}
         statistics = {}
 
-
-        # Дополнительные поля, которые можно настроить
-        if settings.get("show_total_requests", False):
-            total_requests = Request.objects.filter(support_operator=obj).count()
-            statistics['total_requests'] = total_requests
-
-        if settings.get("show_achievements_count", False):
-            achievements_count = EmployeeAchievement.objects.filter(employee=obj).count()
-            statistics['achievements_count'] = achievements_count
-
-        if settings.get("show_total_experience_earned", False):
-            total_experience_earned = EmployeeLog.objects.filter(
-                employee=obj,
-                change_type='experience',
-                new_value__gt=F('old_value')
-            ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-            statistics['total_experience_earned'] = total_experience_earned
-
-        if settings.get("show_completed_tests_count", False):
-            completed_tests_count = TestAttempt.objects.filter(employee=obj, status=TestAttempt.PASSED).count()
-            statistics['completed_tests_count'] = completed_tests_count
-
-
-        if settings.get("show_worked_days", False):
-            worked_days = ShiftHistory.objects.filter(employee=obj).values('date').distinct().count()
-            statistics['worked_days'] = worked_days
-
-        # Другие настраиваемые элементы статистики
-        if settings.get("show_praises_count", False):
-            praises_count = Feedback.objects.filter(target_employee=obj, type="praise", status='approved').count()
-            statistics['praises_count'] = praises_count
+        # Сводную статистику читаем (и при необходимости собираем) только если её что-то показывает
+        enabled = [(key, field) for setting, key, field in self.STATS_SETTINGS if settings.get(setting, False)]
+        if enabled:
+            stats = EmployeeStats.for_employee(obj)
+            for key, field in enabled:
+                statistics[key] = getattr(stats, field)
 
         if settings.get("show_status", False):
             statistics['status'] = obj.status or "Не указан"
@@ -168,7 +153,9 @@ class ClassificationsSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'experience_points', 'parent', 'parentName']
 
     def get_parentName(self, obj):
-        # Вызываем вспомогательный метод для построения полного имени цепочки без последнего элемента
+        # Полное имя хранится в строке; для строк без него строим цепочку родителей запросами
+        if obj.full_name:
+            return obj.parent_full_name
         return self.build_full_parent_name(obj)
 
     def build_full_parent_name(self, obj):
@@ -203,6 +190,7 @@ class EmployeeLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmployeeLog
         fields = [
+            'id',
             'employee',
             'change_type',
             'old_value',
@@ -474,6 +462,7 @@ class EmployeeActionLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmployeeActionLog
         fields = [
+            'id',
             'employee',
             'action_type',
             'model_name',
@@ -1065,7 +1054,7 @@ class RatingSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     class Meta:
         model = Employee
-        fields = ['full_name']
+        fields = ['id', 'full_name']
 
     def get_full_name(self,obj):
         full_name = f'{obj.first_name} {obj.last_name}'
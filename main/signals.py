@@ -2,17 +2,33 @@ from datetime import timedelta
 
 from django.contrib.admin.models import LogEntry
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import transaction
 from django.db.models import F, Sum
-from django.db.models.signals import post_save, pre_delete, post_delete, pre_save
+from django.apps import apps
+from django.db.models.signals import post_save, pre_delete, post_delete, pre_save, post_init, m2m_changed
 from django.dispatch import receiver
 from django.forms import model_to_dict
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from .models import TestAttempt, AcoinTransaction, Employee, create_acoin_transaction, TestQuestion, Test, Acoin, \
     Request, Achievement, EmployeeAchievement, ExperienceMultiplier, EmployeeActionLog, ShiftHistory, EmployeeLog, \
-    UserSession, ComplexityThresholds, Feedback
-from django.contrib.auth.models import User, Group
+    UserSession, ComplexityThresholds, Feedback, EmployeeStats, AchievementEvent, SystemSetting, KarmaSettings, \
+    AnswerOption, Theory, Theme, Classifications
+from django.contrib.auth.models import User, Group, Permission
+from rest_framework.authtoken.models import Token
+from .achievement_engine import enqueue_event
+from .achievement_rules import invalidate_rule_index
+from .answer_keys import invalidate_answer_key
+from .authentication import invalidate_token, invalidate_user
+from .classification_tree import invalidate_classification_tree
+from .config import get_config, invalidate_config
+from .leaderboard import METRICS as LEADERBOARD_METRICS, WINDOW_PERIODS, remove_employee, update_acoins, \
+    update_employee, update_stats
+from .roles import clear_role_cache, invalidate_user_roles
+from .test_catalog import invalidate_test_catalog, is_catalog_author
+from .test_content import invalidate_test_content
+from .audit import IMPORT_AUTHOR_USERNAME, get_import_author, invalidate_import_author, is_import_author, \
+    remember_snapshot, take_snapshot, write_action_log
 
 @receiver(post_save, sender=TestAttempt)
 def handle_test_attempt_status(sender, instance, **kwargs):
@@ -24,6 +40,91 @@ def handle_test_attempt_status(sender, instance, **kwargs):
                 EmployeeAchievement.objects.get_or_create(employee=instance.employee, achievement=achievement)
                 print(f"Awarded achievement: {achievement.name} to employee: {instance.employee}")
 
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def reset_achievement_rule_index(sender, instance, **kwargs):
+    # Перестраиваем индекс правил после фиксации транзакции, чтобы не закешировать старые данные
+    transaction.on_commit(invalidate_rule_index)
+
+@receiver(post_save, sender=SystemSetting)
+@receiver(post_delete, sender=SystemSetting)
+@receiver(post_save, sender=KarmaSettings)
+@receiver(post_delete, sender=KarmaSettings)
+@receiver(post_save, sender=ExperienceMultiplier)
+@receiver(post_delete, sender=ExperienceMultiplier)
+@receiver(post_save, sender=ComplexityThresholds)
+@receiver(post_delete, sender=ComplexityThresholds)
+def reset_config_cache(sender, instance, **kwargs):
+    # Снимок конфигурации перечитывается после фиксации транзакции
+    transaction.on_commit(invalidate_config)
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def reset_token_cache_for_employee(sender, instance, **kwargs):
+    # В кеше токенов хранятся поля сотрудника (в том числе is_active), поэтому сбрасываем их после фиксации
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+@receiver(post_save, sender=Employee)
+def update_employee_leaderboards(sender, instance, **kwargs):
+    # Значения берём сейчас, а применяем после фиксации, чтобы откат не попал в рейтинг
+    args = (instance.pk, instance.is_active, instance.experience, instance.karma)
+    transaction.on_commit(lambda: update_employee(*args))
+
+@receiver(post_delete, sender=Employee)
+def remove_employee_from_leaderboards(sender, instance, **kwargs):
+    employee_id = instance.pk
+    transaction.on_commit(lambda: remove_employee(employee_id))
+
+@receiver(post_save, sender=Acoin)
+def update_acoin_leaderboard(sender, instance, **kwargs):
+    employee_id, amount = instance.employee_id, instance.amount
+    transaction.on_commit(lambda: update_acoins(employee_id, amount))
+
+@receiver(post_save, sender=EmployeeStats)
+def update_period_leaderboards(sender, instance, **kwargs):
+    counters = {
+        metric: getattr(instance, f'{window[0]}_earned_{window[1]}')
+        for metric, window in LEADERBOARD_METRICS.items() if window
+    }
+    starts = {period: getattr(instance, f'{period}_start') for period in WINDOW_PERIODS}
+    employee_id = instance.employee_id
+    transaction.on_commit(lambda: update_stats(employee_id, counters, starts))
+
+@receiver(post_delete, sender=Token)
+def reset_token_cache_for_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
+
+@receiver(m2m_changed, sender=Employee.groups.through)
+@receiver(m2m_changed, sender=Employee.user_permissions.through)
+def reset_role_cache_for_employees(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # Изменили группы или права конкретного сотрудника
+        user_ids = [instance.pk]
+    elif pk_set:
+        # Изменили состав группы (или владельцев права): pk_set - id сотрудников
+        user_ids = list(pk_set)
+    else:
+        # Группу очистили целиком - затронутые сотрудники неизвестны
+        transaction.on_commit(clear_role_cache)
+        return
+    transaction.on_commit(lambda: invalidate_user_roles(*user_ids))
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def reset_role_cache_for_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(clear_role_cache)
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def reset_role_cache(sender, instance, **kwargs):
+    # Переименование или удаление группы/права меняет роли всех её участников
+    transaction.on_commit(clear_role_cache)
+
 @receiver(post_save, sender=TestQuestion)
 @receiver(post_delete, sender=TestQuestion)
 def update_total_questions(sender, instance, **kwargs):
@@ -31,6 +132,55 @@ def update_total_questions(sender, instance, **kwargs):
     total_questions = TestQuestion.objects.filter(test=test).count()
     Test.objects.filter(pk=test.pk).update(total_questions=total_questions)
 
+def reset_test_caches(test_id):
+    # Ключ ответов и содержимое теста перечитываются после фиксации транзакции
+    def invalidate():
+        invalidate_answer_key(test_id)
+        invalidate_test_content(test_id)
+    transaction.on_commit(invalidate)
+
+@receiver(post_save, sender=TestQuestion)
+@receiver(post_delete, sender=TestQuestion)
+@receiver(post_save, sender=Theory)
+@receiver(post_delete, sender=Theory)
+def reset_test_caches_for_content(sender, instance, **kwargs):
+    reset_test_caches(instance.test_id)
+
+@receiver(post_save, sender=Test)
+@receiver(post_delete, sender=Test)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def reset_test_catalog(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_test_catalog)
+
+@receiver(post_save, sender=Employee)
+def reset_test_catalog_for_author(sender, instance, **kwargs):
+    # Имя автора хранится в каталоге; остальные сохранения сотрудников каталог не трогают
+    if is_catalog_author(instance.pk):
+        transaction.on_commit(invalidate_test_catalog)
+
+@receiver(post_delete, sender=Classifications)
+def reset_classification_tree(sender, instance, **kwargs):
+    # Сохранения классификаций обновляют снимок сами (Classifications.save)
+    transaction.on_commit(invalidate_classification_tree)
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def reset_import_author(sender, instance, **kwargs):
+    # Сбрасываем сразу: следующий лог классификации в этой же транзакции должен увидеть нового сотрудника
+    if is_import_author(instance):
+        invalidate_import_author()
+
+@receiver(post_save, sender=AnswerOption)
+@receiver(post_delete, sender=AnswerOption)
+def reset_test_caches_for_option(sender, instance, **kwargs):
+    # При каскадном удалении вопроса его строки уже может не быть - тогда кеши сбросит сигнал вопроса
+    test_id = TestQuestion.objects.filter(pk=instance.question_id).values_list('test_id', flat=True).first()
+    if test_id is not None:
+        reset_test_caches(test_id)
+
 @receiver(post_save, sender=Employee)
 def create_acoin(sender, instance, created, **kwargs):
     if created:
@@ -43,13 +193,43 @@ def update_acoin_balance(sender, instance, created, **kwargs):
         acoin.amount += instance.amount
         acoin.save()
 
-@receiver(pre_delete, sender=models.Model)
-def reorder_ids(sender, instance, **kwargs):
-    model_class = instance.__class__
-    records_to_reorder = model_class.objects.filter(id__gt=instance.id)
-    for record in records_to_reorder:
-        record.id -= 1
-        record.save(update_fields=['id'])
+def remember_stats_key(sender, instance, **kwargs):
+    # Вклад объекта в статистику на момент загрузки; при сохранении счётчики меняются на разницу
+    if not instance.get_deferred_fields():
+        instance._stats_key = EmployeeStats.tracked_key(instance)
+
+# Обработчик подключается раньше award_experience: повторное сохранение обращения
+# с вычисленной сложностью должно прийти уже после учёта самого обращения
+@receiver(post_save, sender=Request)
+@receiver(post_save, sender=Feedback)
+@receiver(post_save, sender=TestAttempt)
+@receiver(post_save, sender=EmployeeAchievement)
+def update_employee_stats_counters(sender, instance, created, **kwargs):
+    new_key = EmployeeStats.tracked_key(instance)
+    try:
+        if created:
+            EmployeeStats.register_change(sender, None, new_key)
+        elif hasattr(instance, '_stats_key'):
+            EmployeeStats.register_change(sender, instance._stats_key, new_key)
+        elif new_key:
+            # Исходное состояние неизвестно - пересчитываем статистику целиком
+            EmployeeStats.rebuild(new_key[0])
+    except Exception as e:
+        print(f"Ошибка при обновлении статистики сотрудника: {e}")
+    instance._stats_key = new_key
+
+@receiver(post_delete, sender=Request)
+@receiver(post_delete, sender=Feedback)
+@receiver(post_delete, sender=TestAttempt)
+@receiver(post_delete, sender=EmployeeAchievement)
+def remove_from_employee_stats(sender, instance, **kwargs):
+    try:
+        EmployeeStats.register_change(sender, getattr(instance, '_stats_key', None), None, create_missing=False)
+    except Exception as e:
+        print(f"Ошибка при обновлении статистики сотрудника: {e}")
+
+for _model in (Request, Feedback, TestAttempt, EmployeeAchievement):
+    post_init.connect(remember_stats_key, sender=_model, dispatch_uid=f'stats_key_{_model._meta.label}')
 
 @receiver(post_save, sender=Employee)
 def assign_group(sender, instance, created, **kwargs):
@@ -67,40 +247,25 @@ def assign_group(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Request)
 def award_experience(sender, instance, created, **kwargs):
     if created or instance.status == 'Completed':
-        # Получаем множители
-        operator_responsible_multiplier = ExperienceMultiplier.objects.filter(
-            name="operator_responsible_multiplier").first()
-        massive_request_multiplier = ExperienceMultiplier.objects.filter(name="massive_request_multiplier").first()
+        # Получаем множители из кеша конфигурации
+        config = get_config()
 
         support_operator = instance.support_operator
         if not support_operator:
             print(f"No support operator found for request {instance.number}")
             return
 
-        # Начальная база опыта, указанная в классификации
-        experience_points = getattr(instance.classification, 'experience_points', None)
+        # База опыта из классификации с учётом множителей за ответственность и массовость
+        experience_points = instance.calculate_experience(
+            config.multiplier("operator_responsible_multiplier"),
+            config.multiplier("massive_request_multiplier"),
+        )
         if not experience_points:
             print(f"No experience points found for classification in request {instance.number}")
             return
 
-        # Применяем множитель за ответственность, если оператор сам завершил обращение
-        responsible_full_name = instance.responsible.split()
-        if len(responsible_full_name) >= 2:
-            responsible_name = f"{responsible_full_name[1]} {responsible_full_name[0]}"  # Имя + Фамилия
-            operator_full_name = f"{support_operator.first_name} {support_operator.last_name}"
-
-            if responsible_name == operator_full_name:
-                if operator_responsible_multiplier:
-                    experience_points *= operator_responsible_multiplier.multiplier
-                    print(f"Experience points after operator_responsible_multiplier: {experience_points}")
-
-        # Применяем множитель за массовое обращение
-        if instance.is_massive and massive_request_multiplier:
-            experience_points *= massive_request_multiplier.multiplier
-            print(f"Experience points after massive_request_multiplier: {experience_points}")
-
         # Теперь определяем сложность на основе итогового значения опыта
-        instance.computed_complexity = instance.compute_complexity(experience_points)
+        instance.computed_complexity = instance.compute_complexity(experience_points, config.complexity_thresholds)
         instance.save(update_fields=['computed_complexity'])
 
         print(f"Final computed complexity of the request based on total experience points: {instance.computed_complexity}")
@@ -134,94 +299,9 @@ def track_experience_and_karma_changes(sender, instance, created, **kwargs):
 def track_shift_late_achievements(sender, instance, created, **kwargs):
     if created:
         try:
-            employee = instance.employee
-
-            # Получаем все достижения по отсутствию опозданий и по отработанным дням
-            achievements = Achievement.objects.filter(type=4)
-
-            # Стрик дней без опозданий
-            shift_history = ShiftHistory.objects.filter(employee=employee).order_by('date')
-
-            max_days_without_late = 0
-            current_streak = 0
-            last_date = None
-
-            for shift in shift_history:
-                if not shift.late:
-                    if last_date:
-                        day_difference = (shift.date - last_date).days
-                        if day_difference > 1:
-                            dates_in_between = [
-                                last_date + timedelta(days=i)
-                                for i in range(1, day_difference)
-                            ]
-                            shifts_in_between = ShiftHistory.objects.filter(
-                                employee=employee,
-                                date__in=dates_in_between
-                            )
-                            if not shifts_in_between.exists():
-                                current_streak += 1
-                            else:
-                                current_streak = 1
-                        else:
-                            current_streak += 1
-                    else:
-                        current_streak = 1
-                    max_days_without_late = max(max_days_without_late, current_streak)
-                else:
-                    current_streak = 0
-                last_date = shift.date
-
-            # Общее количество дней без опозданий
-            total_days_without_late = ShiftHistory.objects.filter(employee=employee, late=False).count()
-
-            # Общее количество отработанных дней
-            total_worked_days = ShiftHistory.objects.filter(employee=employee).values('date').distinct().count()
-
-            for achievement in achievements:
-                if achievement.type_specific_data:
-                    type_data = achievement.type_specific_data
-
-                    # Проверяем достижение на 10 дней подряд без опозданий
-                    if 'streak_days_required' in type_data:
-                        required_streak = type_data['streak_days_required']
-                        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                            employee=employee,
-                            achievement=achievement
-                        )
-                        # Обновляем прогресс по стрику
-                        if max_days_without_late > employee_achievement.progress:
-                            employee_achievement.progress = min(max_days_without_late, required_streak)
-                            if employee_achievement.progress >= required_streak and not employee_achievement.date_awarded:
-                                employee_achievement.date_awarded = timezone.now()
-                            employee_achievement.save()
-                    if 'total_days_required' in type_data:
-                        required_total = type_data['total_days_required']
-                        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                            employee=employee,
-                            achievement=achievement
-                        )
-                        # Обновляем прогресс по общему количеству дней без опозданий
-                        if total_days_without_late > employee_achievement.progress:
-                            employee_achievement.progress = min(total_days_without_late, required_total)
-                            if employee_achievement.progress >= required_total and not employee_achievement.date_awarded:
-                                employee_achievement.date_awarded = timezone.now()
-                            employee_achievement.save()
-
-                    # Проверяем достижение на общее количество отработанных дней
-                    if 'total_worked_days_required' in type_data:
-                        required_worked_days = type_data['total_worked_days_required']
-                        employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                            employee=employee,
-                            achievement=achievement
-                        )
-                        # Обновляем прогресс по общему количеству отработанных дней
-                        if total_worked_days > employee_achievement.progress:
-                            employee_achievement.progress = min(total_worked_days, required_worked_days)
-                            if employee_achievement.progress >= required_worked_days and not employee_achievement.date_awarded:
-                                employee_achievement.date_awarded = timezone.now()
-                            employee_achievement.save()
-
+            # Обновляем накопительные счётчики сотрудника за O(1) вместо пересчёта всей истории смен
+            EmployeeStats.register_shift(instance)
+            enqueue_event(instance.employee, AchievementEvent.SHIFT, instance.pk)
         except Exception as e:
             print(f"Ошибка при обновлении прогресса ачивки: {e}")
 
@@ -240,11 +320,13 @@ def update_achievement_progress(sender, instance, **kwargs):
         employee_achievement.increment_progress()
         employee_achievement.save()
 
+# Модели, изменения которых не попадают в журнал действий
+AUDIT_EXCLUDED_MODELS = [EmployeeActionLog, ShiftHistory, EmployeeLog, Request, UserSession, LogEntry, EmployeeAchievement, Acoin, AcoinTransaction, EmployeeStats, AchievementEvent]
+
 @receiver(post_save)
 def log_model_save(sender, instance, created, **kwargs):
     # Исключаем отслеживание определенных моделей
-    excluded_models = [EmployeeActionLog, ShiftHistory, EmployeeLog, Request, UserSession, LogEntry, EmployeeAchievement, Acoin, AcoinTransaction]
-    if sender in excluded_models:
+    if sender in AUDIT_EXCLUDED_MODELS:
         return
 
     employee = None
@@ -255,10 +337,9 @@ def log_model_save(sender, instance, created, **kwargs):
 
     # Специальная обработка для Classifications
     if sender.__name__ == 'Classifications' and not employee:
-        try:
-            employee = Employee.objects.get(username='oleg')
-        except Employee.DoesNotExist:
-            print("Employee with username 'oleg' does not exist.")
+        employee = get_import_author()
+        if employee is None:
+            print(f"Employee with username '{IMPORT_AUTHOR_USERNAME}' does not exist.")
             return
 
     if not employee:
@@ -271,7 +352,7 @@ def log_model_save(sender, instance, created, **kwargs):
         # Логируем только если достижение завершено и выдано (т.е. есть date_awarded)
         if instance.date_awarded:
             change_description = _handle_employee_achievement_log(instance, employee, sender, action)
-            EmployeeActionLog.objects.create(
+            write_action_log(
                 employee=employee,
                 action_type=action,
                 model_name=sender.__name__,
@@ -281,16 +362,14 @@ def log_model_save(sender, instance, created, **kwargs):
         return  # Выходим из обработчика, чтобы избежать ненужных логов для EmployeeAchievement
 
     # Получаем текущие данные модели
-    current_data = model_to_dict(instance)
+    current_data = take_snapshot(instance)
 
-    # Получаем предыдущие данные модели (если обновление)
+    # Предыдущие данные берём из снимка, сделанного при загрузке объекта (без повторного SELECT)
     old_data = {}
     if not created:
-        try:
-            old_instance = sender.objects.get(pk=instance.pk)
-            old_data = model_to_dict(old_instance)
-        except ObjectDoesNotExist:
-            pass  # В редких случаях объект может быть удален до сигнала
+        old_data = getattr(instance, '_audit_snapshot', {})
+    # Следующее сохранение этого же экземпляра сравнивается с текущим состоянием
+    instance._audit_snapshot = current_data
 
     changes = []
     for field, value in current_data.items():
@@ -311,7 +390,7 @@ def log_model_save(sender, instance, created, **kwargs):
         change_description = "; ".join(changes) if changes else f"{sender.__name__} {action}"
 
     # Логируем изменения для всех остальных моделей
-    EmployeeActionLog.objects.create(
+    write_action_log(
         employee=employee,
         action_type=action,
         model_name=sender.__name__,
@@ -319,6 +398,12 @@ def log_model_save(sender, instance, created, **kwargs):
         description=change_description
     )
 
+# Снимок состояния при загрузке нужен только моделям, изменения которых привязываются к сотруднику
+for _model in apps.get_models():
+    if _model not in AUDIT_EXCLUDED_MODELS and (
+            hasattr(_model, 'employee') or hasattr(_model, 'user') or _model.__name__ == 'Classifications'):
+        post_init.connect(remember_snapshot, sender=_model, dispatch_uid=f'audit_snapshot_{_model._meta.label}')
+
 def _handle_employee_achievement_log(instance, employee, sender, action):
     """
     Обрабатывает логи для модели EmployeeAchievement, когда достижение выдается.
@@ -337,10 +422,11 @@ def _handle_classification_log(instance, old_data, current_data, employee, sende
         if old_data.get('name') != current_data.get('name'):
             changes.append(f"Название изменено с '{old_data.get('name')}' на '{current_data.get('name')}'")
         if old_data.get('parent') != current_data.get('parent'):
-            old_parent = old_data.get('parent')
-            new_parent = current_data.get('parent')
-            old_parent_name = old_parent.name if old_parent else 'None'
-            new_parent_name = new_parent.name if new_parent else 'None'
+            # В снимках хранятся идентификаторы родителя
+            old_parent_id = old_data.get('parent')
+            old_parent_name = sender.objects.filter(pk=old_parent_id).values_list('name', flat=True).first() if old_parent_id else None
+            old_parent_name = old_parent_name or 'None'
+            new_parent_name = instance.parent.name if instance.parent else 'None'
             changes.append(f"Родитель изменен с '{old_parent_name}' на '{new_parent_name}'")
         return "; ".join(changes) if changes else f"{sender.__name__} {action}"
 
@@ -369,152 +455,28 @@ def _handle_test_attempt_log(instance, created, changes, employee, sender, actio
             return "; ".join(changes) if changes else f"{sender.__name__} {action}"
 
 @receiver(post_save, sender=EmployeeLog)
-def track_karma_and_acoin_achievements(sender, instance, created, **kwargs):
-    try:
-        # Получаем текущего сотрудника и тип изменения
-        employee = instance.employee
-        change_type = instance.change_type
-
-        # Получаем текущие дату и время для вычисления периодов
-        today = timezone.now()
-        start_of_day = today.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_of_week = today - timedelta(days=today.weekday())
-        start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_of_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        # Получаем все достижения типа "Indicators"
-        indicator_achievements = Achievement.objects.filter(type=6)
-
-        for achievement in indicator_achievements:
-            type_specific_data = achievement.type_specific_data
-
-            # Логика для кармы
-            if change_type == 'karma':
-                # Заработано кармы
-                if 'karma_earned' in type_specific_data:
-                    required_karma = type_specific_data['karma_earned']
-                    total_karma_earned = EmployeeLog.objects.filter(
-                        employee=employee,
-                        change_type='karma',
-                        new_value__gt=F('old_value')
-                    ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-                    # Найти или создать объект EmployeeAchievement
-                    employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                        employee=employee,
-                        achievement=achievement
-                    )
-
-                    if total_karma_earned >= required_karma and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_karma
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                # Заработать кармы за день, неделю, месяц
-                if 'karma_earned_day' in type_specific_data:
-                    required_karma_day = type_specific_data['karma_earned_day']
-                    karma_earned_day = EmployeeLog.objects.filter(
-                        employee=employee,
-                        change_type='karma',
-                        timestamp__gte=start_of_day,
-                        new_value__gt=F('old_value')
-                    ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-                    if karma_earned_day >= required_karma_day and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_karma_day
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                if 'karma_earned_week' in type_specific_data:
-                    required_karma_week = type_specific_data['karma_earned_week']
-                    karma_earned_week = EmployeeLog.objects.filter(
-                        employee=employee,
-                        change_type='karma',
-                        timestamp__gte=start_of_week,
-                        new_value__gt=F('old_value')
-                    ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-                    if karma_earned_week >= required_karma_week and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_karma_week
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                if 'karma_earned_month' in type_specific_data:
-                    required_karma_month = type_specific_data['karma_earned_month']
-                    karma_earned_month = EmployeeLog.objects.filter(
-                        employee=employee,
-                        change_type='karma',
-                        timestamp__gte=start_of_month,
-                        new_value__gt=F('old_value')
-                    ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-                    if karma_earned_month >= required_karma_month and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_karma_month
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-            # Логика для акоинов
-            if change_type == 'acoins':
-                # Заработать акоины
-                if 'acoins_earned' in type_specific_data:
-                    required_acoins = type_specific_data['acoins_earned']
-                    total_acoins_earned = AcoinTransaction.objects.filter(
-                        employee=employee
-                    ).aggregate(total=Sum('amount'))['total'] or 0
-
-                    # Найти или создать объект EmployeeAchievement
-                    employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                        employee=employee,
-                        achievement=achievement
-                    )
-
-                    if total_acoins_earned >= required_acoins and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_acoins
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                # Заработать акоины за день, неделю, месяц
-                if 'acoins_earned_day' in type_specific_data:
-                    required_acoins_day = type_specific_data['acoins_earned_day']
-                    acoins_earned_day = AcoinTransaction.objects.filter(
-                        employee=employee,
-                        timestamp__gte=start_of_day
-                    ).aggregate(total=Sum('amount'))['total'] or 0
-
-                    if acoins_earned_day >= required_acoins_day and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_acoins_day
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                if 'acoins_earned_week' in type_specific_data:
-                    required_acoins_week = type_specific_data['acoins_earned_week']
-                    acoins_earned_week = AcoinTransaction.objects.filter(
-                        employee=employee,
-                        timestamp__gte=start_of_week
-                    ).aggregate(total=Sum('amount'))['total'] or 0
-
-                    if acoins_earned_week >= required_acoins_week and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_acoins_week
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-                if 'acoins_earned_month' in type_specific_data:
-                    required_acoins_month = type_specific_data['acoins_earned_month']
-                    acoins_earned_month = AcoinTransaction.objects.filter(
-                        employee=employee,
-                        timestamp__gte=start_of_month
-                    ).aggregate(total=Sum('amount'))['total'] or 0
-
-                    if acoins_earned_month >= required_acoins_month and not employee_achievement.date_awarded:
-                        employee_achievement.progress = required_acoins_month
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-            # Сохраняем изменения в объекте EmployeeAchievement
-            employee_achievement.save()
+def update_employee_stats_from_log(sender, instance, created, **kwargs):
+    if created:
+        try:
+            EmployeeStats.register_log(instance)
+        except Exception as e:
+            print(f"Ошибка при обновлении статистики сотрудника: {e}")
 
-    except Exception as e:
-        print(f"Ошибка при отслеживании прогресса показателей: {e}")
+@receiver(post_save, sender=AcoinTransaction)
+def update_employee_stats_from_acoins(sender, instance, created, **kwargs):
+    if created and instance.employee_id:
+        try:
+            EmployeeStats.register_acoin_transaction(instance)
+        except Exception as e:
+            print(f"Ошибка при обновлении статистики сотрудника: {e}")
+
+@receiver(post_save, sender=EmployeeLog)
+def track_karma_and_acoin_achievements(sender, instance, created, **kwargs):
+    if created and instance.change_type in (AchievementEvent.KARMA, AchievementEvent.ACOINS):
+        try:
+            enqueue_event(instance.employee, instance.change_type, instance.pk)
+        except Exception as e:
+            print(f"Ошибка при отслеживании прогресса показателей: {e}")
 def _handle_test_log(instance, created, employee, sender, action):
     """
     Обрабатывает логи для модели Test.
@@ -567,122 +529,14 @@ def field_translation(field):
 def track_test_achievement(sender, instance, created, **kwargs):
     if created and instance.status == TestAttempt.PASSED:
         try:
-            employee = instance.employee
-            test_id = instance.test.id
-
-            # Найти все достижения, которые связаны с данным тестом
-            test_achievements = Achievement.objects.filter(
-                type=5,  # Тип достижения "Тест"
-                type_specific_data__test_id=test_id
-            )
-
-            for achievement in test_achievements:
-                # Проверка выполнения условия (например, процент правильных ответов)
-                required_score = achievement.type_specific_data.get("required_score", None)
-                if required_score is None or instance.score >= required_score:
-                    # Найти или создать EmployeeAchievement
-                    employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                        employee=employee,
-                        achievement=achievement
-                    )
-                    # Если достижение только что создано или прогресс не завершён, обновляем прогресс
-                    if created or employee_achievement.progress < 1:
-                        employee_achievement.progress = 1
-                        employee_achievement.reward_employee()  # Выдаем награду
-                        employee_achievement.date_awarded = timezone.now()  # Фиксируем дату награждения
-                        employee_achievement.save()
-
+            enqueue_event(instance.employee, AchievementEvent.TEST_PASSED, instance.pk)
         except Exception as e:
             print(f"Ошибка при отслеживании прогресса тестового достижения: {e}")
 
 @receiver(post_save, sender=TestAttempt)
 def track_test_attempt_achievements(sender, instance, created, **kwargs):
     try:
-        employee = instance.employee
-
-        # Получаем все достижения, относящиеся к тестам
-        test_achievements = Achievement.objects.filter(type=5)
-
-        # Проверяем, какие достижения связаны с количеством тестов
-        for achievement in test_achievements:
-            if achievement.type_specific_data:
-                type_data = achievement.type_specific_data
-
-                required_tests = type_data.get('total_tests_required')
-                required_successful_tests = type_data.get('successful_tests_required')
-                required_perfect_score_tests = type_data.get('perfect_score_tests_required')
-                required_moderation_tests = type_data.get('moderation_tests_required')
-
-                # Найти или создать объект EmployeeAchievement
-                employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                    employee=employee,
-                    achievement=achievement
-                )
-
-                # Отслеживаем прогресс по каждому условию отдельно
-                progress_total_tests = 0
-                progress_successful_tests = 0
-                progress_perfect_score_tests = 0
-                progress_moderation_tests = 0
-                total_conditions = 0
-                fulfilled_conditions = 0
-
-                # Отслеживаем прогресс по общему количеству выполненных тестов
-                if required_tests is not None:
-                    total_tests_completed = TestAttempt.objects.filter(
-                        employee=employee, status=TestAttempt.PASSED
-                    ).count()
-                    progress_total_tests = min(total_tests_completed, required_tests)
-                    total_conditions += 1
-                    if total_tests_completed >= required_tests:
-                        fulfilled_conditions += 1
-
-                # Отслеживаем прогресс по успешным тестам
-                if required_successful_tests is not None:
-                    successful_tests_completed = TestAttempt.objects.filter(
-                        employee=employee,
-                        status=TestAttempt.PASSED
-                    ).count()
-                    progress_successful_tests = min(successful_tests_completed, required_successful_tests)
-                    total_conditions += 1
-                    if successful_tests_completed >= required_successful_tests:
-                        fulfilled_conditions += 1
-
-                # Отслеживаем прогресс по тестам, выполненным на 100%
-                if required_perfect_score_tests is not None:
-                    perfect_score_tests_completed = TestAttempt.objects.filter(
-                        employee=employee,
-                        score=instance.test.max_score
-                    ).count()
-                    progress_perfect_score_tests = min(perfect_score_tests_completed, required_perfect_score_tests)
-                    total_conditions += 1
-                    if perfect_score_tests_completed >= required_perfect_score_tests:
-                        fulfilled_conditions += 1
-
-                # Отслеживаем прогресс по модерации тестов
-                if required_moderation_tests is not None:
-                    moderation_tests_completed = TestAttempt.objects.filter(
-                        employee=employee,
-                        status=TestAttempt.MODERATION
-                    ).count()
-                    progress_moderation_tests = min(moderation_tests_completed, required_moderation_tests)
-                    total_conditions += 1
-                    if moderation_tests_completed >= required_moderation_tests:
-                        fulfilled_conditions += 1
-
-                # Обновляем прогресс достижения
-                total_progress = (progress_total_tests + progress_successful_tests +
-                                 progress_perfect_score_tests + progress_moderation_tests)
-                employee_achievement.progress = total_progress
-
-                # Если все указанные условия выполнены, фиксируем дату награждения и выдаем награду
-                if fulfilled_conditions == total_conditions and not employee_achievement.date_awarded:
-                    employee_achievement.reward_employee()
-                    employee_achievement.date_awarded = timezone.now()
-
-                # Сохраняем изменения в объекте EmployeeAchievement
-                employee_achievement.save()
-
+        enqueue_event(instance.employee, AchievementEvent.TEST_ATTEMPT, instance.pk)
     except Exception as e:
         print(f"Ошибка при отслеживании прогресса теста: {e}")
 receiver(post_save, sender=Feedback)
@@ -692,80 +546,13 @@ def track_praise_achievement(sender, instance, created, **kwargs):
     """
     if created and instance.type == 'praise':  # Проверяем, что это новый объект с типом 'praise'
         try:
-            employee = instance.target_employee
-
-            # Получаем все достижения, относящиеся к овациям (похвалам)
-            praise_achievements = Achievement.objects.filter(type=7)  # 7 соответствует типу "Овации"
-
-            for achievement in praise_achievements:
-                type_data = achievement.type_specific_data
-
-                # Получаем необходимые параметры из type_specific_data
-                required_praises_total = type_data.get('required_praises_total', None)
-                required_days_in_a_row = type_data.get('required_days_in_a_row', None)
-
-                # Найти или создать объект EmployeeAchievement для отслеживания прогресса
-                employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                    employee=employee,
-                    achievement=achievement
-                )
-
-                # Отслеживаем количество полученных похвал
-                total_praises = Feedback.objects.filter(
-                    target_employee=employee,
-                    type='praise',
-                    status='approved'
-                ).count()
-
-                # Проверка условий для достижения
-                fulfilled_conditions = 0
-                total_conditions = 0
-
-                # 1. Проверка общего количества похвал
-                if required_praises_total is not None:
-                    if total_praises >= required_praises_total:
-                        fulfilled_conditions += 1
-                    total_conditions += 1
-
-                # 2. Проверка на дни подряд с похвалами
-                if required_days_in_a_row is not None:
-                    praise_dates = Feedback.objects.filter(
-                        target_employee=employee,
-                        type='praise',
-                        status='approved'
-                    ).values_list('created_at', flat=True).distinct()
-
-                    # Подсчет последовательных дней
-                    consecutive_days = 1
-                    previous_date = None
-                    for date in sorted(praise_dates):
-                        if previous_date and (date - previous_date).days == 1:
-                            consecutive_days += 1
-                        else:
-                            consecutive_days = 1
-                        previous_date = date
-
-                        if consecutive_days >= required_days_in_a_row:
-                            fulfilled_conditions += 1
-                            break
-                    total_conditions += 1
-
-                # Если все условия выполнены, обновляем ачивку
-                if fulfilled_conditions == total_conditions and not employee_achievement.date_awarded:
-                    employee_achievement.progress = 1
-                    employee_achievement.reward_employee()
-                    employee_achievement.date_awarded = timezone.now()
-
-                employee_achievement.save()
-
+            enqueue_event(instance.target_employee, AchievementEvent.PRAISE, instance.pk)
         except Exception as e:
             print(f"Ошибка при отслеживании прогресса достижения для оваций: {e}")
-@receiver(post_delete)
-def log_model_delete(sender, instance, **kwargs):
-    excluded_models = [EmployeeActionLog, ShiftHistory, EmployeeLog, Request]
-    if sender in excluded_models:
-        return
+AUDIT_DELETE_EXCLUDED_MODELS = (EmployeeActionLog, ShiftHistory, EmployeeLog, Request, EmployeeStats, AchievementEvent)
+
 
+def log_model_delete(sender, instance, **kwargs):
     employee = None
     if hasattr(instance, 'employee'):
         employee = instance.employee
@@ -775,13 +562,19 @@ def log_model_delete(sender, instance, **kwargs):
     if not employee:
         return
 
-    EmployeeActionLog.objects.create(
+    write_action_log(
         employee=employee,
         action_type='deleted',
         model_name=sender.__name__,
         object_id=str(instance.pk),
         description=f"{sender.__name__} был удален"
     )
+
+# Подключаем только к моделям, удаление которых журналируется: у остальных моделей без
+# обработчиков удаления QuerySet.delete() выполняется одним DELETE без загрузки строк
+for _model in apps.get_models():
+    if _model not in AUDIT_DELETE_EXCLUDED_MODELS and (hasattr(_model, 'employee') or hasattr(_model, 'user')):
+        post_delete.connect(log_model_delete, sender=_model, dispatch_uid=f'audit_delete_{_model._meta.label}')
 @receiver(pre_delete, sender=Employee)
 def delete_related_logs(sender, instance, **kwargs):
     EmployeeActionLog.objects.filter(employee=instance).delete()
@@ -789,135 +582,18 @@ def delete_related_logs(sender, instance, **kwargs):
 
 @receiver(post_save, sender=Request)
 def track_request_classification(sender, instance, created, **kwargs):
-    if created:
+    if created and instance.support_operator_id:
         try:
-            employee = instance.support_operator
-            request_classification = instance.classification
-            is_massive = instance.is_massive
-            request_complexity = instance.get_complexity()  # Метод для получения сложности обращения ('simple', 'medium', 'hard')
-
-            # Фильтрация достижений типа "Обращения" (type=1)
-            request_achievements = Achievement.objects.filter(type=1)
-
-            for achievement in request_achievements:
-                # Получаем данные из type_specific_data для каждого достижения
-                type_specific_data = achievement.type_specific_data
-                required_requests_count = type_specific_data.get("required_requests_count")
-                required_classification_ids = type_specific_data.get("classification_ids", [])
-                required_complexity = type_specific_data.get("required_complexity")  # Значение: 'simple', 'medium', 'hard'
-                is_massive_required = type_specific_data.get("is_massive", False)
-
-                # Проверяем соответствие классификации, сложности и типа обращения
-                if (request_classification.id in required_classification_ids and
-                        request_complexity == required_complexity and
-                        is_massive == is_massive_required):
-
-                    # Найти или создать объект EmployeeAchievement
-                    employee_achievement, _ = EmployeeAchievement.objects.get_or_create(
-                        employee=employee,
-                        achievement=achievement
-                    )
-
-                    # Увеличить прогресс на 1
-                    if required_requests_count:
-                        current_progress = employee_achievement.progress + 1
-                        employee_achievement.progress = current_progress
-                        progress_percent = min(current_progress / required_requests_count, 1.0) * 100
-
-                        # Обновляем процент выполнения достижения
-                        employee_achievement.progress_percent = progress_percent
-
-                        # Проверяем, достигнут ли необходимый прогресс для награждения
-                        if current_progress >= required_requests_count and not employee_achievement.date_awarded:
-                            employee_achievement.reward_employee()
-                            employee_achievement.date_awarded = timezone.now()
-
-                        # Сохраняем изменения в объекте EmployeeAchievement
-                        employee_achievement.save()
-
+            enqueue_event(instance.support_operator, AchievementEvent.REQUEST, instance.pk)
         except Exception as e:
             print(f"Ошибка при обновлении прогресса ачивки: {e}")
 
 @receiver(post_save, sender=Employee)
-def track_employee_level_and_experience(sender, instance, **kwargs):
+def track_employee_level_and_experience(sender, instance, update_fields=None, **kwargs):
+    # Сохранения, не затрагивающие уровень и опыт (например, last_login), достижения не меняют
+    if update_fields is not None and not {'level', 'experience'} & set(update_fields):
+        return
     try:
-        # Получаем текущий уровень и опыт сотрудника
-        current_level = instance.level
-        current_exp = instance.experience
-        today = timezone.now()
-        start_of_week = today - timedelta(days=today.weekday())
-        start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        # Фильтрация достижений типа "NewLvl" (type=3)
-        level_achievements = Achievement.objects.filter(type=3)
-
-        total_experience_earned_week = EmployeeLog.objects.filter(
-            employee=instance,
-            change_type='experience',
-            timestamp__gte=start_of_week,
-            new_value__gt=F('old_value')
-        ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-        for achievement in level_achievements:
-            type_specific_data = achievement.type_specific_data
-            required_level = type_specific_data.get("required_level")
-            exp_earned = type_specific_data.get("exp_earned")
-            exp_earned_week = type_specific_data.get("exp_earned_week")
-
-            # Найти или создать объект EmployeeAchievement
-            employee_achievement, created = EmployeeAchievement.objects.get_or_create(
-                employee=instance,
-                achievement=achievement
-            )
-
-            # Обработайте случаи, если объект не создан
-            if not employee_achievement:
-                continue  # Или добавьте соответствующую обработку ошибок
-
-            # Инициализируем список для хранения прогрессов по каждому условию
-            progress_values = []
-
-            # Проверяем прогресс по уровню
-            if required_level is not None:
-                level_progress = min(current_level / required_level, 1.0) * 100  # Прогресс по уровню в процентах
-                progress_values.append(level_progress)
-
-                # Обновляем прогресс, если уровень достигнут
-                if current_level >= required_level:
-                    employee_achievement.progress = required_level
-                    if not employee_achievement.date_awarded:
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-            # Проверяем прогресс по общему заработанному опыту
-            if exp_earned is not None:
-                experience_progress = min(current_exp / exp_earned, 1.0) * 100  # Прогресс по опыту в процентах
-                progress_values.append(experience_progress)
-
-                if current_exp >= exp_earned:
-                    employee_achievement.progress = exp_earned
-                    if not employee_achievement.date_awarded:
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-            # Проверяем прогресс по заработанному опыту за неделю
-            if exp_earned_week is not None:
-                weekly_exp_progress = min(total_experience_earned_week / exp_earned_week, 1.0) * 100  # Прогресс по неделе
-                progress_values.append(weekly_exp_progress)
-
-                if total_experience_earned_week >= exp_earned_week:
-                    employee_achievement.progress = exp_earned_week
-                    if not employee_achievement.date_awarded:
-                        employee_achievement.reward_employee()
-                        employee_achievement.date_awarded = timezone.now()
-
-            # Рассчитываем общий прогресс
-            if progress_values:
-                overall_progress_percent = min(progress_values)  # Общий прогресс равен минимальному из всех условий
-                employee_achievement.progress_percent = overall_progress_percent
-
-            # Сохраняем изменения в объекте EmployeeAchievement
-            employee_achievement.save()
-
+        enqueue_event(instance, AchievementEvent.LEVEL)
     except Exception as e:
         print(f"Ошибка при отслеживании прогресса уровня и опыта: {e}")
@@ -0,0 +1,130 @@
+"""
+Сводная статистика для StatisticsAPIView и FullStatisticsAPIView.
+
+Каждый раздел собирается фиксированным числом запросов (GROUP BY и
+подзапросы) независимо от количества сотрудников и тестов. Готовые разделы
+хранятся в памяти процесса STATISTICS_TTL секунд; при STATISTICS_TTL = 0
+статистика считается заново на каждый запрос.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import AcoinTransaction, Employee, EmployeeAchievement, Test, TestAttempt
+
+
+def _count_subquery(queryset):
+    return Coalesce(Subquery(
+        queryset.filter(employee_id=OuterRef('pk')).order_by().values('employee_id')
+        .annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField(),
+    ), Value(0))
+
+
+def _sum_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(employee_id=OuterRef('pk')).order_by().values('employee_id')
+        .annotate(total=Sum(field)).values('total'),
+        output_field=IntegerField(),
+    ), Value(0))
+
+
+def employee_balances():
+    """Баланс A-коинов, опыт и число достижений сотрудников (StatisticsAPIView), один запрос."""
+    employees = Employee.objects.order_by('pk').annotate(
+        total_achievements=_count_subquery(EmployeeAchievement.objects.all()),
+    ).values_list('id', 'experience', 'acoin__amount', 'total_achievements')
+    return [
+        {
+            "employee_id": employee_id,
+            "total_acoins": acoins or 0,
+            "total_experience": experience,
+            "total_achievements": total_achievements,
+        }
+        for employee_id, experience, acoins, total_achievements in employees
+    ]
+
+
+def employee_totals():
+    """Сумма транзакций A-коинов, опыт и число достижений сотрудников (FullStatisticsAPIView), один запрос."""
+    employees = Employee.objects.order_by('pk').annotate(
+        total_acoins=_sum_subquery(AcoinTransaction.objects.all(), 'amount'),
+        total_achievements=_count_subquery(EmployeeAchievement.objects.all()),
+    ).values_list('id', 'experience', 'total_acoins', 'total_achievements')
+    return [
+        {
+            "employee_id": employee_id,
+            "total_acoins": total_acoins,
+            "total_experience": experience,
+            "total_achievements": total_achievements,
+        }
+        for employee_id, experience, total_acoins, total_achievements in employees
+    ]
+
+
+def test_durations(test_ids):
+    """Длительность пройденных попыток по тестам: средняя, максимальная и по сотрудникам, один запрос."""
+    durations = OrderedDict((test_id, []) for test_id in test_ids)
+    attempts = TestAttempt.objects.filter(
+        status=TestAttempt.PASSED, start_time__isnull=False, end_time__isnull=False,
+    ).order_by('pk').values_list('test_id', 'employee_id', 'start_time', 'end_time')
+    for test_id, employee_id, start_time, end_time in attempts:
+        if test_id in durations:
+            durations[test_id].append({"employee_id": employee_id, "duration": (end_time - start_time).total_seconds()})
+
+    return {
+        test_id: {
+            "average_duration": sum(item["duration"] for item in items) / len(items) if items else None,
+            "max_duration": max(item["duration"] for item in items) if items else None,
+            "individual_durations": items,
+        }
+        for test_id, items in durations.items()
+    }
+
+
+def test_score_percentages(test_ids):
+    """Средний балл пройденных попыток по тестам (с округлением вверх), один GROUP BY."""
+    scores = {
+        row['test_id']: math.ceil(row['total_score'] / row['attempts']) if row['total_score'] is not None else 0
+        for row in TestAttempt.objects.filter(status=TestAttempt.PASSED).values('test_id').annotate(
+            attempts=Count('pk'), total_score=Sum('score'),
+        ).order_by()
+    }
+    return {test_id: scores.get(test_id, 0) for test_id in test_ids}
+
+
+def test_summary():
+    """Длительности и средние баллы по всем тестам: три запроса."""
+    test_ids = list(Test.objects.order_by('pk').values_list('pk', flat=True))
+    return {
+        "test_duration_statistics": test_durations(test_ids),
+        "test_score_percentage": test_score_percentages(test_ids),
+    }
+
+
+# название раздела -> (данные, время сборки)
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def get_statistics(name, build):
+    """Раздел статистики из кеша или, если он устарел, заново через build()."""
+    ttl = getattr(settings, 'STATISTICS_TTL', 60)
+    entry = _snapshots.get(name)
+    if ttl and entry is not None and time.monotonic() - entry[1] < ttl:
+        return entry[0]
+    data = build()
+    if ttl:
+        with _lock:
+            _snapshots[name] = (data, time.monotonic())
+    return data
+
+
+def clear_statistics():
+    with _lock:
+        _snapshots.clear()
@@ -0,0 +1,175 @@
+"""
+Потоковая отдача больших JSON-ответов и keyset-пагинация.
+
+В потоковом режиме (?stream=1) строки читаются из базы через
+QuerySet.iterator(chunk_size=STREAM_CHUNK_SIZE) и сразу пишутся в ответ
+(StreamingHttpResponse), поэтому память на запрос не растёт вместе с таблицей.
+Keyset-пагинация (?after=<timestamp>,<id>&limit=N) продолжает выборку с
+последней строки предыдущей страницы по индексу, без OFFSET; курсор
+следующей страницы возвращается в поле "next".
+"""
+import datetime
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+# Сколько строк читать из базы за один раз в потоковом режиме
+STREAM_CHUNK_SIZE = 1000
+# Размер страницы keyset-пагинации по умолчанию и максимальный
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Сколько символов копить перед отправкой очередного куска ответа
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def dumps(value):
+    # Тот же формат, что у JSONRenderer DRF
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def is_stream_requested(request):
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def is_keyset_requested(request):
+    return 'after' in request.query_params or 'limit' in request.query_params
+
+
+def parse_after(value):
+    """Курсор "<timestamp>,<id>" -> (datetime, id)."""
+    moment, _, pk = (value or '').rpartition(',')
+    # "+" часового пояса в незакодированной строке запроса приходит пробелом
+    moment = parse_datetime(moment.strip().replace(' ', '+'))
+    if moment is None or not pk.strip().isdigit():
+        raise ValidationError({'after': 'Ожидается курсор вида "<timestamp>,<id>".'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment, int(pk)
+
+
+def parse_date_range(request):
+    """
+    (начало, конец) из ?date_from и ?date_to (дата или дата и время) или None.
+    Дата в date_to включает весь день, поэтому конец - исключающая граница.
+    """
+    bounds = []
+    for name in ('date_from', 'date_to'):
+        value = request.query_params.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        moment = parse_datetime(value.replace(' ', '+')) if 'T' in value else None
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValidationError({name: 'Ожидается дата (YYYY-MM-DD) или дата и время в ISO 8601.'})
+            moment = datetime.datetime.combine(day, datetime.time.min)
+            if name == 'date_to':
+                moment += datetime.timedelta(days=1)
+        elif name == 'date_to':
+            moment += datetime.timedelta(microseconds=1)
+        bounds.append(timezone.make_aware(moment) if timezone.is_naive(moment) else moment)
+    return tuple(bounds)
+
+
+def encode_cursor(moment, pk):
+    return f"{moment.isoformat()},{pk}"
+
+
+def keyset_params(request):
+    """(курсор или None, размер страницы или None - вся выборка)."""
+    after = parse_after(request.query_params['after']) if 'after' in request.query_params else None
+    if not is_keyset_requested(request):
+        return after, None
+    try:
+        limit = int(request.query_params.get('limit', DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise ValidationError({'limit': 'Ожидается целое число.'})
+    return after, min(max(limit, 1), MAX_LIMIT)
+
+
+def keyset(queryset, time_field, after=None):
+    """Выборка от новых к старым по (time_field, id), начиная после курсора after."""
+    queryset = queryset.order_by(f'-{time_field}', '-pk')
+    if after is not None:
+        moment, pk = after
+        queryset = queryset.filter(Q(**{f'{time_field}__lt': moment}) | Q(**{time_field: moment, 'pk__lt': pk}))
+    return queryset
+
+
+def _field(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class KeysetPage:
+    """
+    Итератор по странице выборки (или по всей выборке при limit=None) через
+    iterator(); запоминает последнюю строку для курсора следующей страницы.
+    """
+
+    def __init__(self, queryset, time_field, limit=None, serialize=None):
+        self.rows = queryset[:limit] if limit else queryset
+        self.time_field = time_field
+        self.limit = limit
+        self.serialize = serialize or (lambda row: row)
+        self.count = 0
+        self.last = None
+
+    def __iter__(self):
+        for row in self.rows.iterator(chunk_size=STREAM_CHUNK_SIZE):
+            self.count += 1
+            self.last = row
+            yield self.serialize(row)
+
+    def next_cursor(self):
+        """Курсор следующей страницы или None, если страница последняя (вызывать после обхода)."""
+        if not self.limit or self.count < self.limit:
+            return None
+        pk = self.last['id'] if isinstance(self.last, dict) else self.last.pk
+        return encode_cursor(_field(self.last, self.time_field), pk)
+
+
+def iter_json_array(items):
+    yield '['
+    for index, item in enumerate(items):
+        yield dumps(item) if index == 0 else ',' + dumps(item)
+    yield ']'
+
+
+def iter_json_object(fields):
+    """
+    JSON-объект из пар (ключ, значение). Итераторы и генераторы пишутся массивом
+    по одному элементу; функции вызываются в момент записи своего поля, поэтому
+    могут использовать то, что накоплено при записи предыдущих полей.
+    """
+    yield '{'
+    for index, (key, value) in enumerate(fields):
+        yield ('' if index == 0 else ',') + dumps(key) + ':'
+        if callable(value):
+            value = value()
+        if value is None or isinstance(value, (dict, list, tuple, str, int, float, bool)):
+            yield dumps(value)
+        else:
+            yield from iter_json_array(value)
+    yield '}'
+
+
+def _buffered(chunks):
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= WRITE_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def streaming_json_response(chunks):
+    return StreamingHttpResponse(_buffered(chunks), content_type='application/json')
@@ -0,0 +1,77 @@
+"""
+Каталог тем и тестов для ThemesWithTestsView.
+
+Общая для всех сотрудников часть (темы, тесты, названия достижений, авторы)
+собирается двумя запросами и хранится в памяти процесса. Для сотрудника
+поверх неё считаются только статус последней попытки и доступность теста.
+Каталог сбрасывается при изменении тем, тестов, достижений и авторов тестов
+(см. signals.py) и по истечении TEST_CATALOG_TTL секунд.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Test, Theme
+
+
+class TestCatalog:
+    def __init__(self):
+        tests_by_theme = defaultdict(list)
+        self.author_ids = set()
+        tests = Test.objects.select_related('achievement', 'author').order_by('pk').only(
+            'id', 'name', 'theme_id', 'required_karma', 'min_experience', 'created_at', 'max_score',
+            'retry_delay_days', 'can_attempt_twice', 'achievement__name',
+            'author__first_name', 'author__last_name',
+        )
+        for test in tests:
+            if test.author_id:
+                self.author_ids.add(test.author_id)
+            tests_by_theme[test.theme_id].append({
+                'id': test.id,
+                'name': test.name,
+                'required_karma': test.required_karma,
+                'min_experience': test.min_experience,
+                'achievement': test.achievement.name if test.achievement else None,
+                'created_at': test.created_at.strftime("%Y-%m-%dT%H:%M"),
+                'author': f"{test.author.first_name} {test.author.last_name}" if test.author else None,
+                'max_score': test.max_score,
+                'retry_delay_days': test.retry_delay_days,
+                'can_attempt_twice': test.can_attempt_twice,
+            })
+        # (id темы, название, тесты темы) в порядке названий тем
+        self.themes = [
+            (theme_id, name, tests_by_theme[theme_id])
+            for theme_id, name in Theme.objects.order_by('name').values_list('id', 'name')
+        ]
+
+
+_catalog = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_test_catalog():
+    global _catalog, _built_at
+    ttl = getattr(settings, 'TEST_CATALOG_TTL', 300)
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - _built_at < ttl:
+        return catalog
+    with _lock:
+        if _catalog is None or time.monotonic() - _built_at >= ttl:
+            _catalog = TestCatalog()
+            _built_at = time.monotonic()
+        return _catalog
+
+
+def is_catalog_author(employee_id):
+    """Упоминается ли сотрудник в каталоге как автор теста (тогда его переименование сбрасывает каталог)."""
+    catalog = _catalog
+    return catalog is not None and employee_id in catalog.author_ids
+
+
+def invalidate_test_catalog():
+    global _catalog
+    with _lock:
+        _catalog = None
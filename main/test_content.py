@@ -0,0 +1,117 @@
+"""
+Содержимое тестов (вопросы с вариантами ответов и теория) для get_test_by_id
+и get_test_with_theory.
+
+Содержимое теста собирается тремя запросами (вопросы, варианты ответов,
+теория) и хранится уже отсортированным по позиции. Картинки хранятся
+относительными URL и превращаются в абсолютные для каждого запроса, поэтому
+кеш не зависит от хоста. Доступность теста для сотрудника считается во view
+поверх кеша. Кеш сбрасывается при изменении вопросов, вариантов ответов и
+теории (см. signals.py) и по истечении TEST_CONTENT_TTL секунд.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import TestQuestion, Theory
+
+
+def _image_url(image):
+    return image.url if image else None
+
+
+class TestContent:
+    def __init__(self, test_id):
+        questions = list(TestQuestion.objects.filter(test_id=test_id).prefetch_related('answer_options'))
+        theories = list(Theory.objects.filter(test_id=test_id).order_by('position'))
+
+        # Блоки для get_test_by_id: вопросы и теория вперемешку по позиции (вопросы раньше при равной позиции)
+        blocks = [
+            {
+                'type': 'question',
+                'content': {
+                    'question_text': question.question_text,
+                    'duration_seconds': question.duration_seconds,
+                    'question_type': question.question_type,
+                    'points': question.points,
+                    'explanation': question.explanation,
+                    'image': _image_url(question.image),
+                    'position': question.position,
+                    'answer_options': [
+                        {'option_text': option.option_text, 'is_correct': option.is_correct}
+                        for option in question.answer_options.all()
+                    ],
+                },
+            }
+            for question in sorted(questions, key=lambda question: question.position)
+        ]
+        blocks += [
+            {
+                'type': 'theory',
+                'content': {
+                    'title': theory.title,
+                    'text': theory.text,
+                    'image': _image_url(theory.image),
+                    'position': theory.position,
+                },
+            }
+            for theory in theories
+        ]
+        self.blocks = sorted(blocks, key=lambda block: block['content']['position'])
+
+        # Для get_test_with_theory: перед каждым вопросом (в порядке id) идёт вся теория теста
+        theory_blocks = [{'type': 'theory', 'text': theory.text} for theory in theories]
+        self.questions_with_theory = []
+        for question in questions:
+            self.questions_with_theory += theory_blocks
+            self.questions_with_theory.append({
+                'type': 'question',
+                'question_text': question.question_text,
+                'question_type': question.question_type,
+                'points': question.points,
+                'explanation': question.explanation,
+                'answer_options': [
+                    {'option_text': option.option_text, 'is_correct': option.is_correct}
+                    for option in question.answer_options.all()
+                ],
+            })
+
+    def render_blocks(self, request):
+        """Блоки с абсолютными URL картинок; кешированные словари не изменяются."""
+        return [
+            {
+                'type': block['type'],
+                'content': dict(
+                    block['content'],
+                    image=request.build_absolute_uri(block['content']['image']) if block['content']['image'] else None,
+                ),
+            }
+            for block in self.blocks
+        ]
+
+
+# id теста -> (содержимое, время сборки)
+_contents = {}
+_lock = threading.Lock()
+
+
+def get_test_content(test_id):
+    ttl = getattr(settings, 'TEST_CONTENT_TTL', 300)
+    entry = _contents.get(test_id)
+    if entry is not None and time.monotonic() - entry[1] < ttl:
+        return entry[0]
+    content = TestContent(test_id)
+    with _lock:
+        _contents[test_id] = (content, time.monotonic())
+    return content
+
+
+def invalidate_test_content(test_id):
+    with _lock:
+        _contents.pop(test_id, None)
+
+
+def clear_test_contents():
+    with _lock:
+        _contents.clear()
@@ -1,5 +1,45 @@
+import datetime
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+
+import pandas as pd
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
-from main.models import Test, TestAttempt, Employee, Achievement, EmployeeAchievement, AcoinTransaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from main.achievement_engine import process_pending_events
+from main.activity import flush_activity, pending_activity, record_activity
+from main.achievement_rules import AchievementRuleIndex, get_rule_index, invalidate_rule_index
+from main.answer_keys import clear_answer_keys, get_answer_key
+from main.audit import invalidate_import_author
+from main.classification_tree import get_classification_tree, invalidate_classification_tree, \
+    upsert_classification_paths
+from main.authentication import clear_token_cache, get_token_user
+from main.config import get_config, invalidate_config
+from main.retention import apply_retention
+from main.leaderboard import Leaderboard, SortedKeys, get_leaderboard, invalidate_leaderboards
+from main.roles import clear_role_cache, user_has_perm, user_in_group
+from main.statistics import clear_statistics, employee_balances
+from main.test_catalog import invalidate_test_catalog
+from main.test_content import clear_test_contents
+from main.models import Test, TestAttempt, Employee, Achievement, EmployeeAchievement, AcoinTransaction, \
+    ShiftHistory, EmployeeStats, AchievementEvent, EmployeeActionLog, SurveyAnswer, SurveyQuestion, Classifications, \
+    Request, Feedback, EmployeeLog, LevelConfiguration, EarningBucket, AttemptAnswer, Theme, TestQuestion, AnswerOption, Theory, SystemSetting, ExperienceMultiplier, KarmaSettings, FilePath, Background
+from main.serializers import PlayersSerializer
+from scripts.class_script import bulk_add_requests, insert_requests
+from scripts.tasks import load_shifts, parse_shift_cells
+from main.views import get_active_users, question_answer_counts
 
 class AchievementTestCase(TestCase):
     def setUp(self):
@@ -35,3 +75,972 @@ class AchievementTestCase(TestCase):
         self.employee.refresh_from_db()
         self.assertEqual(self.employee.experience, 50)
         self.assertEqual(self.employee.acoins, 100)
+
+
+class EmployeeStatsTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="stats", first_name="Иван", last_name="Иванов")
+
+    def add_shift(self, day, late=False, start=datetime.time(9, 0)):
+        return ShiftHistory.objects.create(
+            employee=self.employee, date=datetime.date(2024, 5, day),
+            scheduled_start=start, scheduled_end=datetime.time(18, 0),
+            actual_start=start, actual_end=datetime.time(18, 0),
+            karma_change=0, experience_change=0, late=late
+        )
+
+    def test_profile_without_statistics_does_not_build_rollup(self):
+        EmployeeStats.objects.filter(employee=self.employee).delete()
+        employee = Employee.objects.get(pk=self.employee.pk)
+        self.assertEqual(PlayersSerializer(employee).data['statistics'], {})
+        self.assertFalse(EmployeeStats.objects.filter(employee=self.employee).exists())
+
+        employee.profile_settings = {"show_worked_days": True}
+        self.assertEqual(PlayersSerializer(employee).data['statistics'], {'worked_days': 0})
+        self.assertTrue(EmployeeStats.objects.filter(employee=self.employee).exists())
+
+    def test_lazy_rebuild_backfills_buckets_for_old_history(self):
+        self.employee.add_karma(5, source="test")
+        # История до появления дневных корзин: записи журнала есть, корзин и счётчиков нет
+        EmployeeLog.objects.filter(employee=self.employee).update(
+            timestamp=timezone.now() - datetime.timedelta(days=10))
+        EarningBucket.objects.filter(employee=self.employee).delete()
+        EmployeeStats.objects.filter(employee=self.employee).delete()
+
+        employee = Employee.objects.get(pk=self.employee.pk)
+        employee.add_karma(3, source="test")
+        stats = EmployeeStats.objects.get(employee=self.employee)
+        self.assertEqual((stats.karma_earned, stats.karma_earned_day), (8, 3))
+        self.assertEqual(EarningBucket.totals('karma', employee_id=self.employee.pk), {self.employee.pk: 8})
+
+    def test_shift_counters_are_incremental(self):
+        for day in (1, 2, 3):
+            self.add_shift(day)
+        self.add_shift(4, late=True)
+        self.add_shift(5)
+        self.add_shift(5, start=datetime.time(12, 0))
+
+        stats = EmployeeStats.objects.get(employee=self.employee)
+        self.assertEqual(stats.current_streak, 2)
+        self.assertEqual(stats.max_streak, 3)
+        self.assertEqual(stats.days_without_late, 5)
+        self.assertEqual(stats.late_count, 1)
+        self.assertEqual(stats.worked_days, 5)
+
+    def test_backdated_shift_matches_rebuild(self):
+        self.add_shift(3)
+        self.add_shift(4)
+        self.add_shift(1, late=True)
+
+        stats = EmployeeStats.objects.get(employee=self.employee)
+        rebuilt = EmployeeStats.rebuild(self.employee)
+        self.assertEqual(stats.max_streak, rebuilt.max_streak)
+        self.assertEqual(stats.worked_days, 3)
+
+    def test_karma_counters(self):
+        self.employee.add_karma(5, source="test")
+        self.employee.add_karma(-3, source="test")
+        stats = EmployeeStats.objects.get(employee=self.employee)
+        self.assertEqual(stats.counter('karma_earned'), 5)
+        self.assertEqual(stats.counter('karma_earned_week'), 5)
+
+    def test_profile_counters_match_rebuild(self):
+        classification = Classifications.objects.create(name="Интернет", experience_points=10)
+        now = timezone.now()
+        Request.objects.create(number="1", classification=classification, responsible="-", initiator="-",
+                               support_operator=self.employee, status="Registered", date=now)
+        request = Request.objects.create(number="2", classification=classification, responsible="-", initiator="-",
+                                         support_operator=self.employee, status="Registered", date=now,
+                                         is_massive=True)
+        feedback = Feedback.objects.create(type="praise", text="Спасибо", target_employee=self.employee)
+        feedback = Feedback.objects.get(pk=feedback.pk)
+        feedback.status = "approved"
+        feedback.save()
+        Request.objects.get(pk=request.pk).delete()
+
+        stats = EmployeeStats.objects.get(employee=self.employee)
+        self.assertEqual((stats.requests_total, stats.massive_requests_total, stats.praises_count), (1, 0, 1))
+        self.assertEqual(stats.requests_by_classification[str(classification.id)], [1, 1, 1])
+
+        rebuilt = EmployeeStats.rebuild(self.employee)
+        for field in ('requests_total', 'requests_month', 'requests_week', 'simple_requests', 'medium_requests',
+                      'hard_requests', 'requests_by_classification', 'praises_count', 'complaints_count'):
+            self.assertEqual(getattr(stats, field), getattr(rebuilt, field), field)
+
+
+class LevelUpTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        LevelConfiguration.invalidate_settings()
+        self.employee = Employee.objects.create(username="level", first_name="Олег", last_name="Олегов")
+
+    def test_level_matches_curve(self):
+        settings = LevelConfiguration.get_settings()
+        self.assertEqual(settings.level_for_experience(0), 1)
+        self.assertEqual(settings.level_for_experience(100), 2)
+        self.assertEqual(settings.level_for_experience(10 ** 9), 50)
+        for level in (1, 2, 10, 50):
+            self.assertEqual(settings.experience_for_level(level),
+                             self.employee.calculate_experience_for_level(level, settings.experience_multiplier))
+
+    def test_multi_level_grant_is_written_in_one_batch(self):
+        self.employee.add_experience(1000, source="test")
+        self.employee.refresh_from_db()
+
+        self.assertEqual(self.employee.level, 5)
+        self.assertEqual(EmployeeLog.objects.filter(employee=self.employee, change_type='level').count(), 4)
+        rewards = [int(50 * level * 0.2) for level in (1, 2, 3, 4)]
+        self.assertEqual(list(AcoinTransaction.objects.filter(employee=self.employee).order_by('id')
+                              .values_list('amount', flat=True)), rewards)
+        self.assertEqual(self.employee.acoin.amount, sum(rewards))
+        self.assertEqual(EmployeeStats.objects.get(employee=self.employee).acoins_earned, sum(rewards))
+
+        self.employee.add_experience(-950, source="test")
+        self.employee.refresh_from_db()
+        self.assertEqual(self.employee.level, 1)
+
+
+class TokenCacheTestCase(TestCase):
+    def setUp(self):
+        clear_token_cache()
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="token", first_name="Мария", last_name="Козлова")
+        self.token = Token.objects.create(user=self.employee)
+
+    def test_cached_lookup_makes_no_queries(self):
+        get_token_user(self.token.key)
+        with self.assertNumQueries(0):
+            employee, token = get_token_user(self.token.key)
+        self.assertEqual(employee.pk, self.employee.pk)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_deactivation_and_token_delete_invalidate_cache(self):
+        get_token_user(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.deactivate()
+        employee, _ = get_token_user(self.token.key)
+        self.assertFalse(employee.is_active)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(Token.DoesNotExist):
+            get_token_user(self.token.key)
+
+    def test_equip_keeps_changes_made_after_authentication(self):
+        background = Background.objects.create(name="лес", price=0)
+        self.employee.owned_backgrounds.add(background)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        get_token_user(self.token.key)
+        # Изменение в обход сигналов (как у process_achievement_events или flush_activity)
+        Employee.objects.filter(pk=self.employee.pk).update(experience=500, karma=70)
+
+        response = client.post(f'/api/backgrounds/{background.pk}/equip/')
+        self.assertEqual(response.status_code, 200)
+        employee = Employee.objects.get(pk=self.employee.pk)
+        self.assertEqual((employee.experience, employee.karma, employee.selected_background_id),
+                         (500, 70, background.pk))
+
+
+class ActivityTrackerTestCase(TestCase):
+    def setUp(self):
+        flush_activity()
+        Group.objects.get_or_create(name="Операторы")
+        self.employees = [
+            Employee.objects.create(username=f"active{i}", first_name="Иван", last_name=f"Активный{i}")
+            for i in range(3)
+        ]
+
+    def test_activity_is_flushed_in_one_update(self):
+        now = timezone.now()
+        for employee in self.employees:
+            record_activity(employee.id, now)
+        self.assertEqual(set(get_active_users().values_list('id', flat=True)),
+                         {employee.id for employee in self.employees})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_activity(), 3)
+        self.assertEqual(pending_activity(), {})
+        self.assertEqual(Employee.objects.filter(last_login=now, last_activity=now).count(), 3)
+
+
+class RoleCacheTestCase(TestCase):
+    def setUp(self):
+        clear_role_cache()
+        self.operators, _ = Group.objects.get_or_create(name="Операторы")
+        self.admins, _ = Group.objects.get_or_create(name="Администраторы")
+        self.employee = Employee.objects.create(username="roles", first_name="Ольга", last_name="Орлова")
+        self.permission = Permission.objects.get(codename='view_employee')
+
+    def test_checks_use_cached_snapshot(self):
+        self.assertFalse(user_in_group(self.employee, "Администраторы"))
+        with self.assertNumQueries(0):
+            self.assertTrue(user_in_group(self.employee, "Операторы"))
+            self.assertFalse(user_has_perm(self.employee, 'main.view_employee'))
+
+    def test_membership_and_permission_changes_invalidate(self):
+        user_in_group(self.employee, "Операторы")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admins.user_set.add(self.employee)
+        self.assertTrue(user_in_group(self.employee, "Администраторы"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operators.permissions.add(self.permission)
+        self.assertTrue(user_has_perm(self.employee, 'main.view_employee'))
+        self.assertEqual(user_has_perm(self.employee, 'main.view_employee'),
+                         Employee.objects.get(pk=self.employee.pk).has_perm('main.view_employee'))
+
+
+class ConfigCacheTestCase(TestCase):
+    def setUp(self):
+        invalidate_config()
+        SystemSetting.objects.create(key="max_upload_size", value="1024")
+        ExperienceMultiplier.objects.create(name="massive_request_multiplier", multiplier=1.5)
+
+    def test_reads_use_cached_snapshot(self):
+        get_config()
+        with self.assertNumQueries(0):
+            config = get_config()
+            self.assertEqual(config.int_setting("max_upload_size"), 1024)
+            self.assertEqual(config.int_setting("max_session_duration", 60), 60)
+            self.assertEqual(config.multiplier("massive_request_multiplier"), 1.5)
+            self.assertIsNone(config.karma_setting("late_penalty", 1))
+
+    def test_changes_invalidate_snapshot(self):
+        get_config()
+        with self.captureOnCommitCallbacks(execute=True):
+            setting = SystemSetting.objects.get(key="max_upload_size")
+            setting.value = "2048"
+            setting.save()
+            KarmaSettings.objects.create(operation_type="late_penalty", level=1, karma_change=-5)
+        config = get_config()
+        self.assertEqual(config.int_setting("max_upload_size"), 2048)
+        self.assertEqual(config.karma_settings_by_level("late_penalty")[1].karma_change, -5)
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        invalidate_leaderboards()
+        Group.objects.get_or_create(name="Операторы")
+        self.first = Employee.objects.create(username="first", first_name="Анна", last_name="Первая", karma=70)
+        self.second = Employee.objects.create(username="second", first_name="Борис", last_name="Второй", karma=60)
+        self.third = Employee.objects.create(username="third", first_name="Вера", last_name="Третья", karma=60)
+        Employee.objects.create(username="inactive", first_name="Глеб", last_name="Неактивный", karma=90).deactivate()
+
+    def test_ranks_and_slices(self):
+        board = Leaderboard({1: 10, 2: 30, 3: 30, 4: 5})
+        self.assertEqual(board.top(3), [(1, 2, 30), (1, 3, 30), (3, 1, 10)])
+        self.assertEqual(board.rank(4), 4)
+        self.assertEqual(board.page(2, 2), [(3, 1, 10), (4, 4, 5)])
+        self.assertEqual(board.around(1, 1), [(1, 3, 30), (3, 1, 10), (4, 4, 5)])
+        self.assertEqual(board.after(30.0, 2, 2), [(1, 3, 30), (3, 1, 10)])
+        board.set(4, 40)
+        board.remove(2)
+        self.assertEqual(board.top(3), [(1, 4, 40), (2, 3, 30), (3, 1, 10)])
+
+    def test_sorted_keys_match_sorted_list(self):
+        generator = random.Random(7)
+        keys = SortedKeys((generator.randrange(50), number) for number in range(20))
+        keys.LOAD = 2
+        expected = sorted(keys)
+        for number in range(20, 300):
+            key = (generator.randrange(50), number)
+            if expected and generator.random() < 0.4:
+                key = expected[generator.randrange(len(expected))]
+                keys.remove(key)
+                expected.remove(key)
+            else:
+                keys.add(key)
+                insort(expected, key)
+            probe = (generator.randrange(50),)
+            self.assertEqual((len(keys), keys.bisect_left(probe), keys.bisect_right((probe[0], 10 ** 6))),
+                             (len(expected), bisect_left(expected, probe), bisect_right(expected, (probe[0], 10 ** 6))))
+            start = generator.randrange(len(expected) + 1)
+            self.assertEqual(keys.slice(start, start + 5), expected[start:start + 5])
+        self.assertEqual(list(keys), expected)
+
+    def test_updates_are_incremental(self):
+        board = get_leaderboard('karma')
+        self.assertEqual(board.rank(self.second.pk), 2)
+        self.assertNotIn(Employee.objects.get(username="inactive").pk, board)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.third.add_karma(20, source="test")
+        with self.assertNumQueries(0):
+            board = get_leaderboard('karma')
+            self.assertEqual(board.rank(self.third.pk), 1)
+            self.assertEqual(board.rank(self.first.pk), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.deactivate()
+        self.assertIsNone(get_leaderboard('karma').rank(self.first.pk))
+        self.assertEqual(len(get_leaderboard('experience')), 2)
+
+    def test_rating_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.second)
+        response = client.get('/api/rating/', {'metric': 'karma', 'around': 'me', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['my_rank'], 2)
+        self.assertEqual([row['full_name'] for row in response.data['results']],
+                         ["Анна Первая", "Борис Второй", "Вера Третья"])
+        self.assertEqual(client.get('/api/rating/', {'metric': 'unknown'}).status_code, 400)
+
+        # Без параметров рейтинга - прежний список всех сотрудников по опыту
+        Employee.objects.filter(pk=self.third.pk).update(experience=50)
+        response = client.get('/api/rating/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(response.data[0], {'id': self.third.pk, 'full_name': "Вера Третья"})
+        self.assertEqual(len(response.data), 4)
+
+
+class EarningBucketTestCase(TestCase):
+    def setUp(self):
+        invalidate_leaderboards()
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="buckets", first_name="Дарья", last_name="Дневная")
+        self.other = Employee.objects.create(username="other", first_name="Егор", last_name="Другой")
+
+    def test_gains_are_bucketed_by_day(self):
+        self.employee.add_karma(5, source="test")
+        self.employee.add_karma(-3, source="test")
+        self.employee.add_karma(4, source="test")
+        AcoinTransaction.objects.create(employee=self.employee, amount=30)
+        old_log = EmployeeLog.objects.create(employee=self.employee, change_type='karma', old_value=0, new_value=7)
+        EmployeeLog.objects.filter(pk=old_log.pk).update(timestamp=timezone.now() - datetime.timedelta(days=40))
+
+        self.assertEqual(EarningBucket.totals('karma', employee_id=self.employee.pk), {self.employee.pk: 16})
+        today = timezone.localdate()
+        self.assertEqual(EarningBucket.totals('karma', since=today)[self.employee.pk], 16)
+        self.assertEqual(EarningBucket.totals('acoins', since=today)[self.employee.pk], 30)
+
+        EarningBucket.rebuild(self.employee.pk)
+        self.assertEqual(EarningBucket.totals('karma', since=today)[self.employee.pk], 9)
+        stats = EmployeeStats.rebuild(self.employee.pk)
+        self.assertEqual((stats.karma_earned, stats.karma_earned_week), (16, 9))
+
+    def test_period_rating(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.add_karma(2, source="test")
+        self.assertEqual(get_leaderboard('karma_week').rank(self.other.pk), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.add_karma(5, source="test")
+
+        client = APIClient()
+        client.force_authenticate(self.other)
+        response = client.get('/api/rating/week/', {'metric': 'karma', 'top': 1})
+        self.assertEqual(response.data['my_rank'], 2)
+        self.assertEqual(response.data['results'], [
+            {'rank': 1, 'id': self.employee.pk, 'full_name': "Дарья Дневная", 'value': 5},
+        ])
+
+
+class AttemptAnswerTestCase(TestCase):
+    def setUp(self):
+        clear_answer_keys()
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="student", first_name="Илья", last_name="Учеников")
+        self.moderator = Employee.objects.create(username="moderator", first_name="Мария", last_name="Проверкина")
+        theme = Theme.objects.create(name="Тема")
+        self.test = Test.objects.create(name="Тест", theme=theme, passing_score=3)
+        self.single = TestQuestion.objects.create(test=self.test, question_text="Выбор", question_type='single', points=1)
+        AnswerOption.objects.create(question=self.single, option_text="Нет", is_correct=False)
+        AnswerOption.objects.create(question=self.single, option_text="Да", is_correct=True)
+        self.text = TestQuestion.objects.create(test=self.test, question_text="Текст", question_type='text', points=2)
+
+    def complete_test(self, answers):
+        TestAttempt.objects.create(employee=self.employee, test=self.test, status=TestAttempt.IN_PROGRESS)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.employee).key}")
+        response = client.post(f'/api/complete_test/{self.employee.pk}/{self.test.pk}/', answers, format='json')
+        self.assertEqual(response.status_code, 200)
+        return TestAttempt.objects.get(pk=response.data['test_attempt_id'])
+
+    def test_answers_are_written_and_moderated(self):
+        attempt = self.complete_test({"1": 2, "2": "Ответ"})
+        self.assertEqual(attempt.status, TestAttempt.MODERATION)
+        single, text = attempt.answers.all()
+        self.assertEqual((single.question, single.selected_options, single.is_correct), (self.single, [2], True))
+        self.assertEqual((text.question, text.text_answer, text.max_score), (self.text, "Ответ", 2))
+
+        client = APIClient()
+        client.force_authenticate(self.moderator)
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.moderator).key}")
+        response = client.post(f'/api/test_attempts/{attempt.pk}/moderate/', {
+            "moderated_questions": [{"question_number": 2, "moderation_score": 1, "moderation_comment": "Неполно"}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        text.refresh_from_db()
+        self.assertEqual((text.score, text.is_partially_true, text.moderator), (1, True, self.moderator))
+
+        counts = {row['question_text']: (row['total_answers'], row['count']) for row in question_answer_counts()}
+        self.assertEqual(counts, {"Выбор": (1, 0), "Текст": (1, 1)})
+
+        admin = Employee.objects.create(username="stat", first_name="Сергей", last_name="Статистов", is_superuser=True)
+        client.force_authenticate(admin)
+        statistics = client.get('/api/test-stat/', {'limit': 10}).data['statistics']
+        self.assertEqual([(stat['id'], stat['moderator']) for stat in statistics],
+                         [(attempt.pk, "Мария Проверкина")])
+
+    def test_backfill_matches_json(self):
+        attempt = self.complete_test({"1": 1})
+        expected = list(attempt.answers.values_list('question_id', 'selected_options', 'is_correct', 'score'))
+        attempt.answers.all().delete()
+
+        call_command('backfill_attempt_answers', stdout=io.StringIO())
+        self.assertEqual(list(attempt.answers.values_list('question_id', 'selected_options', 'is_correct', 'score')),
+                         expected)
+
+
+class AnswerKeyTestCase(TestCase):
+    def setUp(self):
+        clear_answer_keys()
+        self.test = Test.objects.create(name="Тест", theme=Theme.objects.create(name="Тема"))
+        self.question = TestQuestion.objects.create(test=self.test, question_text="Несколько",
+                                                    question_type='multiple', points=3)
+        for text, is_correct in (("А", True), ("Б", False), ("В", True)):
+            AnswerOption.objects.create(question=self.question, option_text=text, is_correct=is_correct)
+
+    def test_grading_uses_cached_key(self):
+        get_answer_key(self.test.pk)
+        with self.assertNumQueries(0):
+            answer_key = get_answer_key(self.test.pk)
+            score, answers_info, question_ids = answer_key.grade({"1": [1, 2, 3]})
+        self.assertEqual(answer_key.questions[0].correct_mask, 0b101)
+        self.assertEqual((score, question_ids), (Decimal('1.5'), [self.question.pk]))
+        self.assertEqual([option["submitted_answer"] for option in answers_info[0]["answer_options"]],
+                         [True, True, True])
+        self.assertEqual(answer_key.grade({"1": [1, 3]})[0], Decimal('3.0'))
+        self.assertTrue(answer_key.grade({"1": [3, 1]})[1][0]["is_correct"])
+
+    def test_option_changes_invalidate_key(self):
+        get_answer_key(self.test.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            AnswerOption.objects.filter(option_text="Б").update(is_correct=True)
+            AnswerOption.objects.get(option_text="Б").save()
+        self.assertEqual(get_answer_key(self.test.pk).questions[0].correct_count, 3)
+
+
+class TestContentTestCase(TestCase):
+    def setUp(self):
+        clear_test_contents()
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="reader", first_name="Нина", last_name="Читаева")
+        self.test = Test.objects.create(name="Тест", theme=Theme.objects.create(name="Тема"))
+        question = TestQuestion.objects.create(test=self.test, question_text="Вопрос", question_type='single',
+                                               position=2)
+        AnswerOption.objects.create(question=question, option_text="Да", is_correct=True)
+        self.theory = Theory.objects.create(test=self.test, title="Теория", text="Текст", position=1)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.employee).key}")
+
+    def test_blocks_are_cached_and_invalidated(self):
+        response = self.client.get(f'/api/test/{self.test.pk}/')
+        self.assertEqual(response.data['blocks'], [
+            {'type': 'theory', 'content': {'title': "Теория", 'text': "Текст", 'image': None, 'position': 1}},
+            {'type': 'question', 'content': {
+                'question_text': "Вопрос", 'duration_seconds': 0, 'question_type': 'single', 'points': 1,
+                'explanation': None, 'image': None, 'position': 2,
+                'answer_options': [{'option_text': "Да", 'is_correct': True}],
+            }},
+        ])
+        self.assertTrue(response.data['test_available'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.theory.position = 3
+            self.theory.save()
+        blocks = self.client.get(f'/api/test/{self.test.pk}/').data['blocks']
+        self.assertEqual([block['type'] for block in blocks], ['question', 'theory'])
+
+        with self.assertNumQueries(1):
+            data = self.client.get(f'/api/get_test_with_theory/{self.test.pk}/').data
+        self.assertEqual([block['type'] for block in data], ['theory', 'question'])
+
+
+class TestCatalogTestCase(TestCase):
+    def setUp(self):
+        invalidate_test_catalog()
+        Group.objects.get_or_create(name="Операторы")
+        self.author = Employee.objects.create(username="author", first_name="Олег", last_name="Авторов")
+        self.employee = Employee.objects.create(username="pupil", first_name="Павел", last_name="Учеников")
+        self.theme = Theme.objects.create(name="Б-тема")
+        Theme.objects.create(name="А-тема")
+        self.tests = [
+            Test.objects.create(name=f"Тест {number}", theme=self.theme, author=self.author, max_score=10)
+            for number in range(3)
+        ]
+        attempt = TestAttempt.objects.create(employee=self.employee, test=self.tests[0], status=TestAttempt.FAILED,
+                                             score=4, test_results='{"answers_info": []}')
+        TestAttempt.objects.filter(pk=attempt.pk).update(status=TestAttempt.PASSED)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.employee).key}")
+
+    def test_catalog_queries_do_not_depend_on_test_count(self):
+        self.client.get('/api/themes-with-tests/')
+        # Данные сотрудника (кроме полей авторизации из кеша токенов) загружаются одним запросом
+        with self.assertNumQueries(3):
+            data = self.client.get('/api/themes-with-tests/').data
+        self.assertEqual([theme['theme'] for theme in data], ["А-тема", "Б-тема"])
+        first, second = data[1]['tests'][:2]
+        self.assertEqual(first['status'], {"status": TestAttempt.PASSED, "total_score": 4, "max_score": 10})
+        self.assertFalse(first['test_available'])
+        self.assertEqual(second['status'], {"status": "Не начато", "total_score": 0, "max_score": 0})
+        self.assertTrue(second['test_available'])
+        self.assertEqual(second['author'], "Олег Авторов")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = "Ольга"
+            self.author.save()
+        self.assertEqual(self.client.get('/api/themes-with-tests/').data[1]['tests'][0]['author'], "Ольга Авторов")
+
+
+class ClassificationTreeTestCase(TestCase):
+    def setUp(self):
+        invalidate_classification_tree()
+        self.root = Classifications.objects.create(name="Сеть")
+        self.child = Classifications.objects.create(name="VPN", parent=self.root)
+        self.leaf = Classifications.objects.create(name="Не подключается", parent=self.child)
+
+    def test_paths_follow_parent_changes(self):
+        self.assertEqual(self.leaf.path, f"/{self.root.pk}/{self.child.pk}/{self.leaf.pk}/")
+        self.assertEqual((self.leaf.depth, self.leaf.full_name), (2, "Сеть->VPN->Не подключается"))
+
+        other = Classifications.objects.create(name="Доступы")
+        self.child.parent = other
+        self.child.name = "Удалённый доступ"
+        self.child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f"/{other.pk}/{self.child.pk}/{self.leaf.pk}/")
+        self.assertEqual(self.leaf.full_name, "Доступы->Удалённый доступ->Не подключается")
+        self.assertEqual(self.leaf.parent_full_name, "Доступы->Удалённый доступ")
+
+        Classifications.objects.update(path='', depth=0, full_name='')
+        self.assertEqual(Classifications.rebuild_tree_fields(), 4)
+        self.leaf.refresh_from_db()
+        self.assertEqual((self.leaf.depth, self.leaf.full_name), (2, "Доступы->Удалённый доступ->Не подключается"))
+
+    def test_snapshot_resolves_and_grows_in_place(self):
+        tree = get_classification_tree()
+        node, found = tree.resolve(["Сеть", "VPN", "Медленно"])
+        self.assertEqual((node.classification.pk, found), (self.child.pk, 2))
+        self.assertEqual([c.pk for c in tree.leaves()], [self.leaf.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slow = Classifications.objects.create(name="Медленно", parent=self.child)
+        self.assertIs(get_classification_tree(), tree)
+        self.assertEqual(tree.resolve(["Сеть", "VPN", "Медленно"])[0].classification.pk, slow.pk)
+        self.assertEqual(tree.serialize(slow)['parentName'], "Сеть->VPN")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slow.delete()
+        self.assertIsNot(get_classification_tree(), tree)
+
+
+class ClassificationUpsertTestCase(TestCase):
+    def setUp(self):
+        invalidate_classification_tree()
+        invalidate_import_author()
+        Group.objects.get_or_create(name="Операторы")
+        # Записи журнала из setUp сбрасываются здесь, иначе буфер журнала останется незаписанным
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importer = Employee.objects.create(username="oleg", first_name="Олег", last_name="Импортов")
+            self.network = Classifications.objects.create(name="Сеть")
+        EmployeeActionLog.objects.all().delete()
+
+    def test_missing_levels_are_created_per_level_with_one_log_entry(self):
+        get_config()
+        get_classification_tree()
+        paths = ["Сеть->VPN->Медленно", "Сеть->VPN->Не подключается", "Почта->Спам", "Сеть"]
+        # Проверка узлов снимка, точка сохранения, по сверке с базой и bulk_create на каждый из 3 уровней
+        # и один bulk_update; журнал пишется после фиксации
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(10):
+                result = upsert_classification_paths(paths)
+
+        self.assertEqual(result["Сеть"].pk, self.network.pk)
+        slow = Classifications.objects.get(pk=result["Сеть->VPN->Медленно"].pk)
+        self.assertEqual((slow.full_name, slow.depth, slow.complexity),
+                         ("Сеть->VPN->Медленно", 2, Classifications.complexity_for(slow.experience_points)))
+        self.assertEqual(slow.path, f"/{self.network.pk}/{slow.parent_id}/{slow.pk}/")
+        self.assertEqual(Classifications.objects.count(), 6)
+        log = EmployeeActionLog.objects.get()
+        self.assertEqual(log.employee, self.importer)
+        self.assertIn("(5)", log.description)
+
+        # Повторный импорт ничего не создаёт, только проверяет, что узлы снимка ещё есть в базе
+        with self.assertNumQueries(1):
+            again = upsert_classification_paths(paths)
+        self.assertEqual({path: c.pk for path, c in again.items()}, {path: c.pk for path, c in result.items()})
+
+    def test_stale_snapshot_is_checked_against_database(self):
+        get_classification_tree()
+        # Изменения другого процесса: сигналы и снимок этого процесса о них не знают
+        vpn = Classifications.objects.bulk_create([Classifications(name="VPN", parent=self.network)])[0]
+        mail = Classifications.objects.create(name="Почта")
+        Classifications.objects.filter(pk=mail.pk)._raw_delete('default')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = upsert_classification_paths(["Сеть->VPN->Медленно", "Почта"])
+        self.assertEqual(result["Сеть->VPN->Медленно"].parent_id, vpn.pk)
+        self.assertNotEqual(result["Почта"].pk, mail.pk)
+        self.assertTrue(Classifications.objects.filter(pk=result["Почта"].pk).exists())
+        self.assertEqual(Classifications.objects.filter(name="VPN").count(), 1)
+        # Снимок пересобран и знает про узел, созданный другим процессом
+        self.assertEqual(get_classification_tree().resolve(("Сеть", "VPN"))[0].classification.pk, vpn.pk)
+
+
+class DisplayNumberTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        self.admin = Employee.objects.create(username="admin", first_name="Ада", last_name="Админова", is_superuser=True)
+        self.questions = [SurveyQuestion.objects.create(question_text=f"Вопрос {number}") for number in range(4)]
+
+    def test_display_number_is_dense_after_delete(self):
+        # Удаление не перенумеровывает id остальных строк
+        self.questions[1].delete()
+        self.assertEqual(SurveyQuestion.objects.get(pk=self.questions[3].pk).question_text, "Вопрос 3")
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        data = client.get('/api/survey-questions/').data
+        self.assertEqual([(item['id'], item['display_number']) for item in data],
+                         [(self.questions[0].pk, 1), (self.questions[2].pk, 2), (self.questions[3].pk, 3)])
+
+    def test_log_tables_are_deleted_in_one_statement(self):
+        for number in range(3):
+            EmployeeActionLog.objects.create(employee=self.admin, action_type='создано', model_name='Test',
+                                             object_id=str(number), description="")
+        with self.assertNumQueries(1):
+            deleted, _ = EmployeeActionLog.objects.all().delete()
+        self.assertEqual(deleted, 3)
+
+
+class StatisticsTestCase(TestCase):
+    def setUp(self):
+        clear_statistics()
+        Group.objects.get_or_create(name="Операторы")
+        self.client = APIClient()
+        theme = Theme.objects.create(name="Тема")
+        self.tests = [Test.objects.create(name=f"Тест {number}", theme=theme) for number in range(3)]
+        start = timezone.now()
+        for number in range(3):
+            employee = Employee.objects.create(username=f"stat{number}", first_name="Стат", last_name=str(number))
+            AcoinTransaction.objects.create(employee=employee, amount=5 * (number + 1))
+            attempt = TestAttempt.objects.create(employee=employee, test=self.tests[0], status=TestAttempt.FAILED,
+                                                 score=number + 1, start_time=start,
+                                                 end_time=start + datetime.timedelta(seconds=10 * (number + 1)))
+            TestAttempt.objects.filter(pk=attempt.pk).update(status=TestAttempt.PASSED)
+        self.client.force_authenticate(employee)
+
+    def test_full_statistics_use_fixed_number_of_queries(self):
+        with self.settings(STATISTICS_TTL=0):
+            with self.assertNumQueries(8):
+                data = self.client.get('/api/full_statistics/').data
+        durations = data["test_duration_statistics"]
+        self.assertEqual(durations[self.tests[0].pk]["average_duration"], 20.0)
+        self.assertEqual(durations[self.tests[0].pk]["max_duration"], 30.0)
+        self.assertEqual(durations[self.tests[1].pk]["individual_durations"], [])
+        self.assertEqual(data["test_score_percentage"], {self.tests[0].pk: 2, self.tests[1].pk: 0, self.tests[2].pk: 0})
+        self.assertEqual([row["total_acoins"] for row in data["employee_statistics"]], [5, 10, 15])
+
+        self.client.get('/api/full_statistics/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/full_statistics/')
+
+    def test_balances_count_achievements_from_one_source(self):
+        employee = Employee.objects.get(username="stat0")
+        achievement = Achievement.objects.create(name="Старт", type=1)
+        EmployeeAchievement.objects.create(employee=employee, achievement=achievement)
+        # Сводный счётчик может расходиться с записями - в ответе используются только записи
+        EmployeeStats.rebuild(employee)
+        EmployeeStats.objects.filter(employee=employee).update(achievements_count=5)
+        with self.assertNumQueries(1):
+            balances = employee_balances()
+        self.assertEqual([(row["total_acoins"], row["total_achievements"]) for row in balances],
+                         [(5, 1), (10, 0), (15, 0)])
+
+
+class StreamingTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="reader", first_name="Роман", last_name="Читалов")
+        moment = timezone.now()
+        self.logs = [
+            EmployeeLog.objects.create(employee=self.employee, change_type='karma', old_value=number,
+                                       new_value=number + 1)
+            for number in range(5)
+        ]
+        # Две записи с одинаковым временем: порядок между ними задаёт id
+        EmployeeLog.objects.filter(pk__in=[log.pk for log in self.logs[:2]]).update(timestamp=moment)
+        EmployeeLog.objects.filter(pk__in=[log.pk for log in self.logs[2:]]).update(
+            timestamp=moment - datetime.timedelta(hours=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.employee)
+
+    def test_keyset_pages_cover_log_once(self):
+        seen = []
+        response = self.client.get('/api/currency-logs/', {'limit': 2})
+        while True:
+            seen += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get('/api/currency-logs/', {'limit': 2, 'after': response.data['next']})
+        self.assertEqual(seen, [log.pk for log in reversed(self.logs[:2])] + [log.pk for log in reversed(self.logs[2:])])
+        self.assertEqual(self.client.get('/api/currency-logs/', {'after': 'вчера'}).status_code, 400)
+
+    def test_stream_returns_same_rows_as_list(self):
+        response = self.client.get('/api/currency-logs/', {'stream': 1})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([item['id'] for item in streamed],
+                         [item['id'] for item in self.client.get('/api/currency-logs/', {'limit': 10}).data['results']])
+        self.assertEqual(streamed[0]['readable_description'], "Роман Читалов получил 1 кармы.")
+
+    def test_log_filters(self):
+        other = Employee.objects.create(username="other", first_name="Ольга", last_name="Другая")
+        EmployeeLog.objects.create(employee=other, change_type='experience', old_value=0, new_value=5)
+        EmployeeLog.objects.create(employee=self.employee, change_type='experience', old_value=0, new_value=5)
+        params = {'employee_id': self.employee.pk, 'change_type': 'karma', 'limit': 10}
+        self.assertEqual(len(self.client.get('/api/currency-logs/', params).data['results']), 5)
+        today = timezone.localdate().isoformat()
+        recent = self.client.get('/api/currency-logs/', dict(params, date_from=today, date_to=today)).data['results']
+        self.assertEqual({item['id'] for item in recent},
+                         set(EmployeeLog.objects.filter(employee=self.employee, change_type='karma',
+                                                        timestamp__date=timezone.localdate()).values_list('id', flat=True)))
+        self.assertEqual(self.client.get('/api/currency-logs/', {'employee_id': 'я'}).status_code, 400)
+
+
+class RetentionTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="keeper", first_name="Карина", last_name="Архивова")
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        FilePath.objects.create(name='log_archive', path=self.archive_dir)
+        SystemSetting.objects.create(key='employee_log_retention_days', value='30')
+        SystemSetting.objects.create(key='achievement_event_retention_days', value='7')
+        invalidate_config()
+        old = timezone.now() - datetime.timedelta(days=40)
+        EmployeeLog.objects.all().delete()
+        self.old_logs = [
+            EmployeeLog.objects.create(employee=self.employee, change_type='karma', old_value=number,
+                                       new_value=number + 1)
+            for number in range(3)
+        ]
+        EmployeeLog.objects.filter(pk__in=[log.pk for log in self.old_logs]).update(timestamp=old)
+        self.recent_log = EmployeeLog.objects.create(employee=self.employee, change_type='karma', old_value=3,
+                                                     new_value=4)
+        AchievementEvent.objects.all().delete()
+        self.processed = AchievementEvent.objects.create(employee=self.employee, event_type=AchievementEvent.KARMA,
+                                                         processed_at=old)
+        self.pending = AchievementEvent.objects.create(employee=self.employee, event_type=AchievementEvent.KARMA)
+        AchievementEvent.objects.filter(pk=self.pending.pk).update(created_at=old)
+
+    def test_dry_run_deletes_nothing(self):
+        results = apply_retention(dry_run=True)
+        self.assertEqual(results, {'employee_log': 3, 'achievement_event': 1})
+        self.assertEqual(EmployeeLog.objects.count(), 4)
+
+    def test_old_rows_archived_and_deleted_in_chunks(self):
+        results = apply_retention(chunk_size=2)
+        self.assertEqual(results, {'employee_log': 3, 'achievement_event': 1})
+        self.assertEqual(list(EmployeeLog.objects.values_list('pk', flat=True)), [self.recent_log.pk])
+        # Необработанные события остаются в очереди, таблица без настройки срока не трогается
+        self.assertEqual(list(AchievementEvent.objects.values_list('pk', flat=True)), [self.pending.pk])
+
+        archives = os.listdir(self.archive_dir)
+        self.assertEqual(len(archives), 1)
+        self.assertTrue(archives[0].startswith('employee_log-'))
+        with gzip.open(os.path.join(self.archive_dir, archives[0]), 'rt', encoding='utf-8') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['id'] for row in rows], [log.pk for log in self.old_logs])
+        self.assertEqual(rows[0]['employee_id'], self.employee.pk)
+
+    def test_logs_kept_without_archive_directory(self):
+        FilePath.objects.filter(name='log_archive').delete()
+        self.assertEqual(apply_retention(), {'achievement_event': 1})
+        self.assertEqual(EmployeeLog.objects.count(), 4)
+
+    def test_delete_logs_older_than_days(self):
+        client = APIClient()
+        client.force_authenticate(self.employee)
+        response = client.delete('/api/delete-logs/?log_type=employee_log&older_than_days=30')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(EmployeeLog.objects.values_list('pk', flat=True)), [self.recent_log.pk])
+        self.assertEqual(client.delete('/api/delete-logs/?older_than_days=месяц').status_code, 400)
+
+
+class ShiftImportTestCase(TestCase):
+    def setUp(self):
+        invalidate_config()
+        Group.objects.get_or_create(name="Операторы")
+        self.ivan = Employee.objects.create(username="sidorov", first_name="Иван", last_name="Сидоров")
+        self.anna = Employee.objects.create(username="petrova", first_name="Анна", last_name="Петрова")
+        # Имя и фамилия есть в графике, но у разных людей
+        self.stranger = Employee.objects.create(username="ivan_petrova", first_name="Иван", last_name="Петрова")
+        KarmaSettings.objects.create(operation_type=KarmaSettings.SHIFT_COMPLETION, karma_change=2, experience_change=10)
+        KarmaSettings.objects.create(operation_type=KarmaSettings.LATE_PENALTY, level=2, karma_change=3)
+        ShiftHistory.objects.create(employee=self.anna, date=datetime.date(2024, 5, 1),
+                                    scheduled_start=datetime.time(9, 0), scheduled_end=datetime.time(18, 0),
+                                    actual_start=datetime.time(9, 0), actual_end=datetime.time(18, 0),
+                                    karma_change=2, experience_change=10, late=False)
+
+    def test_schedule_is_loaded_for_listed_employees_only(self):
+        on_time, late = "Смена;09:00-18:00;Факт;09:00-18:00", "Смена;09:00-18:00;Факт;09:10-18:00"
+        df = pd.DataFrame({
+            'ФИО': ["Сидоров Иван Иванович", "Петрова Анна Сергеевна"],
+            'd1': [on_time, on_time],
+            'd2': [late, on_time],
+        })
+        shifts = parse_shift_cells(df, [(1, 'd1'), (2, 'd2'), (3, None)])
+        self.assertEqual(list(shifts['late']), [False, False, True, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            load_shifts(shifts, datetime.datetime(2024, 5, 31))
+
+        self.ivan.refresh_from_db()
+        self.anna.refresh_from_db()
+        self.stranger.refresh_from_db()
+        # Иван: смена вовремя (+2 кармы, +10 опыта) и опоздание на 10 минут (-3 кармы)
+        self.assertEqual((self.ivan.karma, self.ivan.experience), (49, 10))
+        self.assertEqual(list(ShiftHistory.objects.filter(employee=self.ivan).order_by('date').values_list('late', flat=True)),
+                         [False, True])
+        # Анна: первая смена уже загружена и повторно не начисляется
+        self.assertEqual((self.anna.karma, self.anna.experience), (52, 10))
+        self.assertEqual(ShiftHistory.objects.filter(employee=self.anna).count(), 2)
+        self.assertFalse(ShiftHistory.objects.filter(employee=self.stranger).exists())
+        self.assertIsNone(self.stranger.last_karma_update)
+        self.assertIsNotNone(self.ivan.last_karma_update)
+
+
+class RequestImportTestCase(TestCase):
+    def setUp(self):
+        invalidate_config()
+        Group.objects.get_or_create(name="Операторы")
+        self.operator = Employee.objects.create(username="operator", first_name="Олег", last_name="Операторов")
+        self.classification = Classifications.objects.create(name="Доступ", experience_points=15)
+        self.now = timezone.now()
+        # Обращение из прошлой выгрузки (без оператора, чтобы не влиять на его статистику)
+        Request.objects.bulk_create([self.make_request("R1", operator=None)])
+
+    def make_request(self, number, operator=True):
+        return Request(number=number, classification=self.classification, responsible="Иванов Иван",
+                       support_operator=self.operator if operator else None, initiator="Пользователь",
+                       status='Completed', date=self.now)
+
+    def test_duplicates_are_skipped_and_credited_once(self):
+        requests = [self.make_request(number) for number in ("R1", "R2", "R2", "R3")]
+        expected = sum(request.calculate_experience() for request in requests[1::2])
+        with self.captureOnCommitCallbacks(execute=True):
+            created = bulk_add_requests(requests)
+
+        self.assertEqual([request.number for request in created], ["R2", "R3"])
+        self.assertEqual(Request.objects.filter(support_operator=self.operator).count(), 2)
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.experience, round(expected))
+        self.assertEqual(EmployeeStats.objects.get(employee=self.operator).requests_total, 2)
+
+    def test_numbers_taken_by_concurrent_import_are_not_returned(self):
+        # Номер занят после проверки существующих: вставка пачки откатывается и повторяется без него
+        inserted = insert_requests([self.make_request("R1"), self.make_request("R4")])
+        self.assertEqual([request.number for request in inserted], ["R4"])
+        self.assertIsNone(Request.objects.get(number="R1").support_operator_id)
+
+
+class AchievementRuleIndexTestCase(TestCase):
+    def setUp(self):
+        invalidate_rule_index()
+
+    def test_request_rules_are_keyed_by_classification(self):
+        rule = Achievement.objects.create(name="Обращения", type=1, type_specific_data={
+            "classification_ids": [1, 2], "required_complexity": "simple", "required_requests_count": 3,
+        })
+        Achievement.objects.create(name="Массовые", type=1, type_specific_data={
+            "classification_ids": [1], "required_complexity": "simple", "is_massive": True,
+        })
+
+        index = AchievementRuleIndex(Achievement.objects.all())
+        self.assertEqual(index.for_request(2, "simple", False), [rule])
+        self.assertEqual(len(index.for_request(1, "simple", True)), 1)
+        self.assertEqual(index.for_request(3, "simple", False), [])
+
+    def test_index_is_rebuilt_after_change(self):
+        self.assertEqual(get_rule_index().level_rules, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Achievement.objects.create(name="Уровень", type=3, type_specific_data={"required_level": 5})
+        self.assertEqual(len(get_rule_index().level_rules), 1)
+
+
+class AchievementQueueTestCase(TestCase):
+    def setUp(self):
+        invalidate_rule_index()
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="queue", first_name="Пётр", last_name="Петров")
+        self.achievement = Achievement.objects.create(name="Пунктуальность", type=4, type_specific_data={
+            "total_worked_days_required": 2,
+        })
+        invalidate_rule_index()
+
+    def add_shift(self, day):
+        ShiftHistory.objects.create(
+            employee=self.employee, date=datetime.date(2024, 5, day),
+            scheduled_start=datetime.time(9, 0), scheduled_end=datetime.time(18, 0),
+            actual_start=datetime.time(9, 0), actual_end=datetime.time(18, 0),
+            karma_change=0, experience_change=0
+        )
+
+    def test_events_are_coalesced_by_worker(self):
+        self.add_shift(1)
+        self.add_shift(2)
+        self.assertEqual(AchievementEvent.objects.filter(event_type=AchievementEvent.SHIFT).count(), 2)
+        self.assertFalse(EmployeeAchievement.objects.filter(employee=self.employee).exists())
+
+        process_pending_events()
+
+        employee_achievement = EmployeeAchievement.objects.get(employee=self.employee, achievement=self.achievement)
+        self.assertEqual(employee_achievement.progress, 2)
+        self.assertIsNotNone(employee_achievement.date_awarded)
+        self.assertFalse(AchievementEvent.objects.filter(processed_at__isnull=True).exists())
+
+
+class AuditLogTestCase(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name="Операторы")
+        self.employee = Employee.objects.create(username="audit", first_name="Анна", last_name="Смирнова")
+        self.question = SurveyQuestion.objects.create(question_text="Любимый цвет?")
+
+    def test_update_is_diffed_without_select_and_flushed_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                answer = SurveyAnswer.objects.create(employee=self.employee, question=self.question, answer_text="синий")
+                answer = SurveyAnswer.objects.get(pk=answer.pk)
+                answer.answer_text = "зелёный"
+                answer.save()
+                answer.answer_text = "красный"
+                answer.save()
+                self.assertFalse(EmployeeActionLog.objects.exists())
+
+        descriptions = list(EmployeeActionLog.objects.order_by('id').values_list('description', flat=True))
+        self.assertEqual(descriptions[1:], [
+            "answer_text: 'синий' -> 'зелёный'",
+            "answer_text: 'зелёный' -> 'красный'",
+        ])
+
+    def test_entries_of_rolled_back_savepoint_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                kept = SurveyAnswer.objects.create(employee=self.employee, question=self.question, answer_text="синий")
+                try:
+                    with transaction.atomic():
+                        SurveyAnswer.objects.create(employee=self.employee, question=self.question,
+                                                    answer_text="жёлтый")
+                        raise ValueError
+                except ValueError:
+                    pass
+                kept.answer_text = "зелёный"
+                kept.save()
+
+        self.assertEqual(list(EmployeeActionLog.objects.values_list('object_id', flat=True).distinct()),
+                         [str(kept.pk)])
+        self.assertEqual(EmployeeActionLog.objects.count(), 2)
@@ -132,6 +132,8 @@ urlpatterns = [
     path('get_complaints/', get_employee_complaints, name='get_employee_complaints'),
     path('delete-logs/', delete_logs, name='delete_logs'),
     path('rating/', get_rating, name='get_rating'),
+    path('rating/week/', get_period_rating, {'period': 'week'}, name='get_week_rating'),
+    path('rating/month/', get_period_rating, {'period': 'month'}, name='get_month_rating'),
     path('get-exp-karma/', get_exp_karma, name='get_exp_karma'),
 ]
 # Добавляем маршрут для обработки медиафайлов только в режиме отладки
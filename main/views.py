@@ -15,7 +15,19 @@ from django.core.mail import EmailMessage
 from django.views.decorators.http import require_POST
 from .permissions import IsAdmin, IsModerator, IsUser, IsModeratorOrAdmin, HasPermission
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework.authentication import TokenAuthentication
+from .activity import pending_activity
+from .authentication import CachedTokenAuthentication
+from .answer_keys import get_answer_key
+from .classification_tree import ClassificationTree, get_classification_tree, upsert_classification_paths
+from .config import get_config
+from .test_catalog import get_test_catalog
+from .test_content import get_test_content
+from .leaderboard import METRICS as LEADERBOARD_METRICS, get_leaderboard
+from .retention import POLICIES as RETENTION_POLICIES, purge
+from .roles import clear_role_cache, invalidate_user_roles, user_has_perm
+from .statistics import employee_balances, employee_totals, get_statistics, test_summary
+from .streaming import KeysetPage, is_keyset_requested, is_stream_requested, iter_json_object, keyset, \
+    keyset_params, streaming_json_response, STREAM_CHUNK_SIZE
 from rest_framework.authtoken.models import Token
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 import pytz
@@ -36,7 +48,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, viewsets
 from django.contrib.auth import authenticate
-from .views_base import EmployeeAPIView
+from .views_base import EmployeeAPIView, KeysetListMixin, with_display_number
 class BasePermissionViewSet(viewsets.ModelViewSet):
     """
     Базовый класс для ViewSet, который автоматически проверяет права на основе модели и действия.
@@ -64,6 +76,18 @@ class BasePermissionViewSet(viewsets.ModelViewSet):
 
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        # В каждом элементе списка отдаём порядковый номер display_number (id после удалений идут с пропусками)
+        queryset = with_display_number(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        objects = page if page is not None else queryset
+        data = self.get_serializer(objects, many=True).data
+        for item, obj in zip(data, objects):
+            item['display_number'] = obj.display_number
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
@@ -82,6 +106,22 @@ def delete_logs(request):
     employee_logs_deleted = 0
     employee_action_logs_deleted = 0
 
+    # ?older_than_days=N - удалить только записи старше N дней, пачками по диапазонам id (main/retention.py)
+    older_than_days = request.query_params.get('older_than_days')
+    if older_than_days is not None:
+        if not older_than_days.isdigit():
+            return Response({"error": "older_than_days должен быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+        cutoff = timezone.now() - timedelta(days=int(older_than_days))
+        filters = {'employee': employee} if employee else {}
+        for policy in RETENTION_POLICIES:
+            if policy.name == 'employee_log' and log_type in ['both', 'employee_log']:
+                employee_logs_deleted, _ = purge(policy._replace(filters=filters), cutoff)
+            elif policy.name == 'employee_action_log' and log_type in ['both', 'employee_action_log']:
+                employee_action_logs_deleted, _ = purge(policy._replace(filters=filters), cutoff)
+        return Response({
+            "message": f"Deleted {employee_logs_deleted} logs from EmployeeLog and {employee_action_logs_deleted} logs from EmployeeActionLog"
+        }, status=status.HTTP_200_OK)
+
     # Логика для удаления логов в зависимости от переданного типа
     if log_type in ['both', 'employee_log']:
         if employee:
@@ -179,7 +219,7 @@ class TestScoreAPIView(APIView):
         return Response(result)
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 def deactivate_user(request, user_id):
     try:
         employee = Employee.objects.get(id=user_id)
@@ -195,7 +235,7 @@ def deactivate_user(request, user_id):
 
 
 @api_view(['DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def delete_user(request, user_id):
     try:
@@ -208,7 +248,7 @@ def delete_user(request, user_id):
         return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def activate_user(request, user_id):
     try:
@@ -220,7 +260,7 @@ def activate_user(request, user_id):
     except ValidationError as e:
         return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def test_statistics(request):
     attempts_with_statistics = TestAttempt.objects.annotate(
@@ -311,7 +351,7 @@ def test_statistics(request):
     }
 
     return Response(result)
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 class MostIncorrectQuestionsAPIView(APIView):
     def get(self, request):
@@ -408,7 +448,7 @@ class DynamicPermission(BasePermission):
     def has_permission(self, request, view):
         required_permission = view.required_permissions.get(request.method.lower())
         if required_permission:
-            has_perm = request.user.has_perm(required_permission)
+            has_perm = user_has_perm(request.user, required_permission)
             return has_perm
         return False
 
@@ -565,7 +605,7 @@ class EmployeeDetails(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Employee.DoesNotExist:
             return Response({"message": "Employee not found"}, status=status.HTTP_404_NOT_FOUND)
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 class RegisterAPIView(APIView):
     @transaction.atomic
     def post(self, request):
@@ -665,7 +705,7 @@ def reset_karma_update(request, employee_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 class PlayersViewSet(BasePermissionViewSet):
-    queryset = Employee.objects.filter(is_active=True)
+    queryset = Employee.objects.filter(is_active=True).select_related('acoin', 'avatar', 'stats')
     serializer_class = PlayersSerializer
     permission_classes = [IsAuthenticated]
 
@@ -801,10 +841,9 @@ def moderate_feedback(request, feedback_id):
 
 def calculate_karma_change(operation_type, level=None):
     try:
-        if level is not None:
-            karma_setting = KarmaSettings.objects.get(operation_type=operation_type, level=level)
-        else:
-            karma_setting = KarmaSettings.objects.get(operation_type=operation_type, level__isnull=True)
+        karma_setting = get_config().karma_setting(operation_type, level)
+        if karma_setting is None:
+            raise KarmaSettings.DoesNotExist
 
         return {
             "karma_change": karma_setting.karma_change or 0,
@@ -956,9 +995,50 @@ def get_micro_user(request):
         return Response({"error": str(e)}, status=400)
 
 
+RATING_PAGE_SIZE = 50
+# Параметры, при которых get_rating отдаёт страницу рейтинга вместо прежнего списка
+RATING_PARAMS = ('metric', 'page', 'page_size', 'top', 'around', 'after')
+RATING_MAX_PAGE_SIZE = 200
+
+
+def _positive_int_param(request, name, default, maximum=None):
+    try:
+        value = int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    value = max(value, 1)
+    return min(value, maximum) if maximum else value
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_rating(request):
+    """
+    Без параметров - прежний ответ: список {id, full_name} всех сотрудников по убыванию опыта.
+
+    С любым из параметров RATING_PARAMS - рейтинг активных сотрудников по метрике
+    (?metric=experience|karma|acoins или начисления за период, например experience_week,
+    acoins_month) в виде {metric, count, page, page_size, my_rank, results, next}.
+    ?top=N - первые N мест, ?around=me - page_size мест до и после сотрудника,
+    ?after=<значение>,<id> - page_size мест после указанной строки (курсор следующей
+    страницы - в next), иначе страница ?page (по page_size строк). Место сотрудника
+    возвращается в my_rank.
+    """
+    if not any(param in request.query_params for param in RATING_PARAMS):
+        employees = Employee.objects.only('id', 'first_name', 'last_name', 'experience').order_by('-experience')
+        serializer = RatingSerializer(employees, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    return _rating_response(request, request.query_params.get('metric', 'experience'))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_period_rating(request, period):
+    """Рейтинг по начислениям за текущую неделю или месяц (?metric=experience|karma|acoins)."""
+    return _rating_response(request, f"{request.query_params.get('metric', 'experience')}_{period}")
+
+
+def _rating_response(request, metric):
     current_employee = request.user
     employee_id = request.query_params.get('employee_id', None)
 
@@ -968,14 +1048,54 @@ def get_rating(request):
     else:
         employee = current_employee
 
-    # Получаем всех сотрудников и сортируем их по опыту (опыт, вероятно, числовое поле)
-    employees = Employee.objects.all().order_by('-experience')  # '-experience' для сортировки от большего к меньшему
+    if metric not in LEADERBOARD_METRICS:
+        return Response({"error": f"Неизвестная метрика: {metric}"}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Сериализация списка сотрудников
-    serializer = RatingSerializer(employees, many=True, context={'request': request})
+    leaderboard = get_leaderboard(metric)
+    page_size = _positive_int_param(request, 'page_size', RATING_PAGE_SIZE, RATING_MAX_PAGE_SIZE)
+    page = None
+    next_cursor = None
+    if 'after' in request.query_params:
+        # Keyset-страница: ?after=<значение>,<id> последней строки предыдущей страницы
+        value, _, after_id = request.query_params['after'].rpartition(',')
+        try:
+            value, after_id = float(value), int(after_id)
+        except ValueError:
+            return Response({"error": "Ожидается after=<значение>,<id>"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = leaderboard.after(value, after_id, page_size)
+        if len(rows) == page_size:
+            next_cursor = f"{rows[-1][2]},{rows[-1][1]}"
+    elif 'top' in request.query_params:
+        rows = leaderboard.top(_positive_int_param(request, 'top', RATING_PAGE_SIZE, RATING_MAX_PAGE_SIZE))
+    elif request.query_params.get('around') == 'me':
+        rows = leaderboard.around(employee.id, page_size)
+    else:
+        page = _positive_int_param(request, 'page', 1)
+        rows = leaderboard.page(page, page_size)
+
+    # Имена только для сотрудников на странице
+    employees = Employee.objects.only('id', 'first_name', 'last_name').in_bulk([row[1] for row in rows])
+    names = {
+        item['id']: item['full_name']
+        for item in RatingSerializer(
+            [employees[row[1]] for row in rows if row[1] in employees], many=True, context={'request': request}
+        ).data
+    }
+    results = [
+        {'rank': rank, 'id': row_employee_id, 'full_name': names.get(row_employee_id), 'value': value}
+        for rank, row_employee_id, value in rows
+        if row_employee_id in names
+    ]
 
-    # Возвращение списка сотрудников в виде JSON ответа
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({
+        'metric': metric,
+        'count': len(leaderboard),
+        'page': page,
+        'page_size': page_size,
+        'my_rank': leaderboard.rank(employee.id),
+        'results': results,
+        'next': next_cursor,
+    }, status=status.HTTP_200_OK)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user(request):
@@ -990,64 +1110,23 @@ def get_user(request):
 
         serializer = EmployeeSerializer(employee, context={'request': request})
 
-        # Вычисление периодов времени
-        today = timezone.now()
-        start_of_week = today - timedelta(days=today.weekday())
-        start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0) # Начало недели (понедельник)
-        start_of_month = today.replace(day=1)  # Начало месяца
-
-        # Подсчёт заработанного опыта за месяц и неделю (только положительные изменения)
-        total_experience_earned_month = EmployeeLog.objects.filter(
-            employee=employee,
-            change_type='experience',
-            timestamp__year=today.year,
-            timestamp__month=today.month,
-            new_value__gt=F('old_value')  # Только положительные изменения
-        ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-        total_experience_earned_week = EmployeeLog.objects.filter(
-            employee=employee,
-            change_type='experience',
-            timestamp__gte=start_of_week,
-            new_value__gt=F('old_value')  # Только положительные изменения
-        ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-        # Подсчёт общего заработанного опыта (все положительные изменения)
-        total_experience_earned = EmployeeLog.objects.filter(
-            employee=employee,
-            change_type='experience',
-            new_value__gt=F('old_value')  # Только положительные изменения
-        ).annotate(gain=F('new_value') - F('old_value')).aggregate(total=Sum('gain'))['total'] or 0
-
-        # Подсчёт заработанных A-коинов за месяц и неделю
-        total_acoins_month = AcoinTransaction.objects.filter(
-            employee=employee,
-            timestamp__gte=start_of_month
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        total_acoins_week = AcoinTransaction.objects.filter(
-            employee=employee,
-            timestamp__gte=start_of_week
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Накопительная статистика сотрудника (EmployeeStats) вместо агрегатов по всей истории
+        stats = EmployeeStats.for_employee(employee)
 
-        # Общий подсчёт A-коинов
-        total_acoins = AcoinTransaction.objects.filter(employee=employee).aggregate(total=Sum('amount'))['total'] or 0
+        # Заработанный опыт (только положительные изменения) и A-коины за всё время, месяц и неделю
+        total_experience_earned_month = stats.experience_earned_month
+        total_experience_earned_week = stats.experience_earned_week
+        total_experience_earned = stats.experience_earned
+        total_acoins_month = stats.acoins_earned_month
+        total_acoins_week = stats.acoins_earned_week
+        total_acoins = stats.acoins_earned
 
         # Остальные данные профиля, статистика
         registration_date = employee.date_joined.strftime('%Y-%m-%d')
         last_login = employee.last_login.strftime('%Y-%m-%d %H:%M:%S') if employee.last_login else 'Never'
-        completed_tests_count = TestAttempt.objects.filter(employee=employee, status=TestAttempt.PASSED).count()
-
-        complaints_count = Feedback.objects.filter(
-            target_employee=employee,
-            type="complaint",
-            status='approved'
-        ).count()
-        praises_count = Feedback.objects.filter(
-            target_employee=employee,
-            type="praise",
-            status='approved'
-        ).count()
+        completed_tests_count = stats.completed_tests
+        complaints_count = stats.complaints_count
+        praises_count = stats.praises_count
         praises = Feedback.objects.filter(target_employee=employee, type="praise", status='approved')
 
         # Ответы на вопросы опроса
@@ -1085,7 +1164,7 @@ def get_user(request):
         employee_achievements = EmployeeAchievement.objects.filter(employee=employee)
         employee_achievements_data = EmployeeAchievementSerializer(employee_achievements, many=True,
                                                                    context={'request': request}).data
-        achievements_count = employee_achievements.count()
+        achievements_count = stats.achievements_count
 
         # Функция для разделения списка достижений на группы по 3 элемента
         def chunk_list(data, chunk_size):
@@ -1095,27 +1174,33 @@ def get_user(request):
         achievements_chunks = chunk_list(employee_achievements_data, 6)
 
         # Обращения
-        requests_qs = Request.objects.filter(support_operator=employee).select_related('classification')
-        requests_massive_qs = requests_qs.filter(is_massive=True)
-
-        total_requests = requests_qs.count()
-        requests_this_month = requests_qs.filter(date__year=today.year, date__month=today.month).count()
-        requests_this_week = requests_qs.filter(date__gte=start_of_week).count()
-
-        total_requests_massive = requests_massive_qs.count()
-        requests_massive_this_month = requests_massive_qs.filter(date__year=today.year, date__month=today.month).count()
-        requests_massive_this_week = requests_massive_qs.filter(date__gte=start_of_week).count()
-
-        # Обновляем группировку по классификациям
-        classifications = requests_qs.values('classification__name').annotate(
-            total=Count('number'),
-            month=Count('number', filter=Q(date__year=today.year, date__month=today.month)),
-            week=Count('number', filter=Q(date__gte=start_of_week))
-        )
+        total_requests = stats.requests_total
+        requests_this_month = stats.requests_month
+        requests_this_week = stats.requests_week
+
+        total_requests_massive = stats.massive_requests_total
+        requests_massive_this_month = stats.massive_requests_month
+        requests_massive_this_week = stats.massive_requests_week
+
+        # Группировка по классификациям: счётчики хранятся по id, имена берём одним запросом
+        classification_names = dict(Classifications.objects.filter(
+            id__in=stats.requests_by_classification.keys()
+        ).values_list('id', 'name'))
+        classifications = {}
+        for classification_id, (total, month, week) in stats.requests_by_classification.items():
+            if not total:
+                continue
+            name = classification_names.get(int(classification_id))
+            item = classifications.setdefault(name, {'classification__name': name, 'total': 0, 'month': 0, 'week': 0})
+            item['total'] += total
+            item['month'] += month
+            item['week'] += week
+        classifications = classifications.values()
+
         # Подсчёт количества обращений по типам сложности
-        simple_requests_count = requests_qs.filter(computed_complexity='simple').count()
-        medium_requests_count = requests_qs.filter(computed_complexity='medium').count()
-        hard_requests_count = requests_qs.filter(computed_complexity='hard').count()
+        simple_requests_count = stats.simple_requests
+        medium_requests_count = stats.medium_requests
+        hard_requests_count = stats.hard_requests
 
         # Подсчёт процентов для каждого типа
         def calculate_percentage(part, whole):
@@ -1162,55 +1247,10 @@ def get_user(request):
                 }
         ]
 
-        # Количество отработанных дней
-        worked_days = ShiftHistory.objects.filter(employee=employee).values('date').distinct().count()
-
-        # Количество опозданий
-        total_lates = ShiftHistory.objects.filter(employee=employee, late=True).count()
-
-        # Получаем все смены сотрудника, отсортированные по дате
-        shift_history = ShiftHistory.objects.filter(employee=employee).order_by('date')
-
-        max_days_without_late = 0
-        current_streak = 0
-        last_date = None
-
-        for shift in shift_history:
-            if not shift.late:
-                # Если last_date существует, проверяем разницу в днях
-                if last_date:
-                    day_difference = (shift.date - last_date).days
-                    # Если разница больше 1 дня, проверяем наличие смен между ними
-                    if day_difference > 1:
-                        # Проверяем, есть ли смены между last_date и shift.date
-                        dates_in_between = [
-                            last_date + timedelta(days=i)
-                            for i in range(1, day_difference)
-                        ]
-                        shifts_in_between = ShiftHistory.objects.filter(
-                            employee=employee,
-                            date__in=dates_in_between
-                        )
-                        # Если смен между датами нет (это были выходные), продолжаем текущий стрик
-                        if not shifts_in_between.exists():
-                            current_streak += 1
-                        else:
-                            current_streak = 1
-                    else:
-                        current_streak += 1
-                else:
-                    # Если это первая смена, начинаем стрик
-                    current_streak = 1
-
-                # Обновляем максимум, если текущий стрик больше
-                max_days_without_late = max(max_days_without_late, current_streak)
-            else:
-                # Сбрасываем стрик, если была отметка о позднем приходе
-                current_streak = 0
-
-            # Обновляем последнюю обработанную дату
-            last_date = shift.date
-
+        # Смены: отработанные дни, опоздания и максимальный стрик без опозданий
+        worked_days = stats.worked_days
+        total_lates = stats.late_count
+        max_days_without_late = stats.max_streak
 
         # Инвентарь сотрудника
         employee_items = EmployeeItem.objects.filter(employee=employee)
@@ -1329,12 +1369,14 @@ class FeedbackDetailView(generics.RetrieveAPIView):
         # Дополнительные фильтры или логика, если потребуется
         return super().get_queryset()
 
-class EmployeeLogViewSet(viewsets.ReadOnlyModelViewSet):
+class EmployeeLogViewSet(KeysetListMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint для просмотра логов изменений сотрудников.
     """
-    queryset = EmployeeLog.objects.all().order_by('-timestamp')
+    queryset = EmployeeLog.objects.select_related('employee').order_by('-timestamp')
     serializer_class = EmployeeLogSerializer
+    keyset_field = 'timestamp'
+    filter_fields = {'employee_id': 'employee_id', 'change_type': 'change_type'}
 
 class SurveyQuestionView(APIView):
     def get_permissions(self):
@@ -1403,19 +1445,31 @@ class ClassificationsViewSet(BasePermissionViewSet):
     serializer_class = ClassificationsSerializer
     permission_classes = [IsAuthenticated]
 
+    extra_permission_classes = {
+        'bulk_upsert': [partial(HasPermission, perm='main.add_classifications')],
+    }
+
+    @action(detail=False, methods=['post'])
+    def bulk_upsert(self, request):
+        # Принимает {"paths": ["A->B->C", ...]}, недостающие уровни создаются пачками
+        paths = request.data.get('paths')
+        if not isinstance(paths, list) or not all(isinstance(path, str) and path.strip() for path in paths):
+            return Response({"detail": "Expected 'paths': a list of non-empty strings."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        classifications = upsert_classification_paths(paths, employee=getattr(request, 'employee', None))
+        return Response({path: ClassificationTree.serialize(classification)
+                         for path, classification in classifications.items()})
+
     @action(detail=False, methods=['get'])
     def tree(self, request):
-        root_nodes = Classifications.objects.filter(parent__isnull=True)
-        serializer = self.get_serializer(root_nodes, many=True)
-        return Response(serializer.data)
+        tree = get_classification_tree()
+        return Response([tree.serialize(classification) for classification in tree.roots()])
 
     @action(detail=False, methods=['get'])
     def leaf_nodes(self, request):
-        # Фильтрация классификаций, у которых нет подкатегорий (subclassifications)
-        leaf_nodes = Classifications.objects.annotate(subclassifications_count=Count('subclassifications')).filter(subclassifications_count=0)
-        serializer = self.get_serializer(leaf_nodes, many=True)
-
-        return Response(serializer.data)
+        # Классификации без подкатегорий берутся из снимка дерева
+        tree = get_classification_tree()
+        return Response([tree.serialize(classification) for classification in tree.leaves()])
 class ComplexityThresholdsViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
@@ -1464,10 +1518,12 @@ class SurveyAnswerViewSet(BasePermissionViewSet):
     def perform_create(self, serializer):
         serializer.save(employee=self.request.user)
 
-class EmployeeActionLogViewSet(BasePermissionViewSet):
-    queryset = EmployeeActionLog.objects.all().order_by('-created_at')
+class EmployeeActionLogViewSet(KeysetListMixin, BasePermissionViewSet):
+    queryset = EmployeeActionLog.objects.select_related('employee').order_by('-created_at')
     serializer_class = EmployeeActionLogSerializer
     permission_classes = [IsAuthenticated]
+    keyset_field = 'created_at'
+    filter_fields = {'employee_id': 'employee_id', 'model_name': 'model_name', 'action_type': 'action_type'}
 
 class GroupViewSet(BasePermissionViewSet):
     queryset = Group.objects.all()
@@ -1507,6 +1563,7 @@ class PermissionManagementViewSet(BasePermissionViewSet):
         user = get_object_or_404(Employee, pk=pk)
         permission = get_object_or_404(Permission, id=request.data.get('permission_id'))
         user.user_permissions.add(permission)
+        transaction.on_commit(lambda: invalidate_user_roles(user.pk))
         return Response({'status': 'permission assigned'})
 
     @action(detail=True, methods=['post'])
@@ -1514,6 +1571,7 @@ class PermissionManagementViewSet(BasePermissionViewSet):
         user = get_object_or_404(Employee, pk=pk)
         permission = get_object_or_404(Permission, id=request.data.get('permission_id'))
         user.user_permissions.remove(permission)
+        transaction.on_commit(lambda: invalidate_user_roles(user.pk))
         return Response({'status': 'permission removed'})
 
     @action(detail=True, methods=['post'])
@@ -1521,6 +1579,8 @@ class PermissionManagementViewSet(BasePermissionViewSet):
         group = get_object_or_404(Group, pk=pk)
         permission = get_object_or_404(Permission, id=request.data.get('permission_id'))
         group.permissions.add(permission)
+        # Права группы меняются у всех её участников
+        transaction.on_commit(clear_role_cache)
         return Response({'status': 'permission assigned'})
 
     @action(detail=True, methods=['post'])
@@ -1528,6 +1588,7 @@ class PermissionManagementViewSet(BasePermissionViewSet):
         group = get_object_or_404(Group, pk=pk)
         permission = get_object_or_404(Permission, id=request.data.get('permission_id'))
         group.permissions.remove(permission)
+        transaction.on_commit(clear_role_cache)
         return Response({'status': 'permission removed'})
 
     @action(detail=True, methods=['get'])
@@ -1579,19 +1640,27 @@ def system_statistics(request):
     )
 
     # 6. Получить тесты, которые были модерированы
-    moderated_tests = []
-    moderated_tests_queryset = TestAttempt.objects.filter(test_results__icontains='moderator')
-
-    # Обработка результатов вручную
-    for attempt in moderated_tests_queryset:
-        test_result = json.loads(attempt.test_results)
-        if 'moderator' in test_result:
-            test_name = attempt.test.name
-            moderated_test = next((item for item in moderated_tests if item['name'] == test_name), None)
-            if moderated_test:
-                moderated_test['moderated_attempts'] += 1
-            else:
-                moderated_tests.append({'name': test_name, 'moderated_attempts': 1})
+    moderated_tests = list(
+        AttemptAnswer.objects.exclude(moderator_name='')
+        .values(name=F('attempt__test__name'))
+        .annotate(moderated_attempts=Count('attempt', distinct=True))
+        .order_by('name')
+    )
+
+    if is_stream_requested(request):
+        # Потоковый режим: списки пользователей и тестов читаются пачками и пишутся в ответ по мере чтения
+        return streaming_json_response(iter_json_object([
+            ('active_users_count', active_users_count),
+            ('active_users', active_users.iterator(chunk_size=STREAM_CHUNK_SIZE)),
+            ('total_users_count', total_users_count),
+            ('users', users.iterator(chunk_size=STREAM_CHUNK_SIZE)),
+            ('deactivated_users_count', deactivated_users_count),
+            ('deactivated_users', deactivated_users.iterator(chunk_size=STREAM_CHUNK_SIZE)),
+            ('total_tests_count', total_tests_count),
+            ('tests', tests.iterator(chunk_size=STREAM_CHUNK_SIZE)),
+            ('successful_tests', successful_tests.iterator(chunk_size=STREAM_CHUNK_SIZE)),
+            ('moderated_tests', moderated_tests),
+        ]))
 
     # Подготовка ответа
     data = {
@@ -1866,12 +1935,14 @@ class PreloadedAvatarViewSet(BasePermissionViewSet):
         if not employee.owned_avatars.filter(id=avatar.id).exists():
             return Response({'detail': 'You do not own this avatar.'}, status=status.HTTP_400_BAD_REQUEST)
         employee.avatar = avatar
-        employee.save()
+        employee.save(update_fields=['avatar'])
         return Response({'detail': 'Avatar equipped successfully.'}, status=status.HTTP_200_OK)
 
 def get_active_users(minutes=5):
     time_threshold = timezone.now() - timedelta(minutes=minutes)
-    active_users = Employee.objects.filter(last_login__gte=time_threshold, is_active=True)
+    # Учитываем и записанную активность, и ещё не сброшенную в базу (main/activity.py)
+    recent_ids = [employee_id for employee_id, when in pending_activity().items() if when >= time_threshold]
+    active_users = Employee.objects.filter(Q(last_login__gte=time_threshold) | Q(pk__in=recent_ids), is_active=True)
     return active_users
 @permission_classes([IsAdmin])
 @api_view(['DELETE'])
@@ -1921,37 +1992,8 @@ def get_test_with_theory(request, test_id):
         # Получаем тест по его идентификатору
         test = Test.objects.get(id=test_id)
 
-        # Получаем все вопросы для этого теста
-        questions = TestQuestion.objects.filter(test=test)
-
-        data = []
-
-        # Проходимся по каждому вопросу
-        for question in questions:
-            # Получаем все теории для этого вопроса
-            theories = Theory.objects.filter(test=test).order_by('position')
-
-            # Добавляем теории и вопросы в порядке их позиции
-            for block in theories:
-                data.append({
-                    'type': 'theory',
-                    'text': block.text
-                })
-
-            data.append({
-                'type': 'question',
-                'question_text': question.question_text,
-                'question_type': question.question_type,
-                'points': question.points,
-                'explanation': question.explanation,
-                'answer_options': [
-                    {
-                        'option_text': option.option_text,
-                        'is_correct': option.is_correct
-                    }
-                    for option in question.answer_options.all()
-                ]
-            })
+        # Теория и вопросы в порядке их позиции из кеша содержимого тестов
+        data = get_test_content(test.id).questions_with_theory
 
         return Response(data)
     except Test.DoesNotExist:
@@ -2122,6 +2164,11 @@ def get_test_statistics(request):
         test_id=OuterRef('test_id')
     ).order_by('-end_time').values('id')[:1]
 
+    # Модератор попытки - по первому модерированному ответу (индекс attempt, position)
+    moderator_subquery = AttemptAnswer.objects.filter(
+        attempt_id=OuterRef('pk')
+    ).exclude(moderator_name='').order_by('position').values('moderator_name')[:1]
+
     statistics = TestAttempt.objects.annotate(
         total_score=F('score'),
         max_score=F('test__max_score'),
@@ -2133,6 +2180,7 @@ def get_test_statistics(request):
             default=False,
             output_field=BooleanField()
         ),  # Проверка на последнюю попытку
+        moderator=Subquery(moderator_subquery),
     ).values(
         'id',  # Нам нужен id для извлечения данных позже
         'test__id',
@@ -2147,61 +2195,59 @@ def get_test_statistics(request):
         'acoin',  # Добавляем поле Acoin
         'start_time',
         'end_time',
-        'is_last_attempt'
+        'is_last_attempt',
+        'moderator',
     )
 
-    # Обработка данных в Python: объединение имени и фамилии и добавление модератора
-    statistics_list = []
+    # ?after=<start_time>,<id>&limit=N - страница от новых попыток к старым, ?stream=1 - потоковый ответ
+    stream = is_stream_requested(request)
+    page = None
+    if stream or is_keyset_requested(request):
+        after, limit = keyset_params(request)
+        page = KeysetPage(keyset(statistics, 'start_time', after), 'start_time', limit)
+        statistics = page
+
     themes_set = set()  # Для хранения уникальных тем
     tests_set = set()
     employees_set = set()
-    for stat in statistics:
-        try:
-            # Извлекаем full_name
-            stat['full_name'] = f"{stat['employee__first_name']} {stat['employee__last_name']}"
-
-            # Округляем до целого числа duration_seconds
-            if stat['start_time'] and stat['end_time']:
-                stat['duration_seconds'] = int((stat['end_time'] - stat['start_time']).total_seconds())
-            else:
-                stat['duration_seconds'] = None
 
-            # Извлечение модератора из JSON-поля test_results
-            test_attempt = TestAttempt.objects.get(id=stat['id'])
-            if test_attempt.test_results:
-                try:
-                    test_results = json.loads(test_attempt.test_results)
-                    stat['moderator'] = test_results.get('moderator', None)
-                except json.JSONDecodeError as e:
-                    stat['moderator'] = None
-                    print(f"Ошибка разбора JSON для попытки {test_attempt.id}: {str(e)}")
-            else:
-                stat['moderator'] = None
-
-            # Удаляем ненужные поля
-            del stat['employee__first_name']
-            del stat['employee__last_name']
-
-            # Добавляем тему теста в set, чтобы не было дубликатов
-            themes_set.add(stat['test__theme__name'])
-            tests_set.add(stat['test__name'])
-            employees_set.add(stat['full_name'])
-            statistics_list.append(stat)
-        except ObjectDoesNotExist as e:
-            print(f"Ошибка: Не удалось найти TestAttempt с id {stat['id']}")
-        except Exception as e:
-            print(f"Неожиданная ошибка для попытки {stat['id']}: {str(e)}")
+    def iter_statistics():
+        # Обработка данных в Python: объединение имени и фамилии и добавление модератора
+        for stat in statistics:
+            try:
+                # Извлекаем full_name
+                stat['full_name'] = f"{stat['employee__first_name']} {stat['employee__last_name']}"
 
-    # Преобразуем set тем в список
-    themes_list = list(themes_set)
-    tests_set = list(tests_set)
-    employees_set = list(employees_set)
-    return Response({
-        'statistics': statistics_list,
-        'themes': themes_list,  # Отдельный список уникальных тем
-        'tests': tests_set,
-        'employees': employees_set
-    })
+                # Округляем до целого числа duration_seconds
+                if stat['start_time'] and stat['end_time']:
+                    stat['duration_seconds'] = int((stat['end_time'] - stat['start_time']).total_seconds())
+                else:
+                    stat['duration_seconds'] = None
+
+                # Удаляем ненужные поля
+                del stat['employee__first_name']
+                del stat['employee__last_name']
+
+                # Добавляем тему теста в set, чтобы не было дубликатов
+                themes_set.add(stat['test__theme__name'])
+                tests_set.add(stat['test__name'])
+                employees_set.add(stat['full_name'])
+                yield stat
+            except Exception as e:
+                print(f"Неожиданная ошибка для попытки {stat['id']}: {str(e)}")
+
+    # Списки тем, тестов и сотрудников известны только после обхода попыток
+    fields = [
+        ('statistics', iter_statistics()),
+        ('themes', lambda: list(themes_set)),  # Отдельный список уникальных тем
+        ('tests', lambda: list(tests_set)),
+        ('employees', lambda: list(employees_set)),
+    ]
+    if page is not None:
+        fields.append(('next', page.next_cursor))
+    if stream:
+        return streaming_json_response(iter_json_object(fields))
+    return Response({key: value() if callable(value) else list(value) for key, value in fields})
 
 
 
@@ -2214,53 +2260,14 @@ def get_test_by_id(request, test_id):
     test_serializer = TestSerializer(test, context={'request': request})
     test_data = test_serializer.data
 
-    # Получаем все вопросы и теорию для данного теста, отсортированные по позиции
-    questions = TestQuestion.objects.filter(test=test).order_by('position')
-    theories = Theory.objects.filter(test=test).order_by('position')
-
-    # Создаем список для хранения блоков теста
-    blocks = []
-
-    # Добавляем данные о вопросах в список блоков
-    for question in questions:
-        question_data = TestQuestionSerializer(question, context={'request': request}).data
-        del question_data['id']  # Удаляем поле "id"
-        del question_data['test']  # Удаляем поле "test"
-        answer_options = question_data.get('answer_options', [])
-        for answer in answer_options:
-            del answer['id']  # Удаляем поле "id" из каждого ответа
-            del answer['question']
-            del answer['file']
-        block_data = {
-            'type': 'question',
-            'content': question_data
-        }
-        blocks.append(block_data)
-
-    # Добавляем данные о теории в список блоков
-    for theory in theories:
-        theory_data = TheorySerializer(theory, context={'request': request}).data
-        del theory_data['id']  # Удаляем поле "id"
-        del theory_data['test']  # Удаляем поле "test"
-        block_data = {
-            'type': 'theory',
-            'content': theory_data
-        }
-        blocks.append(block_data)
-
-    # Сортируем блоки по позиции, если она есть
-    sorted_blocks = sorted(blocks, key=lambda x: x['content'].get('position', 0))
+    # Вопросы и теория теста, отсортированные по позиции, из кеша содержимого тестов
+    sorted_blocks = get_test_content(test.id).render_blocks(request)
     employee_experience = employee.experience
     employee_karma = employee.karma
     has_sufficient_karma = employee_karma >= test.required_karma
     has_sufficient_experience = employee_experience >= test.min_experience
     test_available = has_sufficient_karma and has_sufficient_experience
 
-
-    # Добавляем позицию вопроса к соответствующим блокам
-    for block in sorted_blocks:
-        block['content']['position'] = block['content'].get('position', 0)
-
     # Определение доступности теста
     employee = getattr(request, 'employee', request.user)
 
@@ -2287,28 +2294,37 @@ class ThemesWithTestsView(APIView):
         employee_karma = getattr(employee, 'karma', 0)
         employee_experience = getattr(employee, 'experience', 0)
 
-        themes = Theme.objects.all().order_by('name')
+        # Последняя попытка сотрудника по каждому тесту и пройденные тесты - два запроса на все темы
+        last_attempt_ids = TestAttempt.objects.filter(employee=employee).values('test_id').annotate(
+            last_id=Max('pk')
+        ).values('last_id')
+        last_attempts = {
+            attempt.test_id: attempt
+            for attempt in TestAttempt.objects.filter(pk__in=Subquery(last_attempt_ids)).only(
+                'id', 'test_id', 'status', 'score', 'end_time', 'test_results'
+            )
+        }
+        passed_test_ids = set(
+            TestAttempt.objects.filter(employee=employee, status=TestAttempt.PASSED).values_list('test_id', flat=True)
+        )
+
         themes_with_tests = []
+        now = timezone.now()
 
-        for theme in themes:
-            tests = Test.objects.filter(theme=theme)
+        for theme_id, theme_name, tests in get_test_catalog().themes:
             tests_info = []
 
             for test in tests:
-                created_at = test.created_at.strftime("%Y-%m-%dT%H:%M")
-                test_attempt = TestAttempt.objects.filter(employee=employee, test=test).last()
+                test_attempt = last_attempts.get(test['id'])
 
                 if test_attempt:
                     if test_attempt.test_results:
                         try:
-                            test_results = json.loads(test_attempt.test_results)
-                            total_score = test_results.get("Набранное количество баллов", 0)
-                            max_score = test.max_score
-                            answers_info = test_results.get("answers_info", [])
+                            json.loads(test_attempt.test_results)
                             test_status = {
                                 "status": test_attempt.status,
                                 "total_score": test_attempt.score,
-                                "max_score": max_score
+                                "max_score": test['max_score']
                             }
                         except (json.JSONDecodeError, TypeError, KeyError):
                             test_status = None
@@ -2317,18 +2333,18 @@ class ThemesWithTestsView(APIView):
                 else:
                     test_status = {"status": "Не начато", "total_score": 0, "max_score": 0}
 
-                has_sufficient_karma = employee_karma >= test.required_karma
-                has_sufficient_experience = employee_experience >= test.min_experience
+                has_sufficient_karma = employee_karma >= test['required_karma']
+                has_sufficient_experience = employee_experience >= test['min_experience']
 
                 remaining_days = None
                 remaining_hours = None
                 remaining_minutes = None
                 test_available = has_sufficient_karma and has_sufficient_experience
 
-                if test_attempt and test.retry_delay_days is not None:
-                    end_time = test_attempt.end_time or timezone.now()
-                    time_since_last_attempt = timezone.now() - end_time
-                    remaining_time = timedelta(days=test.retry_delay_days) - time_since_last_attempt
+                if test_attempt and test['retry_delay_days'] is not None:
+                    end_time = test_attempt.end_time or now
+                    time_since_last_attempt = now - end_time
+                    remaining_time = timedelta(days=test['retry_delay_days']) - time_since_last_attempt
                     if remaining_time.total_seconds() > 0:
                         remaining_days = remaining_time.days
                         test_available = False  # Обновляем test_available, если нужно ждать
@@ -2339,17 +2355,17 @@ class ThemesWithTestsView(APIView):
                             remaining_minutes = remaining_seconds // 60
 
                 # Если тест одноразовый и уже был пройден
-                if not test.can_attempt_twice and TestAttempt.objects.filter(employee=employee, test=test, status=TestAttempt.PASSED).exists():
+                if not test['can_attempt_twice'] and test['id'] in passed_test_ids:
                     test_available = False
 
                 test_info = {
-                    'test': test.id,
-                    'name': test.name,
-                    'required_karma': test.required_karma,
-                    'min_exp': test.min_experience,
-                    'achievement': test.achievement.name if test.achievement else None,
-                    'created_at': created_at,
-                    'author': test.author.name if test.author else None,
+                    'test': test['id'],
+                    'name': test['name'],
+                    'required_karma': test['required_karma'],
+                    'min_exp': test['min_experience'],
+                    'achievement': test['achievement'],
+                    'created_at': test['created_at'],
+                    'author': test['author'],
                     'status': test_status,
                     'has_sufficient_karma': has_sufficient_karma,
                     'has_sufficient_experience': has_sufficient_experience,
@@ -2360,8 +2376,8 @@ class ThemesWithTestsView(APIView):
                 tests_info.append(test_info)
 
             theme_with_tests = {
-                'theme': theme.name,
-                'theme_id': theme.id,
+                'theme': theme_name,
+                'theme_id': theme_id,
                 'tests': tests_info
             }
             themes_with_tests.append(theme_with_tests)
@@ -2656,7 +2672,7 @@ def create_achievement(request):
 
 class CreateClassificationAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
     def post(self, request):
         name = request.data.get('name')
@@ -3016,10 +3032,13 @@ def moderate_test_attempt(request, test_attempt_id):
 
     test_attempt.end_time = timezone.now()
     test_attempt.save()
+    AttemptAnswer.apply_moderation(test_attempt, answers_info, moderator)
 
     # Начисление опыта модератору за модерацию теста
     try:
-        experience_multiplier = KarmaSettings.objects.get(operation_type="TEST_MODERATION")
+        experience_multiplier = get_config().first_karma_setting("TEST_MODERATION")
+        if experience_multiplier is None:
+            raise KarmaSettings.DoesNotExist
         experience_awarded = experience_multiplier.experience_change
     except KarmaSettings.DoesNotExist:
         experience_awarded = 10  # Дефолтное значение опыта, если настройка не найдена
@@ -3127,84 +3146,10 @@ class CompleteTestView(EmployeeAPIView):
         if not test_attempt:
             return Response({"message": "Test attempt not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        questions = TestQuestion.objects.filter(test=test)
-        total_score = Decimal('0.0')
-        max_score = Decimal('0.0')
-        answers_info = []
-
-        for question_number, question in enumerate(questions, start=1):
-            submitted_text_answer = ""
-            question_text = question.question_text
-            answer_options = [
-                {'option_number': index + 1, 'option_text': option.option_text, 'is_correct': option.is_correct} for
-                index, option in enumerate(question.answer_options.all())]
-            max_score += Decimal(str(question.points))
-
-            answer_key = str(question_number)
-            if answer_key in request.data:
-                submitted_answer = request.data[answer_key]
-
-                is_correct = False
-
-                if question.question_type == 'single':
-                    submitted_answer_number = int(submitted_answer)
-                    submitted_answer_option = answer_options[submitted_answer_number - 1]
-                    is_correct = submitted_answer_option['is_correct']
-                    if is_correct:
-                        total_score += Decimal(str(question.points))
-                        question_score = Decimal(str(question.points))
-                    else:
-                        question_score = Decimal('0.0')
-                elif question.question_type == 'text':
-                    submitted_text_answer = submitted_answer
-                    question_score = Decimal('0.0')
-                elif question.question_type == 'multiple':
-                    if isinstance(submitted_answer, int):
-                        submitted_answer = [submitted_answer]
-                    submitted_answer_numbers = [int(answer) for answer in submitted_answer]
-                    correct_option_numbers = [index + 1 for index, option in enumerate(answer_options) if option['is_correct']]
-
-                    selected_correct_answers = sum(1 for answer in submitted_answer_numbers if answer in correct_option_numbers)
-                    selected_incorrect_answers = sum(1 for answer in submitted_answer_numbers if answer not in correct_option_numbers)
-
-                    question_score_per_correct_answer = Decimal(str(question.points)) / Decimal(len(correct_option_numbers))
-                    question_score_per_incorrect_answer = Decimal(str(question.points)) / Decimal(len(correct_option_numbers))
-
-                    question_score = (selected_correct_answers * question_score_per_correct_answer) - (selected_incorrect_answers * question_score_per_incorrect_answer)
-
-                    if question_score < 0:
-                        question_score = Decimal('0.0')
-
-                    if selected_correct_answers == len(correct_option_numbers) and selected_incorrect_answers == 0:
-                        is_correct = True
-
-                    total_score += question_score
-
-                question_score = question_score.quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
-
-                answer_info = {
-                    "question_text": question_text,
-                    "type": question.question_type,
-                    "is_correct": is_correct,
-                    "question_score": float(question_score),
-                    "answer_options": [],
-                    "explanation": question.explanation
-                }
-                if question.question_type == 'text':
-                    answer_info['text_answer'] = submitted_text_answer
-                    answer_info['max_question_score'] = float(question.points)
-                else:
-                    for option in answer_options:
-                        option_info = {
-                            "option_number": option["option_number"],
-                            "option_text": option["option_text"],
-                            "submitted_answer": option["option_number"] in submitted_answer_numbers if isinstance(submitted_answer, list) else option["option_number"] == int(submitted_answer),
-                            "correct_options": option["is_correct"]
-                        }
-                        answer_info["answer_options"].append(option_info)
-                answers_info.append(answer_info)
-
-        total_score = total_score.quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
+        # Проверка по скомпилированному ключу ответов, без запросов к вопросам и вариантам
+        answer_key = get_answer_key(test.id)
+        total_score, answers_info, answered_question_ids = answer_key.grade(request.data)
+        max_score = answer_key.max_score
 
         test_attempt.test_results = json.dumps({
             "Набранное количество баллов": float(total_score),
@@ -3214,8 +3159,12 @@ class CompleteTestView(EmployeeAPIView):
         test_attempt.end_time = timezone.now()
         test_attempt.score = total_score  # Обновляем поле score
         test_attempt.save()
+        AttemptAnswer.objects.bulk_create([
+            AttemptAnswer.from_answer_info(test_attempt, position, answer_info, question_id=question_id)
+            for position, (answer_info, question_id) in enumerate(zip(answers_info, answered_question_ids), start=1)
+        ])
 
-        has_text_questions = TestQuestion.objects.filter(test=test, question_type='text').exists()
+        has_text_questions = answer_key.has_text_questions
 
         if total_score >= Decimal(str(test.passing_score)):
             test_attempt.status = TestAttempt.PASSED
@@ -3292,74 +3241,49 @@ def top_participants(request):
     return Response(top_participants, status=status.HTTP_200_OK)
 class StatisticsAPIView(APIView):
     def get(self, request):
-        # Получаем всех сотрудников
-        employees = Employee.objects.all()
-
-        # Список для хранения статистики по каждому сотруднику
-        employees_statistics = []
+        # Баланс A-коинов, опыт и количество достижений всех сотрудников одним запросом (main/statistics.py)
+        return JsonResponse(get_statistics('employee_balances', employee_balances), safe=False)
 
-        # Обходим каждого сотрудника
-        for employee in employees:
-            # Получаем количество заработанных валют текущего сотрудника
-            total_acoins = Acoin.objects.filter(employee=employee).aggregate(total_acoins=Sum('amount'))['total_acoins'] or 0
-
-            # Получаем количество заработанного опыта текущего сотрудника
-            total_experience = employee.experience
+def question_answer_counts(correct=False):
+    """
+    Число ответов на каждый вопрос (текст вопроса + тест) и число неверных
+    (или верных при correct=True) среди них - один GROUP BY по AttemptAnswer.
+    """
+    return AttemptAnswer.objects.values('question_text', test_id=F('attempt__test_id')).annotate(
+        total_answers=Count('id'),
+        count=Count('id', filter=Q(is_correct=correct)),
+    ).order_by()
 
-            # Получаем количество заработанных достижений текущего сотрудника
-            total_achievements = EmployeeAchievement.objects.filter(employee=employee).count()
 
-            # Добавляем информацию о текущем сотруднике в список
-            employee_info = {
-                "employee_id": employee.id,
-                "total_acoins": total_acoins,
-                "total_experience": total_experience,
-                "total_achievements": total_achievements
-            }
-            employees_statistics.append(employee_info)
+def most_selected_options(passed_only=False):
+    """(текст вопроса, id теста) -> (номер самого частого выбранного варианта, сколько раз выбран)."""
+    answers = AttemptAnswer.objects.exclude(question_type=TestQuestion.TEXT)
+    if passed_only:
+        answers = answers.filter(attempt__status=TestAttempt.PASSED)
+    counters = defaultdict(Counter)
+    for question_text, test_id, selected_options in answers.values_list(
+            'question_text', 'attempt__test_id', 'selected_options').iterator():
+        counters[(question_text, test_id)].update(selected_options or [])
+    return {key: counter.most_common(1)[0] for key, counter in counters.items() if counter}
 
-        # Возвращаем информацию по каждому сотруднику
-        return JsonResponse(employees_statistics, safe=False)
 
 @permission_classes([IsAdmin])
 class QuestionErrorsStatistics(APIView):
     def get(self, request):
-        # Создаем словари для хранения информации о частоте ошибок и общего числа ответов
-        error_counter = Counter()
-        total_answers_counter = Counter()
-
-        # Обходим все попытки прохождения тестов
-        for attempt in TestAttempt.objects.all():
-            # Получаем результаты теста для текущей попытки
-            test_results = attempt.test_results
-            if isinstance(test_results, str):
-                # Если test_results - строка, пытаемся преобразовать ее в словарь
-                try:
-                    results_dict = json.loads(test_results)
-                    for answer_info in results_dict.get("answers_info", []):
-                        question_text = answer_info.get("question_text")
-                        test_id = attempt.test_id
-                        question_id = f"{question_text}_{test_id}"
-                        # Увеличиваем счетчик общего числа ответов только один раз для каждого вопроса
-                        total_answers_counter[question_id] += 1
-                        # Проверяем, является ли ответ неправильным
-                        if not answer_info["is_correct"]:
-                            error_counter[question_id] += 1
-                except ValueError:
-                    # Если не удалось преобразовать строку в JSON, пропускаем эту попытку
-                    pass
+        # Число ответов и ошибок по каждому вопросу (текст вопроса + тест) одним GROUP BY
+        questions = question_answer_counts().filter(count__gt=0)
 
         # Формируем список вопросов, по которым чаще всего ошибаются
         most_common_errors = [
             {
-                "question_id": qid.split('_')[0],
-                "test_id": qid.split('_')[1],
-                "question_text": qid.split('_')[0],
-                "total_answers": total_answers_counter[qid],
-                "count": count,
-                "ratio": round(count / total_answers_counter[qid] * 100, 1) if total_answers_counter[qid] != 0 else 0
+                "question_id": row['question_text'],
+                "test_id": str(row['test_id']),
+                "question_text": row['question_text'],
+                "total_answers": row['total_answers'],
+                "count": row['count'],
+                "ratio": round(row['count'] / row['total_answers'] * 100, 1) if row['total_answers'] != 0 else 0
             }
-            for qid, count in error_counter.items()
+            for row in questions
         ]
 
         # Сортируем список по соотношению неверных ответов к общему количеству ответов
@@ -3378,42 +3302,20 @@ class PositionListView(APIView):
 @permission_classes([IsAdmin])
 class QuestionCorrectStatistics(APIView):
     def get(self, request):
-        # Создаем словари для хранения информации о частоте правильных ответов и общего количества ответов
-        correct_counter = Counter()
-        total_answers_counter = Counter()
-
-        # Обходим все попытки прохождения тестов
-        for attempt in TestAttempt.objects.all():
-            # Получаем результаты теста для текущей попытки
-            test_results = attempt.test_results
-            if isinstance(test_results, str):
-                # Если test_results - строка, пытаемся преобразовать ее в словарь
-                try:
-                    results_dict = json.loads(test_results)
-                    for answer_info in results_dict.get("answers_info", []):
-                        question_text = answer_info.get("question_text")
-                        test_id = attempt.test_id
-                        question_id = f"{question_text}_{test_id}"
-                        # Увеличиваем счетчик общего числа ответов только один раз для каждого вопроса
-                        total_answers_counter[question_id] += 1
-                        # Проверяем, является ли ответ правильным
-                        if answer_info["is_correct"]:
-                            correct_counter[question_id] += 1
-                except ValueError:
-                    # Если не удалось преобразовать строку в JSON, пропускаем эту попытку
-                    pass
+        # Число ответов и правильных ответов по каждому вопросу (текст вопроса + тест) одним GROUP BY
+        questions = question_answer_counts(correct=True).filter(count__gt=0)
 
         # Формируем список вопросов, по которым чаще всего отвечают правильно
         most_common_correct = [
             {
-                "question_id": qid.split('_')[0],
-                "test_id": qid.split('_')[1],
-                "question_text": qid.split('_')[0],
-                "total_answers": total_answers_counter[qid],
-                "count": count,
-                "ratio": round(count / total_answers_counter[qid] * 100, 1) if total_answers_counter[qid] != 0 else 0
+                "question_id": row['question_text'],
+                "test_id": str(row['test_id']),
+                "question_text": row['question_text'],
+                "total_answers": row['total_answers'],
+                "count": row['count'],
+                "ratio": round(row['count'] / row['total_answers'] * 100, 1) if row['total_answers'] != 0 else 0
             }
-            for qid, count in correct_counter.items()
+            for row in questions
         ]
 
         # Сортируем список по соотношению правильных ответов к общему количеству ответов
@@ -3731,167 +3633,61 @@ class UpdateTestAndContent(APIView):
                 return Response(response_data, status=status.HTTP_200_OK)
         except ValueError as e:
             return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+def question_statistics():
+    most_common_selected = most_selected_options()
+    return {
+        "most_common_errors": [
+            {"question": row['question_text'], "test_id": row['test_id'], "count": row['count'],
+             "most_selected": most_common_selected.get((row['question_text'], row['test_id']))}
+            for row in question_answer_counts().filter(count__gt=0).order_by('-count')
+        ],
+        "most_common_correct": [
+            {"question": row['question_text'], "test_id": row['test_id'], "count": row['count'],
+             "most_selected": most_common_selected.get((row['question_text'], row['test_id']))}
+            for row in question_answer_counts(correct=True).filter(count__gt=0).order_by('-count')
+        ],
+    }
+
+
+def most_common_selected_answers():
+    return [
+        {"question": q, "test_id": t, "most_selected": most_selected}
+        for (q, t), most_selected in most_selected_options(passed_only=True).items()
+    ]
+
+
 class FullStatisticsAPIView(APIView):
     def get(self, request):
-        # Initialize response dictionary
+        # Каждый раздел собирается фиксированным числом запросов и кешируется на STATISTICS_TTL секунд
         response_data = {}
 
         # Statistics for test questions
         try:
-            test_attempts = TestAttempt.objects.all()
-            question_errors = Counter()
-            question_correct = Counter()
-            question_most_selected = {}
-
-            for test_attempt in test_attempts:
-                test_results = test_attempt.test_results
-
-                # Ensure test_results is a dictionary
-                if isinstance(test_results, str):
-                    test_results = json.loads(test_results)
-
-                if test_results:
-                    answers_info = test_results.get("answers_info", [])
-
-                    for answer_info in answers_info:
-                        question_key = (answer_info["question_text"], test_attempt.test_id)
-
-                        if not answer_info["is_correct"]:
-                            question_errors[question_key] += 1
-                        else:
-                            question_correct[question_key] += 1
-
-                        selected_option = answer_info.get("selected_option", "")
-                        if selected_option:
-                            if question_key not in question_most_selected:
-                                question_most_selected[question_key] = Counter()
-                            question_most_selected[question_key][selected_option] += 1
-
-            most_common_errors = question_errors.most_common()
-            most_common_correct = question_correct.most_common()
-            most_common_selected = {k: v.most_common(1)[0] for k, v in question_most_selected.items()}
-
-            response_data["most_common_errors"] = [
-                {"question": q, "test_id": t, "count": c, "most_selected": most_common_selected.get((q, t))}
-                for (q, t), c in most_common_errors
-            ]
-            response_data["most_common_correct"] = [
-                {"question": q, "test_id": t, "count": c, "most_selected": most_common_selected.get((q, t))}
-                for (q, t), c in most_common_correct
-            ]
+            response_data.update(get_statistics('questions', question_statistics))
         except Exception as e:
             response_data["question_statistics_error"] = str(e)
 
-        # Statistics for test duration
+        # Statistics for test duration and score percentage
         try:
-            test_stats = {}
-            tests = Test.objects.all()
-
-            for test in tests:
-                test_attempts = TestAttempt.objects.filter(test=test, status=TestAttempt.PASSED)
-
-                if test_attempts.exists():
-                    durations = [
-                        (attempt.end_time - attempt.start_time).total_seconds()
-                        for attempt in test_attempts
-                        if attempt.end_time and attempt.start_time
-                    ]
-                    if durations:
-                        avg_duration = sum(durations) / len(durations)
-                        max_duration = max(durations)
-                    else:
-                        avg_duration = None
-                        max_duration = None
-
-                    individual_durations = [
-                        {"employee_id": attempt.employee_id, "duration": (attempt.end_time - attempt.start_time).total_seconds()}
-                        for attempt in test_attempts
-                        if attempt.end_time and attempt.start_time
-                    ]
-
-                    test_stats[test.id] = {
-                        "average_duration": avg_duration,
-                        "max_duration": max_duration,
-                        "individual_durations": individual_durations
-                    }
-                else:
-                    test_stats[test.id] = {
-                        "average_duration": None,
-                        "max_duration": None,
-                        "individual_durations": []
-                    }
-
-            response_data["test_duration_statistics"] = test_stats
+            test_stats = get_statistics('tests', test_summary)
+            response_data["test_duration_statistics"] = test_stats["test_duration_statistics"]
         except Exception as e:
+            test_stats = None
             response_data["test_duration_statistics_error"] = str(e)
 
         # Statistics for employee achievements, currency, and experience
         try:
-            employees = Employee.objects.all()
-            employee_stats = []
-
-            for employee in employees:
-                employee_achievements = EmployeeAchievement.objects.filter(employee=employee)
-                total_acoins = AcoinTransaction.objects.filter(employee=employee).aggregate(total=Sum('amount'))[
-                    'total']
-                employee_stats.append({
-                    "employee_id": employee.id,
-                    "total_acoins": total_acoins or 0,
-                    "total_experience": employee.experience,
-                    "total_achievements": employee_achievements.count()
-                })
-
-            response_data["employee_statistics"] = employee_stats
+            response_data["employee_statistics"] = get_statistics('employee_totals', employee_totals)
         except Exception as e:
             response_data["employee_statistics_error"] = str(e)
 
-        # Statistics for test score percentage
-        try:
-            test_scores = {}
-            for test in tests:
-                test_attempts = TestAttempt.objects.filter(test=test, status=TestAttempt.PASSED)
-                total_attempts = test_attempts.count()
-                if total_attempts > 0:
-                    total_correct_attempts = test_attempts.aggregate(Sum('score'))['score__sum']
-                    if total_correct_attempts is not None:
-                        percentage_correct = math.ceil((total_correct_attempts / total_attempts))
-                    else:
-                        percentage_correct = 0
-                else:
-                    percentage_correct = 0
-                test_scores[test.id] = percentage_correct
-
-            response_data["test_score_percentage"] = test_scores
-        except Exception as e:
-            response_data["test_score_percentage_error"] = str(e)
+        if test_stats is not None:
+            response_data["test_score_percentage"] = test_stats["test_score_percentage"]
 
         # Statistics for most frequently selected answers
         try:
-            most_selected_answers = {}
-            for test_attempt in test_attempts:
-                test_results = test_attempt.test_results
-                if isinstance(test_results, str):
-                    test_results = json.loads(test_results)
-                if test_results:
-                    answers_info = test_results.get("answers_info", [])
-                    for answer_info in answers_info:
-                        question_key = (answer_info["question_text"], test_attempt.test_id)
-                        selected_option = answer_info.get("selected_option", "")
-                        if selected_option:
-                            if question_key not in most_selected_answers:
-                                most_selected_answers[question_key] = Counter()
-                            most_selected_answers[question_key][selected_option] += 1
-
-            most_common_selected = {k: v.most_common(1)[0] for k, v in most_selected_answers.items()}
-            response_data["most_common_selected_answers"] = [
-                {"question": q, "test_id": t, "most_selected": most_common_selected.get((q, t))}
-                for (q, t) in most_common_selected
-            ]
-        except Exception as e:
-            response_data["most_common_selected_answers"] = [
-                {"question": q, "test_id": t, "most_selected": most_common_selected.get((q, t))}
-                for (q, t) in most_common_selected
-            ]
+            response_data["most_common_selected_answers"] = get_statistics(
+                'most_common_selected_answers', most_common_selected_answers)
         except Exception as e:
             response_data["most_selected_answers_error"] = str(e)
 
@@ -4016,7 +3812,7 @@ class BackgroundViewSet(viewsets.ModelViewSet):
         if not employee.owned_backgrounds.filter(id=background.id).exists():
             return Response({'detail': 'You do not own this background.'}, status=status.HTTP_400_BAD_REQUEST)
         employee.selected_background = background
-        employee.save()
+        employee.save(update_fields=['selected_background'])
         return Response({'detail': 'Background equipped successfully.'}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
@@ -4059,5 +3855,5 @@ class BackgroundViewSet(viewsets.ModelViewSet):
 
         # Установка фона
         employee.selected_background = background
-        employee.save()
+        employee.save(update_fields=['selected_background'])
         return Response({'detail': 'Фон успешно установлен.'})
\ No newline at end of file
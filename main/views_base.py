@@ -1,23 +1,78 @@
 # views_base.py
 
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 
+from .authentication import CachedTokenAuthentication
+from .streaming import KeysetPage, is_keyset_requested, is_stream_requested, iter_json_array, iter_json_object, \
+    keyset, keyset_params, parse_date_range, streaming_json_response
+
 
 class EmployeeAPIView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        token_key = request.auth.key
-        try:
-            token = Token.objects.get(key=token_key)
-            request.employee = token.user
-        except Token.DoesNotExist:
-            self.permission_denied(request, message="Invalid token")
-        except AttributeError:
-            self.permission_denied(request, message="Employee not found for this token")
\ No newline at end of file
+        # Токен и сотрудник уже получены CachedTokenAuthentication, повторный запрос не нужен
+        if not isinstance(request.auth, Token):
+            self.permission_denied(request, message="Employee not found for this token")
+        request.employee = request.user
+
+
+def with_display_number(queryset):
+    """
+    Добавляет display_number - сплошной номер строки по возрастанию id среди строк
+    выборки. Номер считается при чтении оконной функцией, поэтому после удалений
+    id не нужно перенумеровывать.
+    """
+    return queryset.annotate(display_number=Window(expression=RowNumber(), order_by=F('pk').asc()))
+
+
+class KeysetListMixin:
+    """
+    list для больших таблиц: ?after=<timestamp>,<id>&limit=N - keyset-пагинация
+    по keyset_field (ответ {"results": [...], "next": курсор}), ?stream=1 - потоковый
+    JSON. Без этих параметров список отдаётся как раньше.
+    Фильтры: параметры из filter_fields и диапазон ?date_from/?date_to по keyset_field.
+    """
+    keyset_field = None
+    # параметр запроса -> поле модели для фильтра по точному совпадению
+    filter_fields = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        params = self.request.query_params
+        filters = {field: params[param] for param, field in self.filter_fields.items() if params.get(param)}
+        for field, value in filters.items():
+            if field.endswith('_id') and not value.isdigit():
+                raise ValidationError({field: 'Ожидается целое число.'})
+        date_from, date_to = parse_date_range(self.request)
+        if date_from is not None:
+            filters[f'{self.keyset_field}__gte'] = date_from
+        if date_to is not None:
+            filters[f'{self.keyset_field}__lt'] = date_to
+        return queryset.filter(**filters)
+
+    def list(self, request, *args, **kwargs):
+        stream = is_stream_requested(request)
+        if not stream and not is_keyset_requested(request):
+            return super().list(request, *args, **kwargs)
+
+        after, limit = keyset_params(request)
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        page = KeysetPage(
+            keyset(self.filter_queryset(self.get_queryset()), self.keyset_field, after), self.keyset_field, limit,
+            lambda obj: serializer_class(obj, context=context).data,
+        )
+        if not stream:
+            return Response({'results': list(page), 'next': page.next_cursor()})
+        if limit is None:
+            return streaming_json_response(iter_json_array(page))
+        return streaming_json_response(iter_json_object([('results', page), ('next', page.next_cursor)]))
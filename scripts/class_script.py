@@ -14,34 +14,21 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gamefication.settings')
 django.setup()
 
 # Import necessary models
-from main.models import Classifications, Request, Employee, FilePath
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from main.achievement_engine import enqueue_events
+from main.classification_tree import upsert_classification_paths
+from main.config import get_config
+from main.models import Classifications, Request, Employee, FilePath, \
+    AchievementEvent, EmployeeStats
 
-# Кэш для классификаций
-classification_cache = {}
+# Размер пачки для bulk_create и проверки существующих номеров
+BULK_CHUNK_SIZE = 1000
 
 
 def add_classification_levels(classification_string):
-    """Кэшируем классификации для ускорения процесса."""
-    levels = [level.strip() for level in classification_string.split('->')]
-    parent = None
-    cache_key = '->'.join(levels)
-
-
-    if cache_key in classification_cache:
-        return classification_cache[cache_key]
-
-    for level in levels:
-
-        obj = Classifications.objects.filter(name=level, parent=parent).first()
-        if obj:
-            print(f"Найдена существующая классификация: {obj}")
-        else:
-            print(f"Создаём новую классификацию: '{level}' с родителем: '{parent}'")
-            obj = Classifications.objects.create(name=level, parent=parent)
-        parent = obj
-
-    classification_cache[cache_key] = parent
-    return parent
+    """Находит классификацию "A->B->C" по снимку дерева, недостающие уровни создаёт."""
+    return upsert_classification_paths([classification_string])[classification_string]
 
 
 def is_classification(value):
@@ -90,6 +77,116 @@ def add_request(number, date, description, classification, initiator, responsibl
         print(f"Failed to create Request with number {number}: {e}")
         return None
 
+def load_employee_map():
+    """Словарь (имя, фамилия) -> сотрудник одним запросом (первый по id, как filter().first())."""
+    employees = {}
+    for employee in Employee.objects.order_by('pk'):
+        employees.setdefault((employee.first_name, employee.last_name), employee)
+    return employees
+
+
+def load_existing_numbers(numbers):
+    existing = set()
+    numbers = list(numbers)
+    for start in range(0, len(numbers), BULK_CHUNK_SIZE):
+        chunk = numbers[start:start + BULK_CHUNK_SIZE]
+        existing.update(Request.objects.filter(number__in=chunk).values_list('number', flat=True))
+    return existing
+
+
+def insert_requests(chunk):
+    """
+    Вставляет пачку обращений одной транзакцией и возвращает реально вставленные.
+    Если номера успела занять параллельная загрузка, пачка откатывается и
+    вставляется повторно без занятых номеров.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                Request.objects.bulk_create(chunk)
+            return chunk
+        except IntegrityError:
+            taken = load_existing_numbers(request.number for request in chunk)
+            print(f"Обращения уже загружены параллельно и будут пропущены: {', '.join(sorted(taken))}")
+            chunk = [request for request in chunk if request.number not in taken]
+            if not chunk:
+                return []
+    print(f"Не удалось загрузить пачку обращений ({len(chunk)}) из-за конфликта номеров")
+    return []
+
+
+def bulk_add_requests(requests):
+    """
+    Массовое создание обращений. Вместо save() на каждое обращение (и четырёх
+    post_save-обработчиков) обращения вставляются пачками через bulk_create,
+    а их последствия применяются агрегированно по каждому оператору:
+    сложность считается в памяти, опыт начисляется одной записью,
+    события достижений ставятся в очередь одним bulk_create.
+    Начисления делаются только за обращения, которые вставил этот вызов.
+    """
+    existing_numbers = load_existing_numbers(request.number for request in requests)
+    config = get_config()
+    multipliers = config.multipliers
+    thresholds = config.complexity_thresholds
+
+    candidates = []
+    seen_numbers = set()
+    experience_by_number = {}
+    for request in requests:
+        if request.number in existing_numbers or request.number in seen_numbers:
+            print(f"Request with number {request.number} already exists. Skipping.")
+            continue
+        seen_numbers.add(request.number)
+
+        experience_points = request.calculate_experience(
+            multipliers.get("operator_responsible_multiplier"),
+            multipliers.get("massive_request_multiplier"),
+        )
+        if experience_points:
+            request.computed_complexity = request.compute_complexity(experience_points, thresholds)
+            experience_by_number[request.number] = experience_points
+        candidates.append(request)
+
+    new_requests = []
+    for start in range(0, len(candidates), BULK_CHUNK_SIZE):
+        new_requests += insert_requests(candidates[start:start + BULK_CHUNK_SIZE])
+
+    experience_by_operator = defaultdict(float)
+    requests_by_operator = defaultdict(int)
+    requests_for_stats = defaultdict(list)
+    operators = {}
+    for request in new_requests:
+        operator_id = request.support_operator.pk
+        operators[operator_id] = request.support_operator
+        requests_for_stats[operator_id].append(request)
+        if request.number in experience_by_number:
+            experience_by_operator[operator_id] += experience_by_number[request.number]
+            requests_by_operator[operator_id] += 1
+
+    for operator_id, operator_requests in requests_for_stats.items():
+        try:
+            EmployeeStats.register_requests(operators[operator_id], operator_requests)
+        except Exception as e:
+            print(f"Не удалось обновить статистику сотрудника {operators[operator_id]}: {e}")
+
+    for operator_id, experience_points in experience_by_operator.items():
+        operator = operators[operator_id]
+        try:
+            with transaction.atomic():
+                operator.add_experience(
+                    round(experience_points),
+                    source=f"За {requests_by_operator[operator_id]} обращений из выгрузки"
+                )
+        except Exception as e:
+            print(f"Не удалось начислить опыт сотруднику {operator}: {e}")
+
+    enqueue_events([
+        (request.support_operator, AchievementEvent.REQUEST, request.number)
+        for request in new_requests
+    ])
+    return new_requests
+
+
 def is_fio(value):
     """Проверка, является ли значение ФИО."""
     if not isinstance(value, str):
@@ -119,7 +216,7 @@ def find_column_positions(df):
 
     return initiator_col, responsible_col, status_col
 
-def run_classification_script(file_path, file_path_entry=None):
+def run_classification_script(file_path, file_path_entry=None, bulk=True):
     try:
         if not os.path.exists(file_path):
             raise ValueError(f"Файл {file_path} не найден")
@@ -135,22 +232,34 @@ def run_classification_script(file_path, file_path_entry=None):
         classification = None  # Инициализируем переменную классификации
         requests_to_create = []
         total_requests = 0  # Счётчик успешных запросов
+        employees = load_employee_map()
+
+        # Колонки как списки: итерация по ним намного быстрее df.iterrows()
+        first_column = df[df.columns[0]].tolist()
+        initiators = df[initiator_col].tolist()
+        responsibles = df[responsible_col].tolist()
+        statuses = df[status_col].tolist()
 
-        for index, row in df.iterrows():
-            value = row[df.columns[0]]
+        # Все классификации файла находим или создаём одним пакетом
+        classifications = upsert_classification_paths(
+            {value for value in first_column if pd.notna(value) and not is_fio(value) and is_classification(value)}
+        )
+        print(f"Классификаций в файле: {len(classifications)}")
+
+        for index, value in enumerate(first_column):
             if pd.notna(value):
                 if is_fio(value):
                     full_name = value.strip()
                     parts = full_name.split()
                     if len(parts) >= 2:
                         first_name, last_name = parts[1], parts[0]
-                        support_operator = Employee.objects.filter(first_name=first_name, last_name=last_name).first()
+                        support_operator = employees.get((first_name, last_name))
                         if support_operator:
                             print(f"Найден сотрудник: {support_operator}")
                         else:
                             print(f"Сотрудник '{full_name}' не найден.")
                 elif is_classification(value):
-                    classification = add_classification_levels(value)
+                    classification = classifications[value]
                     print(f"Установлена классификация: {classification}")
                 elif "Обращение" in str(value):
                     match = re.match(r"Обращение (\d+) от (\d{2}\.\d{2}\.\d{4} \d{1,2}:\d{2}:\d{2})", str(value))
@@ -160,18 +269,34 @@ def run_classification_script(file_path, file_path_entry=None):
                         date = datetime.strptime(date_str, '%d.%m.%Y %H:%M:%S')
                         date = pytz.UTC.localize(date)  # Добавление часового пояса, если необходимо
 
-                        description = df.iloc[index + 1, 0] if index + 1 < len(df) else ''
-                        initiator = row[initiator_col]
-                        responsible = row[responsible_col]
-                        status = row[status_col]
+                        description = first_column[index + 1] if index + 1 < len(first_column) else ''
+                        initiator = initiators[index]
+                        responsible = responsibles[index]
+                        status = statuses[index]
 
                         if classification and pd.notna(initiator) and pd.notna(responsible) and support_operator:
+                            if bulk:
+                                requests_to_create.append(Request(
+                                    number=number,
+                                    classification=classification,
+                                    responsible=responsible,
+                                    support_operator=support_operator,
+                                    status=status,
+                                    description=description,
+                                    initiator=initiator,
+                                    date=date,
+                                    is_massive=is_massive_file
+                                ))
+                                continue
                             new_request = add_request(number, date, description, classification, initiator,
                                                       responsible, support_operator, status, is_massive_file)
                             if new_request:
                                 requests_to_create.append(new_request)
                                 total_requests += 1
                                 print(f"Запрос создан: {new_request}")
+
+        if bulk:
+            total_requests = len(bulk_add_requests(requests_to_create))
         print(f"Успешно создано {total_requests} запросов")
 
         if file_path_entry:
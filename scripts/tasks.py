@@ -1,10 +1,15 @@
 import os
+from collections import defaultdict
 from datetime import datetime, timedelta, time
+import numpy as np
 import pandas as pd
 import re
 import calendar
+from django.db import transaction
 from django.utils import timezone
-from main.models import Employee, FilePath, KarmaHistory, KarmaSettings, ShiftHistory
+from main.achievement_engine import enqueue_event
+from main.config import get_config
+from main.models import Employee, FilePath, KarmaHistory, ShiftHistory, EmployeeStats, AchievementEvent
 
 
 def get_file_path(name):
@@ -17,6 +22,7 @@ def get_file_path(name):
 
 
 def process_work_schedule(file_path):
+    # Книга читается один раз: update_employee_karma использует результат этой функции
     df = pd.read_excel(file_path)
 
     # Находим начало таблицы (где находится заголовок "ФИО")
@@ -99,10 +105,69 @@ def time_str_to_time_obj(time_str):
     return datetime.strptime(time_str.strip(), '%H:%M').time()
 
 
+def late_penalty_levels(start_diff):
+    """Векторный аналог determine_late_penalty_level для массива опозданий в минутах."""
+    return np.select(
+        [start_diff <= 5, start_diff <= 10, start_diff <= 20, start_diff <= 30],
+        [1, 2, 3, 4],
+        default=5,
+    )
+
+
+def parse_shift_cells(df, day_columns):
+    """
+    Разворачивает таблицу графика (строка - сотрудник, столбец - день) в длинную таблицу смен
+    и разбирает ячейки векторными строковыми операциями.
+    Ячейка имеет вид "...;ЧЧ:ММ-ЧЧ:ММ;...;ЧЧ:ММ-ЧЧ:ММ": во второй части - плановое время, в четвёртой - фактическое.
+    """
+    columns = {column_name: day for day, column_name in day_columns if column_name is not None}
+    shifts = df[['ФИО'] + list(columns)].melt(id_vars='ФИО', var_name='column', value_name='shift_info')
+    shifts['day'] = shifts['column'].map(columns)
+
+    # ФИО должно состоять ровно из трёх слов: фамилия, имя, отчество
+    names = shifts['ФИО'].where(shifts['ФИО'].map(type) == str).str.split()
+    shifts = shifts[names.str.len() == 3]
+    names = names[shifts.index]
+    shifts['last_name'] = names.str[0]
+    shifts['first_name'] = names.str[1]
+
+    # Берём только текстовые ячейки, пропускаем выходные и пустые
+    shifts = shifts[shifts['shift_info'].map(type) == str]
+    text = shifts['shift_info']
+    has_time = text.str.contains(r'\d{1,2}:\d{2}', regex=True)
+    day_off = text.str.lower().str.contains('выходной|о|бс|б', regex=True) & ~has_time
+    shifts = shifts[~day_off & (text != '')]
+
+    parts = shifts['shift_info'].str.split(r'\n|;', regex=True)
+    shifts = shifts[parts.str.len() >= 4]
+    parts = parts[shifts.index]
+
+    def to_time(values):
+        return pd.to_datetime(values.str.strip(), format='%H:%M', errors='coerce')
+
+    scheduled = parts.str[1].str.split('-')
+    actual = parts.str[3].str.split('-')
+    valid = (scheduled.str.len() == 2) & (actual.str.len() == 2)
+    scheduled_start, scheduled_end = to_time(scheduled.str[0]), to_time(scheduled.str[1])
+    actual_start, actual_end = to_time(actual.str[0]), to_time(actual.str[1])
+    valid &= scheduled_start.notna() & scheduled_end.notna() & actual_start.notna() & actual_end.notna()
+
+    shifts = shifts[valid].copy()
+    scheduled_start, actual_start = scheduled_start[valid], actual_start[valid]
+    start_diff = (actual_start - scheduled_start).dt.total_seconds() / 60.0
+    shifts['late'] = start_diff > 0
+    shifts['late_level'] = np.where(shifts['late'], late_penalty_levels(start_diff), 0)
+    shifts['scheduled_start'] = scheduled_start.dt.time
+    shifts['scheduled_end'] = scheduled_end[valid].dt.time
+    shifts['actual_start'] = actual_start.dt.time
+    shifts['actual_end'] = actual_end[valid].dt.time
+    return shifts[['last_name', 'first_name', 'day', 'scheduled_start', 'scheduled_end',
+                   'actual_start', 'actual_end', 'late', 'late_level']].sort_values('day', kind='stable')
+
+
 # Ваш скрипт для обновления кармы и опыта
 
 def update_employee_karma(file_path):
-    df = pd.read_excel(file_path)
     filename = os.path.basename(file_path)
     file_date = extract_date_from_filename(filename)
     if not file_date:
@@ -125,139 +190,116 @@ def update_employee_karma(file_path):
         else:
             day_columns.append((day, None))  # Если столбца нет
 
-    for index, row in df.iterrows():
-        try:
-            full_name = row['ФИО']
-            if pd.isna(full_name) or len(str(full_name).split()) < 3:
-                print(f"Пропуск строки с некорректным ФИО: {full_name}")
-                continue
+    shifts = parse_shift_cells(df, day_columns)
+    print(f"Найдено смен в графике: {len(shifts)}")
+    load_shifts(shifts, file_date)
 
-            last_name, first_name, middle_name = full_name.split()
-            print(f"Обработка {full_name} ({first_name} {last_name})")
 
-            employees = Employee.objects.filter(first_name=first_name, last_name=last_name)
+def load_shifts(shifts, file_date):
+    """
+    Сохраняет смены из таблицы parse_shift_cells за месяц file_date и начисляет
+    карму и опыт сотрудникам, найденным по имени и фамилии из графика.
+    """
+    number_of_days = calendar.monthrange(file_date.year, file_date.month)[1]
 
-            if not employees.exists():
-                print(f"Сотрудник с именем {full_name} не существует.")
+    # Сотрудники одним запросом; одному ФИО может соответствовать несколько сотрудников.
+    # Фильтр по именам и фамилиям по отдельности находит и их сочетания, которых нет в графике,
+    # поэтому оставляем только пары (имя, фамилия) из файла
+    names = set(zip(shifts['first_name'], shifts['last_name']))
+    employees_by_name = defaultdict(list)
+    for employee in Employee.objects.filter(first_name__in={first_name for first_name, _ in names},
+                                            last_name__in={last_name for _, last_name in names}):
+        if (employee.first_name, employee.last_name) in names:
+            employees_by_name[(employee.first_name, employee.last_name)].append(employee)
+    employees = [employee for group in employees_by_name.values() for employee in group]
+
+    # Настройки кармы из кеша конфигурации
+    config = get_config()
+    shift_completion = config.first_karma_setting('shift_completion')
+    late_penalties = config.karma_settings_by_level('late_penalty')
+
+    # Уже загруженные смены за месяц - вместо exists() на каждую ячейку
+    month_start = datetime(file_date.year, file_date.month, 1).date()
+    month_end = datetime(file_date.year, file_date.month, number_of_days).date()
+    existing = set(ShiftHistory.objects.filter(
+        employee__in=employees, date__range=(month_start, month_end)
+    ).values_list('employee_id', 'date', 'scheduled_start', 'scheduled_end'))
+
+    new_shifts = defaultdict(list)
+    for row in shifts.itertuples(index=False):
+        shift_date = datetime(file_date.year, file_date.month, row.day).date()
+        for employee in employees_by_name.get((row.first_name, row.last_name), []):
+            key = (employee.id, shift_date, row.scheduled_start, row.scheduled_end)
+            if key in existing:
+                print(f"Запись ShiftHistory уже существует для {row.last_name} {row.first_name} на {shift_date}. Пропуск начислений.")
                 continue
-
-            for employee in employees:
-                print(f"Сотрудник: {employee.id}, Имя: {employee.first_name} {employee.last_name}")
-
-                for day, column_name in day_columns:
-                    if column_name is None:
-                        print(f"Нет данных для дня {day}")
-                        continue
-
-                    shift_info = row.get(column_name, '')
-
-                    # Проверка типа данных
-                    if isinstance(shift_info, int):
-                        print(f"Ошибка в данных для дня {day}: целое число {shift_info}")
-                        continue
-
-                    print(f"Данные для дня {day}: {shift_info}")
-
-                    # Проверка на выходные или специальные пометки
-                    if isinstance(shift_info, str) and any(x in shift_info.lower() for x in ['выходной', 'о', 'бс', 'б']) and not re.search(r'\d{1,2}:\d{2}', shift_info):
-                        print(f"Пропуск смены для {full_name} в {file_date.year}-{file_date.month:02}-{day:02} (выходной)")
-                        continue
-
-                    if not shift_info or shift_info == '':
-                        print(f"Пустые данные для {file_date.year}-{file_date.month:02}-{day:02}: '{shift_info}'")
-                        continue
-
-                    parts = re.split(r'\n|;', shift_info)
-
-                    if len(parts) < 4:
-                        print(f"Неполные данные для {file_date.year}-{file_date.month:02}-{day:02}: {parts}")
-                        continue
-
-                    scheduled_time = parts[1]
-                    actual_time = parts[3]
-                    print(f"Запланированное время: {scheduled_time}, Фактическое время: {actual_time}")
-
-                    try:
-                        # Парсинг времени начала и окончания
-                        scheduled_start, scheduled_end = map(time_str_to_time_obj, scheduled_time.split('-'))
-                        actual_start, actual_end = map(time_str_to_time_obj, actual_time.split('-'))
-                    except ValueError as e:
-                        print(f"Ошибка преобразования времени для {file_date.year}-{file_date.month:02}-{day:02}: {e}")
-                        continue
-
-                    # Проверка фактического времени и начисление/штраф кармы
-                    is_on_time, late_level = check_work_time(scheduled_start, scheduled_end, actual_start,
-                                                                      actual_end)
-                    print(f"Проверка: is_on_time={is_on_time}, late_level={late_level}")
-
-                    shift_date = datetime(file_date.year, file_date.month, day).date()
-
-                    # Проверка, есть ли уже запись в ShiftHistory
-                    if ShiftHistory.objects.filter(
-                            employee=employee,
-                            date=shift_date,
-                            scheduled_start=scheduled_start,
-                            scheduled_end=scheduled_end
-                    ).exists():
-                        print(
-                            f"Запись ShiftHistory уже существует для {full_name} на {shift_date}. Пропуск начислений.")
-                        continue  # Пропускаем, так как запись уже существует
-
-                    print(f"Добавление новой записи в ShiftHistory для {full_name} на {shift_date}")
-                    shift_record = ShiftHistory.objects.create(
-                        employee=employee,
-                        date=shift_date,
-                        scheduled_start=scheduled_start,
-                        scheduled_end=scheduled_end,
-                        actual_start=actual_start,
-                        actual_end=actual_end,
-                        karma_change=0,
-                        experience_change=0,
-                        late=(not is_on_time)  # Устанавливаем флаг late в зависимости от результата проверки
-                    )
-
-                    if is_on_time:
-                        try:
-                            settings = KarmaSettings.objects.get(operation_type='shift_completion')
-                            shift_record.karma_change = settings.karma_change
-                            shift_record.experience_change = settings.experience_change
-                            employee.add_karma(settings.karma_change, source=f"Смена {shift_date}, Опоздание: Нет")
-                            employee.add_experience(settings.experience_change,
-                                                    source=f"Смена {shift_date}, Опоздание: Нет")
-                            print(
-                                f"Карма и опыт начислены: Карма = {settings.karma_change}, Опыт = {settings.experience_change}")
-                        except KarmaSettings.DoesNotExist:
-                            print("Настройки для правильного выполнения смены не найдены")
-                            shift_record.karma_change = 0
-                            shift_record.experience_change = 0
-                    else:
-                        try:
-                            settings = KarmaSettings.objects.get(operation_type='late_penalty', level=late_level)
-                            shift_record.karma_change = -settings.karma_change
-                            shift_record.experience_change = 0  # Устанавливаем опыт в 0 при опоздании
-                            employee.add_karma(-settings.karma_change,
-                                               source=f"Смена {shift_date}, Опоздание уровень {late_level}")
-                            print(f"Штраф за опоздание: Карма уменьшена на {settings.karma_change}")
-                        except KarmaSettings.DoesNotExist:
-                            print("Настройки для штрафа за опоздание не найдены")
-                            shift_record.karma_change = 0
-
-                    # Сохраняем изменения в ShiftHistory и сотруднике
-                    shift_record.save()
-                    employee.save()
-
-                    print(
-                        f"Карма и опыт сохранены для {employee.first_name} {employee.last_name}: Карма = {employee.karma}, Опыт = {employee.experience}")
-
-                # Обновление последней даты изменения кармы
-                employee.last_karma_update = timezone.make_aware(datetime.combine(file_date, time.min))
-                employee.save()
-                print(f"Дата последнего обновления кармы обновлена для {employee.first_name} {employee.last_name}: {employee.last_karma_update}")
-
-        except Employee.DoesNotExist:
-            print(f"Сотрудник с именем {full_name} не существует.")
+            existing.add(key)
+
+            if not row.late:
+                setting = shift_completion
+                karma_change = setting.karma_change or 0 if setting else 0
+                experience_change = setting.experience_change or 0 if setting else 0
+            else:
+                setting = late_penalties.get(row.late_level)
+                karma_change = -(setting.karma_change or 0) if setting else 0
+                experience_change = 0  # Опыт при опоздании не начисляется
+            if setting is None:
+                print(f"Настройки кармы для смены {shift_date} (опоздание: {row.late_level}) не найдены")
+
+            new_shifts[employee.id].append(ShiftHistory(
+                employee=employee,
+                date=shift_date,
+                scheduled_start=row.scheduled_start,
+                scheduled_end=row.scheduled_end,
+                actual_start=row.actual_start,
+                actual_end=row.actual_end,
+                karma_change=karma_change,
+                experience_change=experience_change,
+                late=bool(row.late),
+            ))
+
+    ShiftHistory.objects.bulk_create(
+        [shift for employee_shifts in new_shifts.values() for shift in employee_shifts],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+    # Начисления применяем одной записью на сотрудника
+    month_label = f"{file_date.month:02}.{file_date.year}"
+    for employee in employees:
+        employee_shifts = new_shifts.get(employee.id)
+        if not employee_shifts:
+            continue
+        try:
+            with transaction.atomic():
+                EmployeeStats.register_shifts(employee, employee_shifts)
+                enqueue_event(employee, AchievementEvent.SHIFT)
+
+                if not employee.is_active:
+                    print(f"Сотрудник {employee} деактивирован, начисления за смены пропущены")
+                    continue
+
+                # Карма ограничена диапазоном 0..100 после каждой смены, поэтому итог считаем последовательно
+                karma = employee.karma
+                for shift in employee_shifts:
+                    karma = min(100, max(0, karma + shift.karma_change))
+                late_count = sum(1 for shift in employee_shifts if shift.late)
+                source = f"График {month_label}: смен {len(employee_shifts)}, опозданий {late_count}"
+
+                if karma != employee.karma:
+                    employee.add_karma(karma - employee.karma, source=source)
+                experience = sum(shift.experience_change for shift in employee_shifts)
+                if experience:
+                    employee.add_experience(experience, source=source)
+                print(f"Карма и опыт сохранены для {employee.first_name} {employee.last_name}: Карма = {employee.karma}, Опыт = {employee.experience}")
         except Exception as e:
-            print(f"Ошибка при обработке {full_name}: {e}")
+            print(f"Ошибка при обработке {employee.last_name} {employee.first_name}: {e}")
+
+    # Обновление последней даты изменения кармы
+    Employee.objects.filter(pk__in=[employee.pk for employee in employees]).update(
+        last_karma_update=timezone.make_aware(datetime.combine(file_date, time.min))
+    )
+    print(f"Загружено смен: {sum(len(employee_shifts) for employee_shifts in new_shifts.values())}")
 
 
 def run_update_karma(name):